@@ -0,0 +1,76 @@
+from threading import Condition
+
+
+class AdmissionController(object):
+
+    """ Limits how many requests a handler works on at once
+
+    Requests beyond `max_in_flight` wait in a queue of at most `queue_depth`
+    requests for up to `queue_timeout` seconds. Anything that does not fit in
+    the queue, or is not given a slot in time, is shed.
+    """
+
+    def __init__(self, max_in_flight=0, queue_depth=0, queue_timeout=0):
+        """ Create a new admission controller
+
+        Args:
+            max_in_flight (int): The most requests to work on at once, 0 for
+                no limit
+            queue_depth (int): How many requests may wait for a slot
+            queue_timeout (float): How many seconds a request may wait for a
+                slot before being shed
+        """
+        self.max_in_flight = max_in_flight
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self._condition = Condition()
+        self._in_flight = 0
+        self._queued = 0
+        self._admitted = 0
+        self._shed = 0
+
+    def acquire(self):
+        """ Try to admit a request
+
+        Returns:
+            admitted (bool): True if the request may go ahead, in which case
+                `release` must be called once it is done. False if the
+                request was shed
+        """
+        with self._condition:
+            if self._has_slot():
+                return self._admit()
+            if self._queued < self.queue_depth:
+                self._queued += 1
+                try:
+                    if self._condition.wait_for(
+                            self._has_slot, self.queue_timeout):
+                        return self._admit()
+                finally:
+                    self._queued -= 1
+            self._shed += 1
+            return False
+
+    def release(self):
+        """ Free the slot of an admitted request """
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def stats(self):
+        """ Get the current and total counts of admitted and shed requests """
+        with self._condition:
+            return {
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'admitted': self._admitted,
+                'shed': self._shed,
+            }
+
+    def _has_slot(self):
+        return not self.max_in_flight or self._in_flight < self.max_in_flight
+
+    def _admit(self):
+        self._in_flight += 1
+        self._admitted += 1
+        return True
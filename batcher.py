@@ -0,0 +1,86 @@
+from threading import Lock
+from time import monotonic
+
+from nio.modules.scheduler import Job
+
+
+class SignalBatcher(object):
+
+    """ Collects request signals and notifies them as a single list
+
+    A batch is flushed as soon as it holds `max_size` signals, or once
+    `window` has elapsed since the first signal of the batch arrived,
+    whichever comes first. The time a batch is notified is recorded in the
+    request info added with each of its signals, so that the time a signal
+    spent waiting in a batch counts as queue time.
+    """
+
+    def __init__(self, notify, max_size, window):
+        """ Create a new batcher
+
+        Args:
+            notify (callable): Called with the list of batched signals
+            max_size (int): The most signals to hold in a single batch
+            window (timedelta): How long to hold a partial batch
+        """
+        self._notify = notify
+        self._max_size = max_size
+        self._window = window
+        self._pending = []
+        self._infos = []
+        self._generation = 0
+        self._job = None
+        self._lock = Lock()
+
+    def add(self, signal, request_info=None):
+        """ Add a signal to the current batch, flushing it if it is full
+
+        Args:
+            signal (Signal): The signal to notify
+            request_info (dict): The broker's info for the signal's request,
+                the time the batch is notified is set as its `notified`
+        """
+        with self._lock:
+            self._pending.append(signal)
+            if request_info is not None:
+                self._infos.append(request_info)
+            if len(self._pending) < self._max_size:
+                if self._job is None:
+                    self._job = Job(self._flush_window, self._window, False,
+                                    self._generation)
+                return
+            batch, infos = self._take()
+        self._notify_batch(batch, infos)
+
+    def flush(self):
+        """ Notify any pending signals right away """
+        with self._lock:
+            batch, infos = self._take()
+        if batch:
+            self._notify_batch(batch, infos)
+
+    def _flush_window(self, generation):
+        with self._lock:
+            # The batch this job was scheduled for has already been flushed
+            if generation != self._generation:
+                return
+            batch, infos = self._take()
+        if batch:
+            self._notify_batch(batch, infos)
+
+    def _notify_batch(self, batch, infos):
+        notified = monotonic()
+        for request_info in infos:
+            request_info['notified'] = notified
+        self._notify(batch)
+
+    def _take(self):
+        """ Take the pending batch and the request infos of its signals and
+        reset state, caller holds the lock """
+        batch, self._pending = self._pending, []
+        infos, self._infos = self._infos, []
+        self._generation += 1
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        return batch, infos
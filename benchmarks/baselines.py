@@ -0,0 +1,65 @@
+""" Saved benchmark results to compare new runs against
+
+Baselines are kept in `baselines.json` next to this module, keyed by
+benchmark and case. They depend on the machine they were recorded on, so
+record them again on the machine that runs the comparison by setting
+`BENCH_UPDATE_BASELINES=1`.
+"""
+import json
+import os
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+def load_baselines(path=BASELINES_PATH):
+    try:
+        with open(path) as baselines:
+            return json.load(baselines)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(benchmark, case, result, path=BASELINES_PATH):
+    """ Save the result of one case, keeping the rest of the baselines """
+    baselines = load_baselines(path)
+    baselines.setdefault(benchmark, {})[case] = result
+    with open(path, 'w') as out:
+        json.dump(baselines, out, indent=2, sort_keys=True)
+        out.write('\n')
+
+
+def updating_baselines():
+    return os.environ.get('BENCH_UPDATE_BASELINES') == '1'
+
+
+def compare(result, baseline, tolerance, margins=None):
+    """ Find the results that regressed from a baseline
+
+    Args:
+        result (dict): The results of a run, higher is better for keys
+            ending in `_per_sec` and lower is better for the rest
+        baseline (dict): The saved results to compare with
+        tolerance (float): The fraction a result may be worse by, such as
+            0.2 for 20%
+        margins (dict): An amount by name that a result may be worse by on
+            top of the tolerance, for results whose baseline may be 0
+
+    Returns:
+        regressions (list): A message for each result that got worse by
+            more than the tolerance
+    """
+    margins = margins or {}
+    regressions = []
+    for name, expected in sorted(baseline.items()):
+        actual = result.get(name)
+        if actual is None or expected is None:
+            continue
+        margin = margins.get(name, 0)
+        if name.endswith('_per_sec'):
+            worse = actual < expected * (1 - tolerance) - margin
+        else:
+            worse = actual > expected * (1 + tolerance) + margin
+        if worse:
+            regressions.append("{} was {:.4g}, the baseline is {:.4g}".format(
+                name, actual, expected))
+    return regressions
@@ -0,0 +1,98 @@
+""" Benchmark broker register/write/expire throughput under many threads
+
+Run from the directory containing this block collection, e.g.
+
+    python -m web_handler.benchmarks.bench_broker --threads 32
+
+Each worker thread registers requests and either writes a response to them
+or lets them expire, the same way handler and output threads use the broker.
+Results are reported for a single-lock registry alongside the lock-striped
+default so the effect of striping is visible on the machine at hand.
+"""
+import argparse
+from threading import Barrier, Thread
+from time import monotonic
+
+from ..broker import RequestResponseBroker
+
+
+class _Response(object):
+
+    """ A response that discards everything written to it """
+
+    def set_body(self, body):
+        pass
+
+    def set_header(self, name, value):
+        pass
+
+    def set_status(self, status):
+        pass
+
+
+def _run_workers(threads, target):
+    barrier = Barrier(threads + 1)
+    workers = [Thread(target=target, args=(index, barrier))
+               for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = monotonic()
+    for worker in workers:
+        worker.join()
+    return monotonic() - start
+
+
+def bench_register_write(broker, threads, requests):
+    """ Register requests and write a response to each of them """
+    rsp = _Response()
+
+    def work(index, barrier):
+        barrier.wait()
+        for count in range(requests):
+            req_id = (index, count)
+            broker.register_request(req_id, None, rsp, 60)
+            broker.write_response(req_id, body='body')
+
+    return _run_workers(threads, work)
+
+
+def bench_expire(broker, threads, requests):
+    """ Register requests that are all expired by the timing wheel """
+    rsp = _Response()
+
+    def work(index, barrier):
+        barrier.wait()
+        for count in range(requests):
+            broker.register_request((index, count), None, rsp, 0)
+
+    elapsed = _run_workers(threads, work)
+    start = monotonic()
+    while len(broker._registry):
+        RequestResponseBroker._wheel.advance()
+    return elapsed + monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=5000,
+                        help='Requests per thread')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 64])
+    args = parser.parse_args()
+
+    total = args.threads * args.requests
+    print("{} threads, {} requests per thread".format(
+        args.threads, args.requests))
+    print("{:>8} {:>22} {:>22}".format(
+        'shards', 'register+write req/s', 'register+expire req/s'))
+    for shards in args.shards:
+        broker = RequestResponseBroker('bench', shards=shards)
+        write_time = bench_register_write(broker, args.threads, args.requests)
+        expire_time = bench_expire(broker, args.threads, args.requests)
+        print("{:>8} {:>22.0f} {:>22.0f}".format(
+            shards, total / write_time, total / expire_time))
+
+
+if __name__ == '__main__':
+    main()
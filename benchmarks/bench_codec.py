@@ -0,0 +1,67 @@
+""" Benchmark JSON decoding and encoding with every installed codec
+
+Run from the directory containing this block collection, e.g.
+
+    python -m web_handler.benchmarks.bench_codec
+
+Payloads of increasing size are decoded, the way WebJSONHandler parses a
+request body, and encoded to bytes, the way WebJSONOutput writes a response.
+"""
+import argparse
+from timeit import Timer
+
+from ..codec import JSONCodecType, get_codec, StdlibCodec
+
+
+def build_payload(records):
+    """ A body of `records` records shaped like a typical API object """
+    return {
+        'records': [{
+            'id': index,
+            'name': 'record {}'.format(index),
+            'active': index % 2 == 0,
+            'score': index * 1.5,
+            'tags': ['alpha', 'beta', 'gamma'],
+            'location': {'lat': 39.7392, 'lng': -104.9903},
+        } for index in range(records)]
+    }
+
+
+def time_call(func, min_time=0.2):
+    """ The mean seconds per call of func """
+    number, elapsed = Timer(func).autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = Timer(func).timeit(number)
+    return elapsed / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, nargs='+',
+                        default=[1, 10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    codecs = []
+    for codec_type in JSONCodecType:
+        codec = get_codec(codec_type)
+        # Skip auto, and codecs that are not installed and fell back
+        if codec.name == codec_type.value:
+            codecs.append(codec)
+
+    print("{:>8} {:>10} {:>10} {:>14} {:>14}".format(
+        'records', 'bytes', 'codec', 'decode MB/s', 'encode MB/s'))
+    for records in args.records:
+        payload = build_payload(records)
+        encoded = StdlibCodec().dumps(payload)
+        size_mb = len(encoded) / 1e6
+        for codec in codecs:
+            decode = time_call(lambda: codec.loads(encoded))
+            encode = time_call(lambda: codec.dumps(payload))
+            print("{:>8} {:>10} {:>10} {:>14.1f} {:>14.1f}".format(
+                records, len(encoded), codec.name,
+                size_mb / decode, size_mb / encode))
+
+
+if __name__ == '__main__':
+    main()
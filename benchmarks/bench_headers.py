@@ -0,0 +1,63 @@
+""" Compare building response headers per signal with precompiled headers
+
+Run from the directory containing this block collection, e.g.
+
+    python -m unittest web_handler.benchmarks.bench_headers
+
+The same WebJSONOutput configuration is timed building its headers the way
+every header used to be evaluated for every signal, and through the
+precompiled path that only evaluates headers containing expressions.
+"""
+from timeit import timeit
+
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..web_output_block import WebJSONOutput
+
+STATIC_HEADERS = [
+    {'header_name': 'Cache-Control', 'header_val': 'no-cache'},
+    {'header_name': 'X-Frame-Options', 'header_val': 'DENY'},
+    {'header_name': 'X-Content-Type-Options', 'header_val': 'nosniff'},
+]
+DYNAMIC_HEADER = {'header_name': 'X-Request', 'header_val': '{{ $_id }}'}
+
+
+class HeaderBenchmark(NIOBlockTestCase):
+
+    iterations = 20000
+
+    def evaluate_every_header(self, blk, signal):
+        """ Build headers the way they were built before precompiling """
+        headers = {
+            header.header_name(signal): header.header_val(signal)
+            for header in blk.response_headers()
+        }
+        if 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/json'
+        return headers
+
+    def run_config(self, name, headers):
+        blk = WebJSONOutput()
+        self.configure_block(blk, {'response_headers': headers})
+        signal = Signal({'_id': 'request', 'value': 1})
+        self.assertDictEqual(dict(blk.build_headers(signal)),
+                             self.evaluate_every_header(blk, signal))
+
+        per_signal = timeit(lambda: self.evaluate_every_header(blk, signal),
+                            number=self.iterations)
+        precompiled = timeit(lambda: blk.build_headers(signal),
+                             number=self.iterations)
+        print("{:<24} {:>10.2f}us {:>10.2f}us {:>8.1f}x".format(
+            name,
+            per_signal / self.iterations * 1e6,
+            precompiled / self.iterations * 1e6,
+            per_signal / precompiled))
+
+    def test_header_paths(self):
+        print("\n{:<24} {:>12} {:>12} {:>9}".format(
+            'headers', 'per signal', 'precompiled', 'speedup'))
+        self.run_config('3 static', STATIC_HEADERS)
+        self.run_config('3 static, 1 dynamic',
+                        STATIC_HEADERS + [DYNAMIC_HEADER])
+        self.run_config('1 dynamic', [DYNAMIC_HEADER])
@@ -0,0 +1,49 @@
+""" Compare WebJSONOutput response bodies from an expression and directly
+
+Run from the directory containing this block collection, e.g.
+
+    python -m unittest web_handler.benchmarks.bench_json_output
+
+Signals shaped like WebJSONHandler output are turned into response bodies
+through the default `response_out` expression, and with `serialize_signal`
+enabled, which encodes the signal without the expression engine.
+"""
+from timeit import timeit
+
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..web_output_block import WebJSONOutput
+
+
+class JSONOutputBenchmark(NIOBlockTestCase):
+
+    iterations = 5000
+
+    def build_signal(self, fields):
+        signal = Signal({
+            'field_{}'.format(index): 'value {}'.format(index)
+            for index in range(fields)
+        })
+        signal._id = 'request'
+        signal._method = 'POST'
+        signal._params = {}
+        signal._headers = {'Content-Type': 'application/json'}
+        return signal
+
+    def time_body(self, serialize_signal, signal):
+        blk = WebJSONOutput()
+        self.configure_block(blk, {'serialize_signal': serialize_signal})
+        return timeit(lambda: blk.build_body(signal),
+                      number=self.iterations) / self.iterations
+
+    def test_body_paths(self):
+        print("\n{:>8} {:>14} {:>14} {:>9}".format(
+            'fields', 'expression', 'serialize', 'speedup'))
+        for fields in [1, 10, 100]:
+            signal = self.build_signal(fields)
+            expression = self.time_body(False, signal)
+            serialize = self.time_body(True, signal)
+            print("{:>8} {:>12.2f}us {:>12.2f}us {:>8.1f}x".format(
+                fields, expression * 1e6, serialize * 1e6,
+                expression / serialize))
@@ -0,0 +1,224 @@
+""" Load test requests through a handler block to an output block and back
+
+Run from the directory containing this block collection, e.g.
+
+    python -m unittest web_handler.benchmarks.bench_round_trip
+
+A handler block serves a local port and its signals are passed straight to
+an output block, for both the plain and the JSON blocks. Worker threads make
+requests over keep-alive connections at each concurrency and payload size,
+and the requests per second, p50 and p99 latency, growth in resident memory
+and the number of threads other than the workers are reported.
+
+Set these environment variables to change the load:
+
+    BENCH_CONCURRENCY     Comma separated worker counts, default 1,8,32
+    BENCH_PAYLOAD_SIZES   Comma separated body sizes in bytes, default 64,4096
+    BENCH_REQUESTS        Requests per worker, default 200
+    BENCH_TOLERANCE       How much worse than its baseline a result may be
+                          before the benchmark fails, default 0.25
+
+Every result is compared with `baselines.json`, set
+`BENCH_UPDATE_BASELINES=1` to record new baselines instead. Cases without a
+baseline are reported and not compared.
+"""
+import gc
+import json
+import os
+from http.client import HTTPConnection
+from threading import Barrier, Thread, active_count
+from time import monotonic
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..web_handler_block import WebHandler, WebJSONHandler
+from ..web_output_block import WebOutput, WebJSONOutput
+from .baselines import compare, load_baselines, save_baseline, \
+    updating_baselines
+
+
+def _env_ints(name, default):
+    value = os.environ.get(name)
+    return [int(item) for item in value.split(',')] if value else default
+
+
+def _rss_kb():
+    """ The current resident memory of the process in KB, None if unknown
+
+    The peak from `getrusage` never goes down, so once one case sets it
+    later cases would show no growth. The current size is read from
+    /proc instead, which only Linux has.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RoundTripBenchmark(NIOBlockTestCase):
+
+    host = '127.0.0.1'
+    port = 8189
+    concurrency = _env_ints('BENCH_CONCURRENCY', [1, 8, 32])
+    payload_sizes = _env_ints('BENCH_PAYLOAD_SIZES', [64, 4096])
+    requests = _env_ints('BENCH_REQUESTS', [200])[0]
+    tolerance = float(os.environ.get('BENCH_TOLERANCE', 0.25))
+    # The results saved as baselines and compared with them
+    compared = ('requests_per_sec', 'p50_ms', 'p99_ms', 'memory_growth_kb',
+                'threads')
+    # How much worse than its baseline a result may be on top of the
+    # tolerance, so that results with a baseline near 0 can be compared
+    margins = {'memory_growth_kb': 1024, 'threads': 2}
+
+    def get_test_modules(self):
+        return super().get_test_modules() | {'web'}
+
+    def setUp(self):
+        super().setUp()
+        self.handler_block = None
+        self.output_block = None
+
+    def tearDown(self):
+        self.stop_blocks()
+        super().tearDown()
+
+    def signals_notified(self, block, signals, output_id):
+        # Pass the request signals straight through to the output block
+        if block is self.handler_block:
+            self.output_block.process_signals(signals)
+
+    def start_blocks(self, handler_block, handler_config, output_block,
+                     output_config):
+        self.handler_block = handler_block
+        self.output_block = output_block
+        self.configure_block(self.handler_block, dict(
+            handler_config, host=self.host, port=self.port,
+            request_timeout={'seconds': 30}))
+        self.configure_block(self.output_block, output_config)
+        self.output_block.start()
+        self.handler_block.start()
+
+    def stop_blocks(self):
+        if self.handler_block is not None:
+            self.handler_block.stop()
+            self.output_block.stop()
+            self.handler_block = self.output_block = None
+
+    def load(self, method, body, headers, concurrency):
+        """ Make requests from worker threads and time each of them
+
+        Returns:
+            result (dict): The measurements of the run
+        """
+        latencies = []
+        errors = []
+        barrier = Barrier(concurrency + 1)
+
+        def work():
+            connection = HTTPConnection(self.host, self.port, timeout=30)
+            times = []
+            barrier.wait()
+            try:
+                for _ in range(self.requests):
+                    start = monotonic()
+                    connection.request(method, '/', body, headers)
+                    response = connection.getresponse()
+                    response.read()
+                    times.append(monotonic() - start)
+                    if response.status != 200:
+                        errors.append(response.status)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+                latencies.extend(times)
+
+        workers = [Thread(target=work) for _ in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        gc.collect()
+        rss_before = _rss_kb()
+        barrier.wait()
+        start = monotonic()
+        # Leave out the worker threads, so only the blocks' threads count
+        threads = active_count() - concurrency
+        for worker in workers:
+            worker.join()
+        elapsed = monotonic() - start
+        rss_after = _rss_kb()
+
+        self.assertFalse(errors, "{} requests failed, the first with "
+                         "{!r}".format(len(errors), errors[0] if errors
+                                       else None))
+        latencies.sort()
+        return {
+            'requests_per_sec': len(latencies) / elapsed,
+            'p50_ms': _percentile(latencies, 0.5) * 1000,
+            'p99_ms': _percentile(latencies, 0.99) * 1000,
+            'memory_growth_kb': None if rss_before is None or
+            rss_after is None else rss_after - rss_before,
+            'threads': threads,
+        }
+
+    def run_cases(self, benchmark, method, build_body, headers):
+        baselines = load_baselines().get(benchmark, {})
+        regressions = []
+        print("\n{}".format(benchmark))
+        print("{:>12} {:>8} {:>10} {:>10} {:>10} {:>12} {:>8}".format(
+            'concurrency', 'payload', 'req/s', 'p50 ms', 'p99 ms',
+            'memory KB', 'threads'))
+        for payload_size in self.payload_sizes:
+            body = build_body(payload_size)
+            for concurrency in self.concurrency:
+                result = self.load(method, body, headers, concurrency)
+                print("{:>12} {:>8} {:>10.0f} {:>10.2f} {:>10.2f} {:>12} "
+                      "{:>8}".format(
+                          concurrency, payload_size,
+                          result['requests_per_sec'], result['p50_ms'],
+                          result['p99_ms'], result['memory_growth_kb'],
+                          result['threads']))
+                case = 'c{}_b{}'.format(concurrency, payload_size)
+                if updating_baselines():
+                    save_baseline(benchmark, case, {
+                        name: result[name] for name in self.compared})
+                elif case in baselines:
+                    regressions.extend(
+                        '{} {}: {}'.format(benchmark, case, message)
+                        for message in compare(
+                            result, baselines[case], self.tolerance,
+                            self.margins))
+                else:
+                    print("{} {} has no baseline, set "
+                          "BENCH_UPDATE_BASELINES=1 to record one".format(
+                              benchmark, case))
+        self.assertFalse(regressions, '\n'.join(regressions))
+
+    def test_round_trip(self):
+        self.start_blocks(WebHandler(), {}, WebOutput(), {
+            'response_out': '{{ $body }}',
+        })
+        self.run_cases('round_trip', 'POST', lambda size: b'x' * size,
+                       {'Content-Type': 'text/plain'})
+
+    def test_json_round_trip(self):
+        self.start_blocks(WebJSONHandler(), {}, WebJSONOutput(), {
+            'serialize_signal': True,
+        })
+
+        def build_body(size):
+            # Records of about 64 bytes each, to make up the payload size
+            records = max(1, size // 64)
+            return json.dumps({'records': [{
+                'id': index,
+                'name': 'record {}'.format(index),
+                'tags': ['alpha', 'beta'],
+            } for index in range(records)]}).encode()
+
+        self.run_cases('json_round_trip', 'POST', build_body,
+                       {'Content-Type': 'application/json'})
@@ -0,0 +1,197 @@
+import zlib
+from tempfile import SpooledTemporaryFile
+
+from .headers import get_header
+
+# How much to read from a file-like body at a time
+CHUNK_SIZE = 64 * 1024
+# Spooled bodies are kept in memory up to this size, then moved to disk
+SPOOL_MEMORY_SIZE = 1024 * 1024
+
+
+class BodyError(ValueError):
+
+    """ Raised when a request body can not be read
+
+    The status is the HTTP status to answer the request with.
+    """
+
+    status = 400
+
+
+class BodyTooLarge(BodyError):
+
+    """ Raised when a request body is over the configured size limit """
+
+    status = 413
+
+    def __init__(self, max_size):
+        super().__init__(
+            "The request body is larger than {} bytes".format(max_size))
+        self.max_size = max_size
+
+
+class UnsupportedEncoding(BodyError):
+
+    """ Raised when a request body has a Content-Encoding we can't decode """
+
+    status = 415
+
+
+def declared_length(req):
+    """ The Content-Length of a request, or None if it is not known """
+    length = get_header(getattr(req, '_headers', None), 'Content-Length')
+    try:
+        return int(length)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_declared_length(req, max_size):
+    """ Reject a request by its Content-Length before reading the body
+
+    Raises:
+        BodyTooLarge: If the declared length is over max_size
+    """
+    length = declared_length(req)
+    if max_size and length is not None and length > max_size:
+        raise BodyTooLarge(max_size)
+
+
+def iter_chunks(body, chunk_size=CHUNK_SIZE):
+    """ Yield a body in chunks, whether it is file-like, bytes or str """
+    if hasattr(body, 'read'):
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    elif body:
+        if isinstance(body, str):
+            body = body.encode()
+        body = memoryview(body)
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+
+def read_body(req, max_size=0):
+    """ Read the whole body of a request, enforcing a size limit
+
+    Args:
+        req: The nio.modules.web.http.Request to read
+        max_size (int): The most bytes to accept, 0 for no limit
+
+    Returns:
+        body: The body as the web engine provided it, file-like bodies are
+            read into bytes
+
+    Raises:
+        BodyTooLarge: If the body is over max_size
+    """
+    check_declared_length(req, max_size)
+    body = req.get_body()
+    if hasattr(body, 'read'):
+        chunks = []
+        size = 0
+        for chunk in iter_chunks(body):
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise BodyTooLarge(max_size)
+            chunks.append(chunk)
+        return b''.join(chunks)
+    if max_size and body and len(body) > max_size:
+        raise BodyTooLarge(max_size)
+    return body
+
+
+def spool_body(req, max_size=0):
+    """ Copy the body of a request into a spooled temporary file
+
+    The body is copied a chunk at a time. Small bodies stay in memory and
+    larger ones are moved to disk, so downstream blocks can read a body of
+    any size without holding all of it.
+
+    Args:
+        req: The nio.modules.web.http.Request to read
+        max_size (int): The most bytes to accept, 0 for no limit
+
+    Returns:
+        body (SpooledTemporaryFile): The body, rewound to the start
+
+    Raises:
+        BodyTooLarge: If the body is over max_size
+    """
+    check_declared_length(req, max_size)
+    spooled = SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+    size = 0
+    try:
+        for chunk in iter_chunks(req.get_body()):
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise BodyTooLarge(max_size)
+            spooled.write(chunk)
+    except:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
+
+
+def _decompress(body, wbits, max_size):
+    decompressor = zlib.decompressobj(wbits)
+    chunks = []
+    size = 0
+    for chunk in iter_chunks(body):
+        while chunk:
+            # Never inflate more than a chunk at a time, so a small body
+            # can't expand to more than the limit in memory
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+            size += len(data)
+            if max_size and size > max_size:
+                raise BodyTooLarge(max_size)
+            chunks.append(data)
+            chunk = decompressor.unconsumed_tail
+    data = decompressor.flush()
+    size += len(data)
+    if max_size and size > max_size:
+        raise BodyTooLarge(max_size)
+    chunks.append(data)
+    if not decompressor.eof:
+        raise BodyError("The request body is truncated")
+    return b''.join(chunks)
+
+
+def decode_body(body, encoding, max_size=0):
+    """ Decompress a request body with a gzip or deflate Content-Encoding
+
+    Args:
+        body (bytes): The encoded body
+        encoding (str): The Content-Encoding header of the request
+        max_size (int): The most decompressed bytes to accept, 0 for no
+            limit
+
+    Returns:
+        body (bytes): The decoded body
+
+    Raises:
+        BodyTooLarge: If the decompressed body is over max_size
+        UnsupportedEncoding: If the encoding is not gzip or deflate
+        BodyError: If the body is not validly encoded
+    """
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return body
+    if encoding in ('gzip', 'x-gzip'):
+        wbits = [16 + zlib.MAX_WBITS]
+    elif encoding == 'deflate':
+        # Deflate should be zlib wrapped, but some clients send it raw
+        wbits = [zlib.MAX_WBITS, -zlib.MAX_WBITS]
+    else:
+        raise UnsupportedEncoding(
+            "The {} Content-Encoding is not supported".format(encoding))
+    for bits in wbits:
+        try:
+            return _decompress(body, bits, max_size)
+        except zlib.error:
+            continue
+    raise BodyError("The request body is not valid {}".format(encoding))
@@ -1,12 +1,170 @@
-from threading import Event
+import asyncio
+from collections import OrderedDict
+from itertools import count
+from threading import Event, Lock
+from time import monotonic
+
+from nio.util.logging import get_nio_logger
+
+from .etag import etag_matches
+from .expiry import TimingWheel
+from .headers import get_header, set_headers
+from .registry import ShardedRegistry
+from .stream import ChunkStream
+
+
+class BrokerCapacityError(RuntimeError):
+
+    """ Raised when a broker already holds its maximum pending requests """
+
+
+class RequestExpiredError(ValueError):
+
+    """ Raised when writing to a request that timed out a short while ago
+
+    Output blocks that are slower than the request timeout can expect these,
+    they do not need to be logged as errors.
+    """
 
 
 class RequestResponseBroker(object):
 
-    _mappings = {}
+    """ Saves pending requests so that responses can be written to them
+
+    Each handler block gets its own broker, or shares one with other blocks
+    in the same named group. Request IDs carry the key of the broker they
+    were registered with, so an output block can find the broker for any
+    request without searching every broker.
+
+    Pending requests are kept in a lock-striped registry. Finishing a request
+    always starts by atomically popping it from the registry, so a response
+    writer and the expiry of the request can never both finish it. Timeouts
+    are enforced by a shared timing wheel rather than by the waiting thread,
+    and the timing wheel writes the timeout responses too. The IDs of
+    expired requests are remembered for a while, so that late writes to
+    them fail with a RequestExpiredError.
+    """
+
+    # Separates the broker key from the rest of a request ID
+    id_separator = '.'
+
+    _groups = {}
+    _brokers = {}
+    _groups_lock = Lock()
+    _keys = count(1)
+    # The broker for request IDs that do not carry a broker key
+    _default = None
+
+    # How long a waiting thread gives the timing wheel to expire its request
+    # before expiring it itself
+    _expiry_grace = 1
+
+    # How long, and how many, expired request IDs are remembered for
+    tombstone_ttl = 60
+    max_tombstones = 10000
+
+    _wheel = TimingWheel(lambda keys: RequestResponseBroker._expire_keys(keys))
+
+    def __init__(self, name, max_requests=0, shards=64):
+        """ Create a new broker, use `get_group` to share brokers by name
+
+        Args:
+            name (str): The name of the broker, used in logs and stats
+            max_requests (int): The most requests that may be pending at
+                once, 0 for no limit
+            shards (int): The number of shards to split pending requests over
+        """
+        self.name = name
+        self.key = format(next(self._keys), 'x')
+        self.logger = get_nio_logger("RequestResponseBroker")
+        self.max_requests = max_requests
+        self._registry = ShardedRegistry(shards)
+        self._stats = {
+            'registered': 0,
+            'responded': 0,
+            'expired': 0,
+            'rejected': 0,
+            'late_writes': 0,
+        }
+        self._stats_lock = Lock()
+        # Guards starting a response stream against expiring its request
+        self._stream_lock = Lock()
+        # Guards collecting the parts of aggregated responses
+        self._parts_lock = Lock()
+        # The IDs of expired requests, with the time they expired
+        self._tombstones = OrderedDict()
+        self._tombstones_lock = Lock()
+        self._brokers[self.key] = self
 
     @classmethod
-    def register_request(cls, id, req, rsp, timeout):
+    def get_group(cls, name, max_requests=0):
+        """ Get the broker for a named group, creating it if needed
+
+        Args:
+            name (str): The name of the broker group
+            max_requests (int): The most requests that may be pending at
+                once in this group, 0 for no limit. This replaces the limit
+                of an existing group
+
+        Returns:
+            broker (RequestResponseBroker): The broker for the group
+        """
+        with cls._groups_lock:
+            broker = cls._groups.get(name)
+            if broker is None:
+                broker = cls(name, max_requests)
+                cls._groups[name] = broker
+            broker.max_requests = max_requests
+            return broker
+
+    @classmethod
+    def default(cls):
+        """ Get the broker used for request IDs without a broker key """
+        with cls._groups_lock:
+            if RequestResponseBroker._default is None:
+                RequestResponseBroker._default = RequestResponseBroker(
+                    'default')
+            return RequestResponseBroker._default
+
+    @classmethod
+    def for_request(cls, req_id):
+        """ Find the broker a request was registered with from its ID
+
+        Raises:
+            ValueError: If the ID refers to a broker that does not exist
+        """
+        key, sep, _ = str(req_id).partition(cls.id_separator)
+        if not sep:
+            return cls.default()
+        broker = cls._brokers.get(key)
+        if broker is None:
+            raise ValueError("The request ID {} has not been "
+                             "registered or has timed out".format(req_id))
+        return broker
+
+    def request_id(self, token):
+        """ Build a request ID for this broker from a unique token """
+        return self.key + self.id_separator + token
+
+    def stats(self):
+        """ Get the counts of requests that went through this broker
+
+        Returns:
+            stats (dict): Counts of registered, responded, expired and
+                rejected requests and of writes to expired ones, along with
+                the number of pending ones
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = len(self._registry)
+        stats['max_requests'] = self.max_requests
+        return stats
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self._stats[stat] += 1
+
+    def register_request(self, id, req, rsp, timeout):
         """ Register that a request has occurred by saving the relevant info
 
 
@@ -20,38 +178,183 @@ class RequestResponseBroker(object):
                 of time, a timeout error will be returned instead
 
         Returns:
-            None
+            info (dict): The saved information about the request, pass it
+                along when waiting for the response
+
+        Raises:
+            BrokerCapacityError: If the broker is already at its limit of
+                pending requests
+        """
+        return self._add_request(id, self._build_request_info(
+            req, rsp, timeout, Event()))
+
+    def _add_request(self, id, request_info):
+        # The pending count is not taken under a lock, so concurrent
+        # registrations may overshoot the limit by a few requests
+        if self.max_requests and len(self._registry) >= self.max_requests:
+            self._count('rejected')
+            raise BrokerCapacityError(
+                "Broker {} already has {} pending requests".format(
+                    self.name, self.max_requests))
+        self._registry.add(id, request_info)
+        self._wheel.schedule((self, id), request_info['timeout'])
+        self._count('registered')
+        return request_info
+
+    @staticmethod
+    def _build_request_info(req, rsp, timeout, event):
+        """ Build the saved info for a request.
+
+        The event can be anything with a `set` method, it will be set once
+        the response has been written or the request has expired. The
+        monotonic times the request was registered and responded to are
+        saved in it as well. The handler may add a `vary` with the `Vary`
+        header it already set, the response's `Vary` is merged with it.
         """
-        req_event = Event()
-        cls._mappings[id] = {
+        return {
             'req': req,
             'rsp': rsp,
             'timeout': timeout,
-            'event': req_event
+            'event': event,
+            'expired': False,
+            'registered': monotonic(),
         }
 
-    @classmethod
-    def wait_for_response(cls, req_id):
+    def expect_parts(self, id, count):
+        """ Set how many parts make up the aggregated response to a request
+
+        Requests expect a single part unless told otherwise.
+
+        Raises:
+            ValueError: If the ID is invalid or already timed out
+        """
+        self.get_request_info(id)['parts_expected'] = count
+
+    def add_part(self, id, part, final=False):
+        """ Collect one part of an aggregated response for a request ID
+
+        Args:
+            id: The same ID of the original request
+            part: The part of the response, such as one encoded record
+            final (bool): True to finish the response with this part even
+                if fewer parts than expected have been added
+
+        Returns:
+            parts (list): Every part in the order they were added once the
+                response is complete, otherwise None. The caller should then
+                write the response
+
+        Raises:
+            ValueError: If the ID is invalid, already timed out or already
+                complete
+        """
+        request_info = self.get_request_info(id)
+        with self._parts_lock:
+            parts = request_info.setdefault('parts', [])
+            if request_info.get('parts_complete'):
+                raise ValueError("The response for request ID {} is "
+                                 "already complete".format(id))
+            parts.append(part)
+            if not final and \
+                    len(parts) < request_info.get('parts_expected', 1):
+                return None
+            request_info['parts_complete'] = True
+            return parts
+
+    def wait_for_response(self, req_id, request_info=None):
         """ Wait for a response for a given request ID
 
         Note, this method will block the current thread until the response
         is written or the timeout has occurred.
 
+        Args:
+            req_id: The ID the request was registered with
+            request_info (dict): The info returned when registering. Pass it
+                if the response may already have been written, since writing
+                a response removes the request from the registry
+
         Returns:
             None
         """
-        request_info = cls.get_request_info(req_id)
+        if request_info is None:
+            request_info = self.get_request_info(req_id)
 
-        # Wait for this request's event to be set by a response writer
-        if not request_info['event'].wait(request_info['timeout']):
-            # We timed out, write an error to the response
-            cls.write_timeout_error(request_info['rsp'])
+        # Wait for this request's event to be set by a response writer or
+        # by the expiry of the request
+        if not request_info['event'].wait(
+                request_info['timeout'] + self._expiry_grace):
+            # The timing wheel fell behind, expire the request ourselves. If
+            # a writer claimed it in the meantime this waits for the write
+            self._expire(req_id)
+            request_info['event'].wait()
 
-        # We're done with this ID, clean it up from the mappings
-        del cls._mappings[req_id]
+    @staticmethod
+    def _expire_keys(keys):
+        """ Expire requests scheduled on the timing wheel """
+        for broker, req_id in keys:
+            try:
+                broker._expire(req_id)
+            except Exception:
+                # Keep expiring the rest of the requests
+                broker.logger.exception(
+                    "Unable to expire request %s of broker %s",
+                    req_id, broker.name)
 
-    @classmethod
-    def get_request_info(cls, id):
+    def _expire(self, req_id):
+        """ Expire a request if it is still pending
+
+        Requests with a response stream only expire once no chunk has been
+        written to them for their timeout. Other requests get a timeout
+        error written to their response before their waiter is woken up.
+        """
+        with self._stream_lock:
+            request_info = self._registry.get(req_id)
+            if request_info is None:
+                return
+            stream = request_info.get('stream')
+            if stream and not stream.idle_for(request_info['timeout']):
+                self._wheel.schedule((self, req_id), request_info['timeout'])
+                return
+            request_info = self._registry.pop(req_id)
+        if request_info is None:
+            return
+        self._count('expired')
+        self._bury(req_id)
+        if stream:
+            # The response has started, so abort it for the client to see
+            stream.fail()
+            return
+        request_info['expired'] = True
+        try:
+            self.write_timeout_error(request_info['rsp'])
+        finally:
+            request_info['event'].set()
+
+    def _bury(self, req_id):
+        """ Remember that a request expired, forgetting the oldest ones """
+        now = monotonic()
+        with self._tombstones_lock:
+            self._tombstones[req_id] = now
+            while self._tombstones:
+                oldest = next(iter(self._tombstones.values()))
+                if len(self._tombstones) <= self.max_tombstones and \
+                        oldest > now - self.tombstone_ttl:
+                    break
+                self._tombstones.popitem(last=False)
+
+    def _not_found(self, id):
+        """ The error for writing to a request that is not pending """
+        with self._tombstones_lock:
+            expired_at = self._tombstones.get(id)
+        if expired_at is not None and \
+                expired_at > monotonic() - self.tombstone_ttl:
+            self._count('late_writes')
+            return RequestExpiredError(
+                "The request ID {} has timed out".format(id))
+        return ValueError("The request ID {} has not been "
+                          "registered or has timed out".format(id))
+
+    def get_request_info(self, id):
         """ Get the request info for a given request ID.
 
         Returns:
@@ -60,23 +363,21 @@ class RequestResponseBroker(object):
         Raises:
             ValueError: If the ID is invalid or already timed out
         """
-        if id not in cls._mappings:
-            raise ValueError("The request ID {} has not been "
-                             "registered or has timed out".format(id))
+        request_info = self._registry.get(id)
+        if request_info is None:
+            raise self._not_found(id)
 
-        return cls._mappings[id]
+        return request_info
 
-    @classmethod
-    def write_timeout_error(cls, rsp):
+    def write_timeout_error(self, rsp):
         """ Build a response indicating that the request timed out """
         rsp.set_status(504)
         rsp.set_body("The service did not respond in time")
 
-    @classmethod
-    def write_response(cls, id, status=200, body=None, headers=None):
+    def write_response(self, id, status=200, body=None, headers=None):
         """ Write to the saved response object for a given request ID.
 
-        This method will look up the cached response information, write to it,
+        This method will claim the cached response information, write to it,
         and set the event indicating to the original thread that the response
         is ready to be returned.
 
@@ -85,19 +386,193 @@ class RequestResponseBroker(object):
             status (int): The HTTP status to return - 200 by default
             body (str, bytes): The body of the response to return. None or ''
                 for no body on the response at all
-            headers (dict): Dictionary containing response headers
+            headers (dict): Dictionary containing response headers. A 200
+                response with an ETag header matching the If-None-Match
+                header of the request is written as a 304 with no body
 
         Raises:
-            ValueError: If the ID is invalid or already timed out
+            ValueError: If the ID is invalid, already timed out or already
+                responded to
         """
-        request_info = cls.get_request_info(id)
+        request_info = self._registry.pop(id)
+        if request_info is None:
+            raise self._not_found(id)
+        stream = request_info.get('stream')
+        if stream:
+            # The response is already being streamed, end it with this body
+            try:
+                stream.put(body)
+            finally:
+                stream.close()
+            return
         rsp = request_info['rsp']
+        # Keep what was written so the handler can reuse the response
+        request_info['response'] = (status, body, headers)
+        if status == 200 and self._not_modified(request_info['req'], headers):
+            # The client already has this response
+            status, body = 304, None
+
+        try:
+            if body:
+                rsp.set_body(body)
+            if headers:
+                set_headers(rsp, headers, request_info.get('vary'))
+            rsp.set_status(status)
+        finally:
+            request_info['responded'] = monotonic()
+            self._count('responded')
+            request_info['event'].set()
+
+    @staticmethod
+    def _not_modified(req, headers):
+        """ Whether the request's If-None-Match matches the response ETag """
+        if not headers:
+            return False
+        if_none_match = get_header(
+            getattr(req, '_headers', None), 'If-None-Match')
+        return if_none_match is not None and etag_matches(
+            if_none_match, get_header(headers, 'ETag'))
+
+    def write_chunk(self, id, chunk, final=False, status=200, headers=None):
+        """ Write part of a streamed response for a given request ID.
+
+        The first chunk for a request starts a stream as the response body,
+        along with the status and headers, and lets the original thread
+        return so the web engine starts sending the response. Later chunks
+        are added to the stream until one is marked final. This needs a web
+        engine that sends iterable bodies as they are iterated.
+
+        Args:
+            id: The same ID of the original request
+            chunk (str, bytes): The next part of the response body
+            final (bool): True if this is the last chunk of the response
+            status (int): The HTTP status to return, used by the first chunk
+            headers (dict): Response headers, used by the first chunk
+
+        Raises:
+            ValueError: If the ID is invalid, already timed out or already
+                responded to, or if the client stopped reading the stream
+        """
+        request_info = self.get_request_info(id)
+        stream = request_info.get('stream')
+        started = False
+        if stream is None:
+            with self._stream_lock:
+                if self._registry.get(id) is not request_info:
+                    raise self._not_found(id)
+                stream = request_info.get('stream')
+                if stream is None:
+                    stream = ChunkStream(request_info['timeout'])
+                    request_info['stream'] = stream
+                    started = True
+
+        if started:
+            rsp = request_info['rsp']
+            try:
+                if headers:
+                    set_headers(rsp, headers, request_info.get('vary'))
+                rsp.set_status(status)
+                rsp.set_body(stream)
+            finally:
+                request_info['responded'] = monotonic()
+                self._count('responded')
+                request_info['event'].set()
+
+        if final:
+            self._registry.pop(id)
+            try:
+                stream.put(chunk)
+            finally:
+                stream.close()
+        else:
+            stream.put(chunk)
+
+
+class _FutureWaiter(object):
+
+    """ An Event-like object that resolves an asyncio future when set.
 
-        if body:
-            rsp.set_body(body)
-        if headers:
-            for name, val in headers.items():
-                rsp.set_header(name, val)
-        rsp.set_status(status)
+    Setting the waiter is safe from any thread, the future is resolved on
+    the thread running its event loop.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        self._loop.call_soon_threadsafe(self._resolve)
+
+    def is_set(self):
+        return self.future.done()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AsyncRequestResponseBroker(RequestResponseBroker):
+
+    """ A broker that suspends waiting requests without holding a thread.
+
+    Requests are registered and written to with the same API as the
+    threaded broker, so WebOutput blocks do not need to know which one a
+    handler uses. Waiting is done by awaiting `wait_for_response` from a
+    coroutine running on the event loop the request was registered with,
+    which lets one loop thread keep any number of requests in flight.
+    """
+
+    def register_request(self, id, req, rsp, timeout, loop=None):
+        """ Register a request to be waited on from an event loop
+
+        Args:
+            id: A unique identifier for this request. This same ID should be
+                passed when the response is written
+            req: The original nio.modules.web.http.Request object
+            rsp: The nio.modules.web.http.Response object to write to
+            timeout (float): The total number of seconds to wait for a response
+                to be written. If a response is not written in this amount
+                of time, a timeout error will be returned instead
+            loop: The asyncio event loop that will wait for the response,
+                defaults to the running event loop, so it must be given
+                when this is not called from a coroutine
+
+        Returns:
+            info (dict): The saved information about the request, pass it
+                along when waiting for the response
+
+        Raises:
+            BrokerCapacityError: If the broker is already at its limit of
+                pending requests
+            RuntimeError: If no loop is given and no event loop is running
+        """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        return self._add_request(id, self._build_request_info(
+            req, rsp, timeout, _FutureWaiter(loop)))
+
+    async def wait_for_response(self, req_id, request_info=None):
+        """ Wait for a response for a given request ID
+
+        This is a coroutine, it suspends until the response is written or the
+        timeout has occurred without blocking the event loop.
+
+        Returns:
+            None
+        """
+        if request_info is None:
+            request_info = self.get_request_info(req_id)
 
-        request_info['event'].set()
+        # The future is resolved by a response writer or by the expiry of
+        # the request, both of which happen off of the event loop. It is
+        # shielded so that timing out the wait leaves it to be awaited again
+        future = request_info['event'].future
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(future),
+                request_info['timeout'] + self._expiry_grace)
+        except asyncio.TimeoutError:
+            # The timing wheel fell behind, expire the request ourselves. If
+            # a writer claimed it in the meantime this waits for the write
+            self._expire(req_id)
+            await future
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from threading import Event, Lock
+from time import monotonic
+
+from .headers import get_header
+
+
+class _Flight(object):
+
+    """ A request being fetched for every caller with the same cache key """
+
+    def __init__(self):
+        self._event = Event()
+        self.response = None
+
+    def finish(self, response):
+        self.response = response
+        self._event.set()
+
+    def wait(self, timeout):
+        """ Wait for the response, None if it could not be fetched """
+        self._event.wait(timeout)
+        return self.response
+
+
+class ResponseCache(object):
+
+    """ An LRU cache of responses that each expire after a fixed time
+
+    Responses are saved as (status, body, headers) tuples. Only one caller
+    at a time fetches the response for a key that is not cached. Callers
+    asking for the same key in the meantime wait for that response rather
+    than fetching it again.
+    """
+
+    def __init__(self, max_entries, ttl, params=None, headers=()):
+        """ Create a new cache
+
+        Args:
+            max_entries (int): The most responses to keep, the least
+                recently used one is evicted to make room for another
+            ttl (float): Seconds a response is kept for
+            params (list): The request params that make up the cache key,
+                None or empty for all of them
+            headers (list): The request headers that make up the cache key
+        """
+        self.max_entries = max_entries
+        self._ttl = ttl
+        self._params = tuple(params) if params else None
+        self._headers = tuple(headers)
+        # Compressed responses are only reused for the same Accept-Encoding
+        self._keyed_on_encoding = 'accept-encoding' in (
+            name.lower() for name in self._headers)
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = Lock()
+        self._stats = {
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'cache_coalesced': 0,
+            'cache_evictions': 0,
+        }
+
+    def key_for(self, method, path, params, headers):
+        """ Build the cache key of a request """
+        params = params or {}
+        if self._params is None:
+            param_values = tuple(
+                (name, str(params[name])) for name in sorted(params))
+        else:
+            param_values = tuple(
+                str(params.get(name)) for name in self._params)
+        header_values = tuple(
+            get_header(headers, name) for name in self._headers)
+        return method, path, param_values, header_values
+
+    def lookup(self, key):
+        """ Look up the response for a key
+
+        Returns:
+            (response, flight, leader): The cached response, or None along
+                with the flight fetching it. If leader is True the caller
+                must fetch the response and pass it to `finish`, otherwise
+                it can wait on the flight for another caller to do so
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, response = entry
+                if expires > monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['cache_hits'] += 1
+                    return response, None, False
+                del self._entries[key]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats['cache_coalesced'] += 1
+                return None, flight, False
+            self._stats['cache_misses'] += 1
+            flight = self._flights[key] = _Flight()
+            return None, flight, True
+
+    def peek(self, key):
+        """ The cached response for a key, without fetching it on a miss """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            return entry[1]
+        return None
+
+    def finish(self, key, flight, response):
+        """ Hand a fetched response to the callers waiting on it
+
+        Args:
+            key: The cache key of the request
+            flight: The flight returned from `lookup`
+            response (tuple): The (status, body, headers) of the response,
+                None if it could not be fetched. Only successful responses
+                with a str or bytes body are cached, and compressed ones
+                only if Accept-Encoding is part of the cache key. Responses
+                that are not cached aren't handed to the waiting callers
+                either, each of them fetches its own
+        """
+        if response is not None and not self._cacheable(response):
+            response = None
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if response is not None:
+                self._entries[key] = (monotonic() + self._ttl, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['cache_evictions'] += 1
+        flight.finish(response)
+
+    def _cacheable(self, response):
+        status, body, headers = response
+        if get_header(headers, 'Content-Encoding') and \
+                not self._keyed_on_encoding:
+            return False
+        return status == 200 and (
+            body is None or isinstance(body, (str, bytes)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cache_entries'] = len(self._entries)
+        return stats
@@ -0,0 +1,119 @@
+import json
+from enum import Enum
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+class JSONCodecType(Enum):
+    auto = 'auto'
+    stdlib = 'stdlib'
+    orjson = 'orjson'
+    ujson = 'ujson'
+    simdjson = 'simdjson'
+
+
+class StdlibCodec(object):
+
+    """ Encodes and decodes JSON with the standard library """
+
+    name = 'stdlib'
+
+    def loads(self, data):
+        """ Decode JSON from str or bytes """
+        return json.loads(data)
+
+    def dumps(self, obj):
+        """ Encode an object to JSON bytes, unknown types become strings """
+        return json.dumps(obj, default=str).encode()
+
+
+class OrjsonCodec(StdlibCodec):
+
+    """ Encodes and decodes JSON with orjson
+
+    Objects orjson can't encode, such as integers over 64 bits, are encoded
+    with the standard library instead. Some objects are still encoded
+    differently than by the standard library: datetimes are written in ISO
+    8601 format and NaN and infinite floats are written as null.
+    """
+
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(
+                obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().dumps(obj)
+
+
+class UjsonCodec(StdlibCodec):
+
+    """ Encodes and decodes JSON with ujson
+
+    Objects ujson can't encode, such as integers over 64 bits, are encoded
+    with the standard library instead.
+    """
+
+    name = 'ujson'
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(
+                obj, default=str, escape_forward_slashes=False).encode()
+        except (TypeError, ValueError, OverflowError):
+            return super().dumps(obj)
+
+
+class SimdjsonCodec(StdlibCodec):
+
+    """ Decodes with simdjson, which does not encode, and encodes with json """
+
+    name = 'simdjson'
+
+    def loads(self, data):
+        return simdjson.loads(data)
+
+
+# Codecs in order of preference, along with the module each one needs
+_CODECS = [
+    (JSONCodecType.orjson, OrjsonCodec, lambda: orjson),
+    (JSONCodecType.ujson, UjsonCodec, lambda: ujson),
+    (JSONCodecType.simdjson, SimdjsonCodec, lambda: simdjson),
+]
+
+
+def get_codec(codec_type=JSONCodecType.auto):
+    """ Get the codec for a type, falling back to stdlib if not installed
+
+    Args:
+        codec_type (JSONCodecType): The codec to use, `auto` picks the
+            fastest one that is installed
+
+    Returns:
+        codec: An object with `loads` and `dumps` methods. `dumps` returns
+            bytes
+    """
+    for candidate, codec_class, module in _CODECS:
+        if codec_type in (candidate, JSONCodecType.auto) and module():
+            return codec_class()
+    return StdlibCodec()
@@ -0,0 +1,134 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings in the order they are preferred when a client accepts several
+ENCODINGS = ('br', 'gzip', 'deflate')
+
+
+def available_encodings(names=None):
+    """ The supported encodings out of some names, in preference order
+
+    Brotli is only available if the brotli library is installed.
+    """
+    names = set(name.lower() for name in names) if names else set(ENCODINGS)
+    return tuple(encoding for encoding in ENCODINGS
+                 if encoding in names and (encoding != 'br' or brotli))
+
+
+def parse_accept_encoding(accept_encoding):
+    """ Parse an Accept-Encoding header into a dict of quality values """
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def negotiate(accept_encoding, encodings):
+    """ Choose an encoding for a response
+
+    Args:
+        accept_encoding (str): The Accept-Encoding header of the request
+        encodings (tuple): The encodings that may be used, most preferred
+            first
+
+    Returns:
+        encoding (str): The encoding to use, None to send the body as is
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    if not qualities:
+        return None
+    default = qualities.get('*', 0.0)
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding, level):
+    """ Compress bytes with an encoding at a level from 1 to 9 """
+    if encoding == 'gzip':
+        # Adding 16 to the window bits writes a gzip header and trailer
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+    if encoding == 'deflate':
+        return zlib.compress(body, level)
+    if encoding == 'br':
+        # Brotli qualities go from 0 to 11
+        return brotli.compress(body, quality=min(11, level + 2))
+    raise ValueError("Unsupported encoding {}".format(encoding))
+
+
+def encoded_headers(headers, encoding):
+    """ Copy response headers for a body compressed with an encoding """
+    headers = dict(headers or {})
+    headers['Content-Encoding'] = encoding
+    vary = headers.get('Vary')
+    headers['Vary'] = vary + ', Accept-Encoding' if vary else 'Accept-Encoding'
+    etag = headers.get('ETag')
+    if etag and etag.endswith('"'):
+        # The compressed body is a different representation of the resource
+        headers['ETag'] = etag[:-1] + '-' + encoding + '"'
+    return headers
+
+
+class Compressor(object):
+
+    """ Compresses response bodies with an encoding the client accepts """
+
+    def __init__(self, encodings=None, min_size=1024, level=6):
+        """ Create a new compressor
+
+        Args:
+            encodings (list): The encodings that may be used, all of the
+                available ones if empty
+            min_size (int): Bodies smaller than this many bytes are sent
+                as they are, compressing them costs more than it saves
+            level (int): The compression level, from 1 (fastest) to 9
+                (smallest)
+        """
+        self.encodings = available_encodings(encodings)
+        self.min_size = min_size
+        self.level = max(1, min(9, level))
+
+    def encode(self, body, headers, accept_encoding):
+        """ Compress a response body if the client accepts it
+
+        Args:
+            body (str, bytes): The response body
+            headers (dict): The response headers, these are not modified
+            accept_encoding (str): The Accept-Encoding header of the request
+
+        Returns:
+            (body, headers): The body and headers to send
+        """
+        if not isinstance(body, (str, bytes)) or len(body) < self.min_size:
+            return body, headers
+        if headers and 'Content-Encoding' in headers:
+            # The body is already encoded
+            return body, headers
+        encoding = negotiate(accept_encoding, self.encodings)
+        if encoding is None:
+            return body, headers
+        if isinstance(body, str):
+            body = body.encode()
+        return compress(body, encoding, self.level), \
+            encoded_headers(headers, encoding)
@@ -0,0 +1,73 @@
+import re
+
+from .headers import get_header
+
+
+def is_preflight(req):
+    """ Whether an OPTIONS request is a CORS preflight request """
+    return get_header(req._headers, 'Access-Control-Request-Method') \
+        is not None
+
+
+class OriginList(object):
+
+    """ The origins allowed to make cross-origin requests """
+
+    def __init__(self, origins=None, pattern=None):
+        """ Create a new origin list
+
+        Args:
+            origins (list): Origins that are allowed, such as
+                `https://app.local:3000`
+            pattern (str): A regular expression that matches the whole of
+                any other allowed origin
+        """
+        self._origins = frozenset(origins or ())
+        self._pattern = re.compile(pattern) if pattern else None
+
+    def __bool__(self):
+        return bool(self._origins) or self._pattern is not None
+
+    def allows(self, origin):
+        if not origin:
+            return False
+        if origin in self._origins:
+            return True
+        return self._pattern is not None and \
+            self._pattern.fullmatch(origin) is not None
+
+
+class CORSHeaders(object):
+
+    """ The CORS headers of a handler, built once for every response
+
+    Without an origin list the same headers go on every response. With one,
+    the `Origin` of a request is echoed back in `Access-Control-Allow-Origin`
+    if it is allowed, and `Vary: Origin` is added so caches keep the
+    responses to each origin apart.
+    """
+
+    def __init__(self, headers, origins=None):
+        """ Create the CORS headers of a handler
+
+        Args:
+            headers (dict): The CORS response headers
+            origins (OriginList): The origins that are allowed, None or empty
+                to send `Access-Control-Allow-Origin` as it is in headers
+        """
+        headers = dict(headers or {})
+        self._origins = origins or None
+        if self._origins is not None:
+            headers.pop('Access-Control-Allow-Origin', None)
+            self._denied = tuple(headers.items()) + (('Vary', 'Origin'),)
+        self._items = tuple(headers.items())
+
+    def items_for(self, req):
+        """ The (name, value) pairs of the headers for a request """
+        if self._origins is None:
+            return self._items
+        origin = get_header(req._headers, 'Origin')
+        if not self._origins.allows(origin):
+            return self._denied
+        return self._items + (
+            ('Access-Control-Allow-Origin', origin), ('Vary', 'Origin'))
@@ -0,0 +1,49 @@
+from enum import Enum
+from hashlib import blake2b
+
+
+class ETagSource(Enum):
+    none = 'none'
+    hash = 'hash'
+    expression = 'expression'
+
+
+def hash_etag(body):
+    """ Build a strong ETag from a hash of a response body
+
+    Returns:
+        etag (str): The quoted ETag, None if the body is not str or bytes
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    elif not isinstance(body, (bytes, bytearray, memoryview)):
+        return None
+    return '"' + blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def quote_etag(value):
+    """ Quote an ETag value unless it is already quoted """
+    value = str(value)
+    if value.startswith('"') or value.startswith('W/"'):
+        return value
+    return '"' + value + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """ Whether an If-None-Match header matches an ETag
+
+    ETags are compared weakly, as If-None-Match requires, so a weak and a
+    strong ETag with the same value match.
+    """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
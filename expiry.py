@@ -0,0 +1,99 @@
+from math import ceil
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from nio.util.logging import get_nio_logger
+
+
+class TimingWheel(object):
+
+    """ A hashed timing wheel that expires keys in bulk
+
+    Scheduling a key is O(1): it is appended to the slot for the tick its
+    deadline falls in. A single sweeper thread advances the wheel every
+    `resolution` seconds and hands all keys whose deadline has passed to
+    `on_expire` in one call. Keys that finished before their deadline are
+    not removed from the wheel, `on_expire` is expected to ignore them.
+    """
+
+    def __init__(self, on_expire, resolution=0.05, slots=512):
+        """ Create a new timing wheel
+
+        Args:
+            on_expire (callable): Called with a list of expired keys
+            resolution (float): The length of a tick in seconds, keys expire
+                at most this long after their deadline
+            slots (int): The number of slots on the wheel
+        """
+        self._on_expire = on_expire
+        self._resolution = resolution
+        self._slots = [[] for _ in range(slots)]
+        self._lock = Lock()
+        self._origin = monotonic()
+        self._tick = 0
+        self._thread = None
+        self._stop_event = Event()
+        self.logger = get_nio_logger("TimingWheel")
+
+    def schedule(self, key, delay):
+        """ Expire a key once `delay` seconds have passed """
+        deadline_tick = int(ceil(
+            (monotonic() + delay - self._origin) / self._resolution))
+        with self._lock:
+            # Never schedule into a slot that has already been swept
+            deadline_tick = max(deadline_tick, self._tick + 1)
+            self._slots[deadline_tick % len(self._slots)].append(
+                (deadline_tick, key))
+            if self._thread is None:
+                self._start()
+
+    def advance(self, now=None):
+        """ Sweep every tick up to `now` and expire the keys that are due
+
+        This is called by the sweeper thread, but may be called directly to
+        sweep the wheel synchronously.
+        """
+        if now is None:
+            now = monotonic()
+        current_tick = int((now - self._origin) / self._resolution)
+        expired = []
+        with self._lock:
+            while self._tick < current_tick:
+                self._tick += 1
+                slot_index = self._tick % len(self._slots)
+                slot = self._slots[slot_index]
+                if not slot:
+                    continue
+                # Entries in this slot that belong to a later lap stay put
+                remaining = []
+                for deadline_tick, key in slot:
+                    if deadline_tick <= self._tick:
+                        expired.append(key)
+                    else:
+                        remaining.append((deadline_tick, key))
+                self._slots[slot_index] = remaining
+        if expired:
+            self._on_expire(expired)
+        return expired
+
+    def stop(self):
+        """ Stop the sweeper thread, it is restarted on the next schedule """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            stop_event, self._stop_event = self._stop_event, Event()
+        stop_event.set()
+        if thread is not None:
+            thread.join()
+
+    def _start(self):
+        self._thread = Thread(target=self._run, args=(self._stop_event,),
+                              name="TimingWheel", daemon=True)
+        self._thread.start()
+
+    def _run(self, stop_event):
+        while not stop_event.wait(self._resolution):
+            try:
+                self.advance()
+            except Exception:
+                # A failing expiry callback must not stop the sweeper
+                self.logger.exception("Unable to expire keys")
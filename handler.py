@@ -1,69 +1,304 @@
-import json
-from uuid import uuid4
-from .broker import RequestResponseBroker
+from logging import DEBUG
+from time import monotonic
+
+from .body import BodyError, BodyTooLarge, check_declared_length, \
+    decode_body, read_body, spool_body
+from .broker import BrokerCapacityError
+from .codec import StdlibCodec
+from .cors import CORSHeaders, is_preflight
+from .etag import etag_matches
+from .headers import get_header, set_headers
+from .routes import request_path
+from .sse import SubscriberLimitError, accepts_event_stream
+from .views import select_headers
 from nio.signal.base import Signal
 from nio.modules.web import RESTHandler
 
 
+# Content types of newline delimited JSON bodies
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson',
+                'application/jsonl', 'application/x-jsonlines')
+
+
+def is_ndjson(req):
+    """ Whether a request body is newline delimited JSON """
+    content_type = get_header(req._headers, 'Content-Type')
+    return isinstance(content_type, str) and \
+        content_type.partition(';')[0].strip().lower() in NDJSON_TYPES
+
+
 class Handler(RESTHandler):
 
     """ A REST Handler that will listen for HTTP requests and register them """
 
-    def __init__(self, endpoint, blk, headers=None):
+    def __init__(self, endpoint, blk, headers=None, router=None,
+                 origins=None):
         super().__init__('/' + endpoint)
+        self._endpoint = endpoint
+        self._router = router
         self._blk = blk
         self.logger = blk.logger
-        self._headers = headers
+        self._headers = CORSHeaders(headers, origins) \
+            if headers or origins else None
 
     def on_get(self, req, rsp):
-        self.__add_headers(rsp)
+        if not self.validate_method('GET', rsp):
+            return
+        self.__add_headers(req, rsp)
+        if self._blk.accepts_subscriptions() and accepts_event_stream(req):
+            self.subscribe(rsp)
+            return
         self.run_request('GET', req, rsp, include_body=False)
 
     def on_post(self, req, rsp):
-        self.__add_headers(rsp)
+        if not self.validate_method('POST', rsp):
+            return
+        self.__add_headers(req, rsp)
         self.run_request('POST', req, rsp, include_body=True)
 
     def on_put(self, req, rsp):
-        self.__add_headers(rsp)
+        if not self.validate_method('PUT', rsp):
+            return
+        self.__add_headers(req, rsp)
         self.run_request('PUT', req, rsp, include_body=True)
 
     def on_delete(self, req, rsp):
-        self.__add_headers(rsp)
+        if not self.validate_method('DELETE', rsp):
+            return
+        self.__add_headers(req, rsp)
         self.run_request('DELETE', req, rsp, include_body=False)
 
     def on_options(self, req, rsp):
-        self.__add_headers(rsp)
+        """ Answer OPTIONS requests, such as CORS preflights, right away
+
+        Browsers cache preflight responses for as long as the CORS
+        `Access-Control-Max-Age` header allows.
+        """
+        rsp.set_header('Allow', self._blk.get_allowed_methods())
+        self.__add_headers(req, rsp)
+        if is_preflight(req):
+            rsp.set_status(204)
+
+    def on_head(self, req, rsp):
+        """ Answer HEAD requests without notifying a signal
+
+        The status and headers of a cached GET response are returned if
+        there is one, otherwise an empty 200.
+        """
+        if not self.validate_method('HEAD', rsp):
+            return
+        self.__add_headers(req, rsp)
+        if self._router is not None and \
+                self.validate_route('GET', req, rsp) is None:
+            return
+        cache = self._blk.get_response_cache()
+        response = cache.peek(self.cache_key(cache, 'GET', req)) \
+            if cache is not None else None
+        if response is not None:
+            status, _, headers = response
+            self.write_cached_response((status, None, headers), req, rsp)
+        else:
+            rsp.set_status(200)
+
+    def subscribe(self, rsp):
+        """ Hold the response open as an event stream for the client
+
+        The subscriber is the response body, so the web engine sends events
+        to the client as they are published to the block's channel. No
+        request ID is made and no signal is notified for subscriptions. Once
+        the channel has as many subscribers as it may, a 503 is sent instead.
+        """
+        self.logger.debug("Received event stream subscription")
+        try:
+            subscriber = self._blk.subscribe()
+        except SubscriberLimitError as e:
+            self.logger.warning("Refusing subscription: %s", e)
+            self.write_unavailable(rsp)
+            return
+        rsp.set_header('Content-Type', 'text/event-stream')
+        rsp.set_header('Cache-Control', 'no-cache')
+        rsp.set_status(200)
+        rsp.set_body(subscriber)
 
     def run_request(self, method, req, rsp, include_body=False):
-        """ Record an HTTP request for a given method """
-        # Make sure this method is supported by the block
-        self.logger.debug(
-            "Received {} request, validating method".format(method))
-        if not self.validate_method(method, rsp):
+        """ Record an HTTP request for a given method
+
+        The method must already have been validated.
+        """
+        self.logger.debug("Received %s request", method)
+        route = None
+        if self._router is not None:
+            route = self.validate_route(method, req, rsp)
+            if route is None:
+                return
+        if include_body and not self.validate_body_size(req, rsp):
+            return
+
+        cache = self._blk.get_response_cache() if method == 'GET' else None
+        if cache is not None:
+            self.run_cached_request(cache, method, req, rsp, route)
+        else:
+            self.admit_request(method, req, rsp, include_body, route)
+
+    def validate_route(self, method, req, rsp):
+        """ Find the route for the request path and method
+
+        If there is none, write a 404 to the response, or a 405 if routes
+        for the path accept other methods
+
+        Returns:
+            route (RouteMatch): The matched route and its path params, None
+                if the request has been answered
+        """
+        route, allowed = self._router.match(method, request_path(req))
+        if route is not None:
+            return route
+        if allowed:
+            rsp.set_header('Allow', ', '.join(sorted(allowed)))
+            self.write_status(rsp, 405)
+        else:
+            self.write_status(rsp, 404)
+        return None
+
+    def run_cached_request(self, cache, method, req, rsp, route=None):
+        """ Answer a request from the cache, fetching it once on a miss
+
+        Requests that miss the cache while another request with the same
+        cache key is being fetched wait for that response instead of
+        notifying a signal of their own.
+        """
+        key = self.cache_key(cache, method, req)
+        response, flight, leader = cache.lookup(key)
+        if response is None and not leader:
+            self.logger.debug("Waiting for the same request to finish")
+            response = flight.wait(self._blk.get_timeout_seconds())
+            if response is None:
+                # The other request failed, try this one on its own
+                self.admit_request(method, req, rsp, False, route)
+                return
+        if response is not None:
+            self.logger.debug("Answering request from the cache")
+            self.write_cached_response(response, req, rsp)
+            return
+
+        response = None
+        try:
+            response = self.admit_request(method, req, rsp, False, route)
+        finally:
+            cache.finish(key, flight, response)
+
+    def cache_key(self, cache, method, req):
+        return cache.key_for(method, self._endpoint + request_path(req),
+                             req.get_params(), req._headers)
+
+    def write_cached_response(self, response, req, rsp):
+        status, body, headers = response
+        if status == 200 and etag_matches(
+                get_header(req._headers, 'If-None-Match'),
+                get_header(headers, 'ETag')):
+            status, body = 304, None
+        if body:
+            rsp.set_body(body)
+        if headers:
+            set_headers(rsp, headers, self.vary_for(req))
+        rsp.set_status(status)
+        self._blk.count_status(status)
+
+    def admit_request(self, method, req, rsp, include_body, route=None):
+        """ Process a request if the block has room to work on it
+
+        Returns:
+            response (tuple): The (status, body, headers) written to the
+                response, None if no response was written in full
+        """
+        # Shed the request before doing any work for it if the block is
+        # already working on as many requests as it may
+        admission = self._blk.get_admission()
+        if not admission.acquire():
+            self.logger.debug("Too many requests in flight, shedding request")
+            self.write_unavailable(rsp)
             return
+        try:
+            return self.process_request(
+                method, req, rsp, include_body, route)
+        finally:
+            admission.release()
 
-        # Generate a unique ID for this request
-        request_id = str(uuid4())
+    def process_request(self, method, req, rsp, include_body, route=None):
+        """ Register an admitted request and wait for its response
 
-        # Register this request with the broker
-        self.logger.debug(
-            "Registering request with request ID {}".format(request_id))
-        RequestResponseBroker.register_request(
-            request_id, req, rsp, self._blk.get_timeout_seconds())
+        Returns:
+            response (tuple): The (status, body, headers) written to the
+                response, None if no response was written in full
+        """
+        # Generate a unique ID for this request, it carries the key of the
+        # broker so that the response can be routed back to it
+        broker = self._blk.get_broker()
+        request_id = broker.request_id(self._blk.new_request_token())
 
-        # Next, notify the signal containing the request information
-        self.logger.debug(
-            "Notifiying request signal with request ID {}".format(request_id))
+        # Build the signals before registering the request, so that requests
+        # we can't build signals for never take up room in the broker
         try:
-            self._blk.notify_signals([self.build_output_signal(
-                request_id, req, method, include_body)])
+            signals = self.build_output_signals(
+                request_id, req, method, include_body)
+        except BodyError as e:
+            self.logger.debug("Rejecting request body: %s", e)
+            self.write_status(rsp, e.status)
+            return
         except:
             self.logger.exception("Unable to build signal for request")
+            # The web engine answers with a 500 once this is raised
+            self._blk.count_status(500)
+            raise
+        if route is not None:
+            for signal in signals:
+                self.add_route_to_signal(signal, route)
+
+        # Register this request with the broker. The level is checked once
+        # rather than by every debug call for this request
+        debug = self.logger.isEnabledFor(DEBUG)
+        if debug:
+            self.logger.debug(
+                "Registering request with request ID %s", request_id)
+        try:
+            request_info = broker.register_request(
+                request_id, req, rsp, self.timeout_for(req))
+        except BrokerCapacityError:
+            self.logger.warning("Too many pending requests, rejecting")
+            self.write_unavailable(rsp)
+            return
+        # Keep the Vary the CORS headers set from being overwritten by the
+        # response, this is set before any signal goes out to respond to
+        vary = self.vary_for(req)
+        if vary:
+            request_info['vary'] = vary
+
+        # Next, notify the signals containing the request information
+        if debug:
+            self.logger.debug(
+                "Notifiying request signal with request ID %s", request_id)
+        try:
+            if len(signals) == 1:
+                self._blk.emit_request_signal(signals[0], request_info)
+            else:
+                # Each signal is one part of an aggregated response
+                broker.expect_parts(request_id, len(signals))
+                self._blk.emit_request_signals(signals, request_info)
+        except:
+            self._blk.count_status(500)
             raise
 
         # Wait for the response to be written, this call will block until
         # the resposne is written to or the timeout occurs
-        RequestResponseBroker.wait_for_response(request_id)
+        broker.wait_for_response(request_id, request_info)
+        self._blk.record_request(request_id, request_info, monotonic())
+        return request_info.get('response')
+
+    def build_output_signals(self, request_id, req_obj,
+                             http_method, include_body):
+        """ Build the list of signals to notify for a request """
+        return [self.build_output_signal(
+            request_id, req_obj, http_method, include_body)]
 
     def build_output_signal(self, request_id, req_obj,
                             http_method, include_body):
@@ -71,25 +306,43 @@ class Handler(RESTHandler):
             'id': request_id,
             'method': http_method,
             'params': req_obj.get_params(),
-            'headers': req_obj._headers,
+            'headers': self.headers_for_signal(req_obj),
         })
 
         if include_body:
             try:
                 setattr(out_sig, 'body', self.get_body_for_signal(req_obj))
+            except BodyError:
+                raise
             except:
                 self.logger.exception("Unable to get request body")
                 raise
         return out_sig
 
+    def headers_for_signal(self, req):
+        """ The request headers the block keeps on its signals """
+        return select_headers(req._headers, self._blk.get_signal_headers())
+
+    def add_route_to_signal(self, signal, route):
+        """ Add the matched route and its path params to a signal """
+        signal.route = route.route.pattern
+        signal.path_params = route.params
+
     def get_body_for_signal(self, req):
-        """ Get the body to store on the signal """
-        return req.get_body()
+        """ Get the body to store on the signal
+
+        Raises:
+            BodyTooLarge: If the body is over the block's size limit
+        """
+        if self._blk.streams_body():
+            return spool_body(req, self._blk.get_max_body_size())
+        return read_body(req, self._blk.get_max_body_size())
 
     def validate_method(self, method, rsp):
         """ Make sure the HTTP method is supported by the block.
 
-        If it is not, write a 501 to the response and return False
+        If it is not, write a 405 to the response, with an Allow header of
+        the methods that are, and return False
 
         Returns:
             success (bool): True if the method is supported, False if not
@@ -97,43 +350,173 @@ class Handler(RESTHandler):
         if self._blk.supports_method(method):
             return True
 
-        rsp.set_status(501)
+        self.logger.debug("Method %s is not allowed", method)
+        rsp.set_header('Allow', self._blk.get_allowed_methods())
+        self.write_status(rsp, 405)
         return False
 
-    def __add_headers(self, rsp):
+    def validate_body_size(self, req, rsp):
+        """ Reject a request whose declared body is over the size limit
+
+        If it is, write a 413 to the response and return False
+
+        Returns:
+            success (bool): True if the body may be read, False if not
+        """
+        try:
+            check_declared_length(req, self._blk.get_max_body_size())
+        except BodyTooLarge:
+            self.logger.debug("Request body is too large, rejecting")
+            self.write_status(rsp, 413)
+            return False
+        return True
+
+    def timeout_for(self, req):
+        """ The seconds to wait for the response to a request
+
+        Clients may ask for a shorter timeout with the block's timeout
+        header, but never a longer one than the block's request timeout.
+        """
+        timeout = self._blk.get_timeout_seconds()
+        name = self._blk.get_timeout_header()
+        requested = get_header(req._headers, name) if name else None
+        if not isinstance(requested, str):
+            return timeout
+        try:
+            requested = float(requested)
+        except ValueError:
+            return timeout
+        return requested if 0 < requested < timeout else timeout
+
+    def write_unavailable(self, rsp):
+        """ Tell the client the block is overloaded and when to retry """
+        self.write_status(rsp, 503)
+        rsp.set_header('Retry-After', str(self._blk.get_retry_after()))
+
+    def write_status(self, rsp, status):
+        """ Answer a request with just a status, counting it for the block """
+        rsp.set_status(status)
+        self._blk.count_status(status)
+
+    def vary_for(self, req):
+        """ The `Vary` header the handler sets on a request's response """
+        if self._headers is not None:
+            for name, value in self._headers.items_for(req):
+                if name.lower() == 'vary':
+                    return value
+
+    def __add_headers(self, req, rsp):
         if self._headers is not None:
-            for header in self._headers:
-                rsp.set_header(header, self._headers[header])
+            for name, value in self._headers.items_for(req):
+                rsp.set_header(name, value)
 
 class JSONHandler(Handler):
 
+    def __init__(self, endpoint, blk, headers=None, codec=None,
+                 router=None, origins=None):
+        super().__init__(endpoint, blk, headers, router, origins)
+        self._codec = codec or StdlibCodec()
+
+    def read_decoded_body(self, req):
+        """ Read the body, decompressing it if it has a Content-Encoding
+
+        Raises:
+            BodyError: If the body is over the block's size limits or can't
+                be decoded
+        """
+        req_body = read_body(req, self._blk.get_max_body_size())
+        encoding = get_header(req._headers, 'Content-Encoding')
+        if encoding and isinstance(req_body, (bytes, bytearray)):
+            req_body = decode_body(
+                req_body, encoding, self._blk.get_max_decompressed_size())
+        return req_body
+
     def get_body_for_signal(self, req):
         """ Parse the JSON of the body rather than use a string.
 
+        Bodies with a gzip or deflate Content-Encoding are decompressed
+        before they are parsed.
+
         Raises:
             ValueError: If the body does not contain valid JSON
+            BodyError: If the body is over the block's size limits or can't
+                be decoded
         """
-        req_body = req.get_body()
+        req_body = self.read_decoded_body(req)
         if not (isinstance(req_body, list) or isinstance(req_body, dict)):
-            return json.loads(req_body)
+            return self._codec.loads(req_body)
         return req_body
 
-    def build_output_signal(self, request_id, req_obj,
-                            http_method, include_body):
-        """ For the JSON Handler, return the body as the body of the signal """
-        self.logger.debug("Building output signal")
-        req_info = {
+    def get_records_for_signals(self, req):
+        """ Parse a bulk body into a list of records
+
+        The body is either a JSON array of records, a single record, or
+        newline delimited JSON with one record per line.
+        """
+        if is_ndjson(req):
+            req_body = self.read_decoded_body(req)
+            return [self._codec.loads(line)
+                    for line in req_body.splitlines() if line.strip()]
+        records = self.get_body_for_signal(req)
+        return records if isinstance(records, list) else [records]
+
+    def build_output_signals(self, request_id, req_obj,
+                             http_method, include_body):
+        """ For bulk requests, notify a signal for each record of the body
+
+        Every signal carries the same request info, so they all respond to
+        the one request.
+        """
+        if not (include_body and self._blk.accepts_bulk()):
+            return super().build_output_signals(
+                request_id, req_obj, http_method, include_body)
+        self.logger.debug("Building bulk output signals")
+        try:
+            records = self.get_records_for_signals(req_obj)
+        except BodyError:
+            raise
+        except:
+            self.logger.exception("Unable to get request body")
+            raise
+        if not records:
+            raise BodyError("The request body has no records")
+
+        req_info = self.build_request_info(request_id, req_obj, http_method)
+        signals = []
+        for record in records:
+            if not isinstance(record, dict):
+                raise TypeError(
+                    "Each record in the request body must be a dictionary")
+            record.update(req_info)
+            signals.append(Signal(record))
+        return signals
+
+    def add_route_to_signal(self, signal, route):
+        """ The route and path params are hidden attributes as well """
+        signal._route = route.route.pattern
+        signal._path_params = route.params
+
+    def build_request_info(self, request_id, req_obj, http_method):
+        """ The hidden attributes describing the request on each signal """
+        return {
             '_id': request_id,
             '_method': http_method,
             '_params': req_obj.get_params(),
-            '_headers': req_obj._headers,
+            '_headers': self.headers_for_signal(req_obj),
         }
 
+    def build_output_signal(self, request_id, req_obj,
+                            http_method, include_body):
+        """ For the JSON Handler, return the body as the body of the signal """
+        req_info = self.build_request_info(request_id, req_obj, http_method)
+
         try:
             if include_body:
                 req_body = self.get_body_for_signal(req_obj)
             else:
                 req_body = {}
+        except BodyError:
+            raise
         except:
             self.logger.exception("Unable to get request body")
             raise
@@ -0,0 +1,65 @@
+def get_header(headers, name, default=None):
+    """ Look up a request header by name, ignoring case
+
+    Args:
+        headers (dict): The headers of a request, may be None
+        name (str): The header name to look up
+        default: What to return if the header is not present
+
+    Returns:
+        value: The value of the header, or default
+    """
+    if not headers:
+        return default
+    # Most engines keep headers in their canonical case, so try that first
+    value = headers.get(name)
+    if value is not None:
+        return value
+    name = name.lower()
+    for header_name, value in headers.items():
+        if header_name.lower() == name:
+            return value
+    return default
+
+
+def split_names(value):
+    """ Split a comma separated list of names, ignoring blanks """
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def merge_vary(*values):
+    """ Combine `Vary` header values, keeping each name once
+
+    Args:
+        values (str): Comma separated header names, None or empty ones are
+            skipped
+
+    Returns:
+        vary (str): The names of every value in the order first seen, `*`
+            if any of them is `*`
+    """
+    names = []
+    seen = set()
+    for value in values:
+        for name in split_names(value):
+            if name == '*':
+                return '*'
+            if name.lower() not in seen:
+                seen.add(name.lower())
+                names.append(name)
+    return ', '.join(names)
+
+
+def set_headers(rsp, headers, vary=None):
+    """ Set response headers, merging `Vary` with one already set
+
+    Args:
+        rsp (Response): The response to set the headers on
+        headers (dict): The headers to set
+        vary (str): The `Vary` already set on the response, such as by the
+            handler's CORS headers, so that it is not overwritten
+    """
+    for name, value in headers.items():
+        if vary and name.lower() == 'vary':
+            value = merge_vary(vary, value)
+        rsp.set_header(name, value)
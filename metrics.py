@@ -0,0 +1,206 @@
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(object):
+
+    """ Counts observations in fixed buckets
+
+    The buckets are set when the histogram is made, so recording a value
+    only finds its bucket and adds to a count, nothing is allocated.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """ Create a new histogram
+
+        Args:
+            bounds (tuple): The upper bound of each bucket in ascending
+                order, values above the last bound go in an overflow bucket
+        """
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """ The bucket counts, sum and count of the observations """
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def percentile(self, q, snapshot=None):
+        """ Estimate a percentile from the buckets
+
+        Args:
+            q (float): The percentile, from 0 to 1
+            snapshot (tuple): A snapshot to estimate from, a new one by
+                default
+
+        Returns:
+            value (float): The upper bound of the bucket the percentile
+                falls in, None if nothing has been observed. Percentiles in
+                the overflow bucket are reported as infinite
+        """
+        counts, _, count = snapshot or self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(self.bounds + (float('inf'),), counts):
+            seen += bucket
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class RequestMetrics(object):
+
+    """ Latency histograms and response counters for a handler block
+
+    Three latencies are recorded for each request that gets a response:
+
+    * queue: From registering the request until its signals are notified,
+      including any time spent waiting in a batch
+    * service: From notifying the signals until the response is written
+    * total: From registering the request until the handler is woken up
+      to send the response
+    """
+
+    latencies = ('queue', 'service', 'total')
+    counters = ('requests', 'timeouts', 'responses_501', 'responses_4xx',
+                'responses_5xx')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self._histograms = dict(
+            (name, Histogram(bounds)) for name in self.latencies)
+        self._counts = dict.fromkeys(self.counters, 0)
+        self._lock = Lock()
+
+    def count_status(self, status):
+        """ Count a response by its status, along with the request """
+        with self._lock:
+            self._counts['requests'] += 1
+            if status == 504:
+                self._counts['timeouts'] += 1
+            if status == 501:
+                self._counts['responses_501'] += 1
+            if 400 <= status < 500:
+                self._counts['responses_4xx'] += 1
+            elif status >= 500:
+                self._counts['responses_5xx'] += 1
+
+    @staticmethod
+    def timings(request_info, now):
+        """ The latencies and status of a request that was waited on
+
+        Args:
+            request_info (dict): The broker's info for the request
+            now (float): The monotonic time the handler was woken up
+
+        Returns:
+            (queue, service, total, status): The latencies in seconds, queue
+                and service are None if the request never got that far
+        """
+        registered = request_info['registered']
+        notified = request_info.get('notified')
+        responded = request_info.get('responded')
+        queue = service = None
+        if notified is not None:
+            queue = notified - registered
+            if responded is not None:
+                service = responded - notified
+        if request_info['expired']:
+            status = 504
+        else:
+            status = (request_info.get('response') or (200,))[0]
+        return queue, service, now - registered, status
+
+    def record(self, request_info, now):
+        """ Record the latencies and status of a request that was waited on
+
+        Returns:
+            (queue, service, total, status): The recorded timings
+        """
+        timings = self.timings(request_info, now)
+        queue, service, total, status = timings
+        self._histograms['total'].observe(total)
+        if queue is not None:
+            self._histograms['queue'].observe(queue)
+        if service is not None:
+            self._histograms['service'].observe(service)
+        self.count_status(status)
+        return timings
+
+    def stats(self):
+        """ The counters, with the p50 and p99 of each latency in seconds """
+        with self._lock:
+            stats = dict(self._counts)
+        for name, histogram in self._histograms.items():
+            snapshot = histogram.snapshot()
+            stats[name + '_p50'] = histogram.percentile(0.5, snapshot)
+            stats[name + '_p99'] = histogram.percentile(0.99, snapshot)
+        return stats
+
+    def prometheus(self, prefix='web_handler', labels=None):
+        """ Format the metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str): Put in front of every metric name
+            labels (dict): Labels to put on every sample, such as the name
+                of the block
+        """
+        label_text = ','.join(
+            '{}="{}"'.format(name, _escape(value))
+            for name, value in sorted((labels or {}).items()))
+        lines = []
+        for name in self.latencies:
+            metric = '{}_{}_seconds'.format(prefix, name)
+            histogram = self._histograms[name]
+            counts, total, count = histogram.snapshot()
+            lines.append('# TYPE {} histogram'.format(metric))
+            seen = 0
+            for bound, bucket in zip(histogram.bounds + ('+Inf',), counts):
+                seen += bucket
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    metric, _join(label_text, 'le="{}"'.format(bound)), seen))
+            lines.append('{}_sum{} {}'.format(metric, _braces(label_text),
+                                              total))
+            lines.append('{}_count{} {}'.format(metric, _braces(label_text),
+                                                count))
+        with self._lock:
+            counts = dict(self._counts)
+        for name in self.counters:
+            metric = '{}_{}_total'.format(prefix, name)
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{}{} {}'.format(metric, _braces(label_text),
+                                          counts[name]))
+        return '\n'.join(lines) + '\n'
+
+
+def format_ms(seconds):
+    """ Format a latency in milliseconds for logs """
+    return '-' if seconds is None else '{:.2f}ms'.format(seconds * 1000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _join(*parts):
+    return ','.join(part for part in parts if part)
+
+
+def _braces(label_text):
+    return '{' + label_text + '}' if label_text else ''
@@ -0,0 +1,65 @@
+from threading import Lock
+
+
+class ShardedRegistry(object):
+
+    """ A thread-safe mapping split over independently locked shards
+
+    Keys are spread over the shards by hash so that threads working on
+    different requests rarely contend for the same lock. Every operation
+    touches a single shard, which keeps contention flat as the number of
+    threads grows.
+    """
+
+    def __init__(self, shards=64):
+        """ Create a new registry
+
+        Args:
+            shards (int): How many shards to split keys over, rounded up to
+                the next power of two
+        """
+        num_shards = 1
+        while num_shards < shards:
+            num_shards <<= 1
+        self._mask = num_shards - 1
+        self._shards = [{} for _ in range(num_shards)]
+        self._locks = [Lock() for _ in range(num_shards)]
+
+    def _index(self, key):
+        return hash(key) & self._mask
+
+    def add(self, key, value):
+        """ Save a value for a key, replacing any existing value """
+        index = self._index(key)
+        with self._locks[index]:
+            self._shards[index][key] = value
+
+    def get(self, key, default=None):
+        """ Return the value for a key, or default if it is not saved """
+        index = self._index(key)
+        with self._locks[index]:
+            return self._shards[index].get(key, default)
+
+    def pop(self, key, default=None):
+        """ Atomically remove and return the value for a key
+
+        Only one of any number of concurrent callers will get the value for
+        a key, the others get the default. This makes `pop` a way to claim
+        the right to finish a request.
+        """
+        index = self._index(key)
+        with self._locks[index]:
+            return self._shards[index].pop(key, default)
+
+    def clear(self):
+        for index, shard in enumerate(self._shards):
+            with self._locks[index]:
+                shard.clear()
+
+    def __contains__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            return key in self._shards[index]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
@@ -0,0 +1,75 @@
+from enum import Enum
+from itertools import count
+from os import urandom
+from uuid import uuid4
+
+
+class RequestIdFormat(Enum):
+    uuid = 'uuid'
+    token = 'token'
+    counter = 'counter'
+
+
+class UUIDGenerator(object):
+
+    """ Generates random UUID4 strings, 36 characters each """
+
+    guessable = False
+
+    def __call__(self):
+        return str(uuid4())
+
+
+class TokenGenerator(object):
+
+    """ Generates random 64-bit tokens as 16 hex characters """
+
+    guessable = False
+
+    def __call__(self):
+        return urandom(8).hex()
+
+
+class CounterGenerator(object):
+
+    """ Generates a random per-generator prefix followed by a counter
+
+    This is the cheapest format to generate and hash. The prefix is picked
+    when the generator is created, so IDs stay unique across restarts of a
+    block. IDs from the same generator are sequential though, so they are
+    easy to guess from one another.
+    """
+
+    guessable = True
+
+    def __init__(self):
+        self._prefix = urandom(8).hex() + '-'
+        # Taking the next value of a count is atomic in CPython
+        self._counter = count()
+
+    def __call__(self):
+        return self._prefix + format(next(self._counter), 'x')
+
+
+_GENERATORS = {
+    RequestIdFormat.uuid: UUIDGenerator,
+    RequestIdFormat.token: TokenGenerator,
+    RequestIdFormat.counter: CounterGenerator,
+}
+
+
+def get_generator(id_format, allow_guessable=True):
+    """ Get a new request ID generator for a format
+
+    Args:
+        id_format (RequestIdFormat): The format of the IDs to generate
+        allow_guessable (bool): If False, formats whose IDs can be guessed
+            from one another are replaced by random tokens
+
+    Returns:
+        generator (callable): Returns a new request ID each time it is called
+    """
+    generator = _GENERATORS[id_format]()
+    if generator.guessable and not allow_guessable:
+        return TokenGenerator()
+    return generator
@@ -0,0 +1,96 @@
+import re
+from collections import namedtuple
+
+# Path parameters are written as {name} in route patterns
+PATH_PARAM = re.compile(r'\{(\w+)\}')
+
+RouteMatch = namedtuple('RouteMatch', ['route', 'params'])
+
+
+def request_path(req):
+    """ The path of a request below the endpoint of its handler """
+    identifier = req.get_identifier() if hasattr(req, 'get_identifier') \
+        else None
+    if not isinstance(identifier, str):
+        identifier = ''
+    return '/' + identifier.strip('/')
+
+
+class Route(object):
+
+    """ A path pattern and the HTTP methods it accepts """
+
+    def __init__(self, pattern, methods=None):
+        """ Create a new route
+
+        Args:
+            pattern (str): The path to match, with path parameters in braces
+                such as `/users/{user_id}`
+            methods (list): The methods the route accepts, empty for any
+        """
+        self.pattern = '/' + pattern.strip('/')
+        self.methods = frozenset(
+            method.upper() for method in methods) if methods else None
+        self.static = not PATH_PARAM.search(self.pattern)
+        self._regex = None if self.static else self._compile(self.pattern)
+
+    @staticmethod
+    def _compile(pattern):
+        # Literal parts of the pattern alternate with parameter names
+        parts = PATH_PARAM.split(pattern)
+        regex = ''.join(
+            '(?P<{}>[^/]+)'.format(part) if index % 2 else re.escape(part)
+            for index, part in enumerate(parts))
+        return re.compile(regex + '$')
+
+    def accepts(self, method):
+        return self.methods is None or method in self.methods
+
+    def match(self, path):
+        """ The path parameters if the path matches, otherwise None """
+        if self.static:
+            return {} if path == self.pattern else None
+        match = self._regex.match(path)
+        return match.groupdict() if match else None
+
+
+class Router(object):
+
+    """ Finds the route for a request path and method
+
+    Routes without path parameters are found with a single dict lookup.
+    Only routes with parameters are matched one by one, in the order they
+    were given, against their precompiled patterns.
+    """
+
+    def __init__(self, routes):
+        self._static = {}
+        self._dynamic = []
+        for route in routes:
+            if route.static:
+                self._static.setdefault(route.pattern, []).append(route)
+            else:
+                self._dynamic.append(route)
+
+    def match(self, method, path):
+        """ Find the route for a request
+
+        Returns:
+            (match, allowed): The RouteMatch of the first route for the path
+                that accepts the method. If none accepts it, match is None
+                and allowed holds the methods that routes for the path do
+                accept. Both are empty if no route matches the path at all
+        """
+        allowed = set()
+        for route in self._static.get(path, ()):
+            if route.accepts(method):
+                return RouteMatch(route, {}), allowed
+            allowed.update(route.methods)
+        for route in self._dynamic:
+            params = route.match(path)
+            if params is None:
+                continue
+            if route.accepts(method):
+                return RouteMatch(route, params), allowed
+            allowed.update(route.methods)
+        return None, allowed
@@ -0,0 +1,193 @@
+from collections import deque
+from enum import Enum
+from threading import Condition, Lock
+
+from .headers import get_header
+
+
+class SlowClientPolicy(Enum):
+    drop = 'drop'
+    disconnect = 'disconnect'
+
+
+class SubscriberLimitError(RuntimeError):
+
+    """ Raised when a channel already has its maximum subscribers """
+
+
+def accepts_event_stream(req):
+    """ Whether a request asks for a Server-Sent Events stream """
+    accept = get_header(getattr(req, '_headers', None), 'Accept')
+    return isinstance(accept, str) and 'text/event-stream' in accept
+
+
+def format_event(data, event=None):
+    """ Build a Server-Sent Events frame for some data
+
+    Args:
+        data (str, bytes): The event data, may span multiple lines
+        event (str): An optional event name
+
+    Returns:
+        frame (bytes): The encoded frame
+    """
+    if isinstance(data, bytes):
+        data = data.decode()
+    elif not isinstance(data, str):
+        data = str(data)
+    lines = []
+    if event:
+        lines.append('event: ' + event)
+    lines.extend('data: ' + line for line in data.split('\n'))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class Subscriber(object):
+
+    """ One client connection receiving events from a channel
+
+    Events wait in a buffer of at most `buffer_size` frames until the web
+    engine sends them. Iterating the subscriber yields the frames as they
+    arrive, along with a keepalive comment whenever no event arrives for
+    `keepalive` seconds so that closed connections are noticed.
+    """
+
+    def __init__(self, channel, buffer_size, policy, keepalive):
+        self._channel = channel
+        self._buffer = deque()
+        self._buffer_size = buffer_size
+        self._policy = policy
+        self._keepalive = keepalive
+        self._condition = Condition()
+        self._closed = False
+
+    def offer(self, frame):
+        """ Buffer a frame for the client
+
+        Returns:
+            delivered (bool): False if the frame was dropped, or the client
+                disconnected, because the client is not keeping up
+        """
+        with self._condition:
+            if self._closed:
+                return False
+            if len(self._buffer) >= self._buffer_size:
+                if self._policy is SlowClientPolicy.disconnect:
+                    self._closed = True
+                    self._buffer.clear()
+                    self._condition.notify()
+                return False
+            self._buffer.append(frame)
+            self._condition.notify()
+            return True
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def __iter__(self):
+        try:
+            # Send something right away so the client sees the stream open
+            yield b': subscribed\n\n'
+            while True:
+                with self._condition:
+                    if not self._buffer and not self._closed:
+                        self._condition.wait(self._keepalive)
+                    if self._closed:
+                        return
+                    frames = list(self._buffer)
+                    self._buffer.clear()
+                if frames:
+                    yield b''.join(frames)
+                else:
+                    yield b': keepalive\n\n'
+        finally:
+            self._channel.unsubscribe(self)
+
+
+class SubscriptionChannel(object):
+
+    """ Fans published events out to every subscriber of a named channel """
+
+    _channels = {}
+    _channels_lock = Lock()
+
+    def __init__(self, name):
+        self.name = name
+        # Replaced rather than modified, so publishing needs no lock
+        self._subscribers = ()
+        self._lock = Lock()
+        self._stats = {
+            'published': 0,
+            'dropped': 0,
+            'refused': 0,
+        }
+
+    @classmethod
+    def get_channel(cls, name):
+        """ Get the channel with a name, creating it if needed """
+        with cls._channels_lock:
+            channel = cls._channels.get(name)
+            if channel is None:
+                channel = cls._channels[name] = cls(name)
+            return channel
+
+    def subscribe(self, buffer_size=100, policy=SlowClientPolicy.drop,
+                  keepalive=15, max_subscribers=0):
+        """ Add a subscriber to the channel
+
+        Args:
+            buffer_size (int): How many events to buffer for the client
+            policy (SlowClientPolicy): What to do when the buffer is full,
+                drop the new event or disconnect the client
+            keepalive (float): Seconds between keepalive comments when no
+                events are published
+            max_subscribers (int): The most subscribers the channel may have
+                at once, 0 for no limit
+
+        Returns:
+            subscriber (Subscriber): Iterate it as the response body
+
+        Raises:
+            SubscriberLimitError: If the channel has max_subscribers already
+        """
+        subscriber = Subscriber(self, buffer_size, policy, keepalive)
+        with self._lock:
+            if max_subscribers and \
+                    len(self._subscribers) >= max_subscribers:
+                self._stats['refused'] += 1
+                raise SubscriberLimitError(
+                    "Channel {} already has {} subscribers".format(
+                        self.name, max_subscribers))
+            self._subscribers += (subscriber, )
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = tuple(
+                sub for sub in self._subscribers if sub is not subscriber)
+
+    def publish(self, data, event=None):
+        """ Send an event to every current subscriber
+
+        The event is encoded once no matter how many subscribers there are.
+
+        Returns:
+            count (int): How many subscribers the event was buffered for
+        """
+        frame = format_event(data, event)
+        delivered = 0
+        for subscriber in self._subscribers:
+            if subscriber.offer(frame):
+                delivered += 1
+        with self._lock:
+            self._stats['published'] += 1
+            self._stats['dropped'] += len(self._subscribers) - delivered
+        return delivered
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subscribers'] = len(self._subscribers)
+        return stats
@@ -0,0 +1,96 @@
+from queue import Queue, Empty, Full
+from time import monotonic
+
+
+class StreamFailedError(RuntimeError):
+
+    """ Raised to the web engine when a response stream can't be finished
+
+    Raising from the body aborts the response, so the client sees a
+    truncated response rather than one that looks complete.
+    """
+
+
+class ChunkStream(object):
+
+    """ An iterable response body fed with chunks from other threads
+
+    The web engine iterates over the stream to send each chunk as it
+    arrives. Only `max_chunks` chunks are buffered at once. Writers never
+    wait for the client, a client that falls that far behind fails the
+    stream instead of holding up the thread writing to it.
+    """
+
+    _END = object()
+
+    def __init__(self, idle_timeout, max_chunks=64):
+        """ Create a new stream
+
+        Args:
+            idle_timeout (float): How many seconds the reader waits for the
+                next chunk before failing the stream
+            max_chunks (int): How many chunks to buffer at most
+        """
+        self._idle_timeout = idle_timeout
+        self._queue = Queue(max_chunks)
+        self._closed = False
+        self._failed = False
+        self.last_write = monotonic()
+
+    def put(self, chunk):
+        """ Add a chunk to the stream
+
+        Raises:
+            ValueError: If the stream is closed or its buffer is full because
+                the client is not keeping up, the stream fails in that case
+        """
+        if self._closed:
+            raise ValueError("The response stream is already closed")
+        if not chunk:
+            return
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        self.last_write = monotonic()
+        try:
+            self._queue.put_nowait(chunk)
+        except Full:
+            self.fail()
+            raise ValueError("The client is not reading the response stream")
+
+    def close(self):
+        """ End the stream once the buffered chunks have been read """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put_nowait(self._END)
+        except Full:
+            # The reader ends the stream once it has read the buffer
+            pass
+
+    def fail(self):
+        """ Abort the stream, the client sees an incomplete response """
+        self._failed = self._closed = True
+
+    def idle_for(self, seconds):
+        """ Whether nothing has been written for at least `seconds` """
+        return monotonic() - self.last_write >= seconds
+
+    def __iter__(self):
+        while True:
+            if self._failed:
+                raise StreamFailedError("The response stream failed")
+            try:
+                chunk = self._queue.get(timeout=self._idle_timeout)
+            except Empty:
+                if self._closed and not self._failed:
+                    return
+                # The writer went away without finishing the stream
+                self.fail()
+                raise StreamFailedError(
+                    "No chunk was written to the response stream in time")
+            if chunk is self._END:
+                return
+            yield chunk
+            if self._closed and not self._failed and self._queue.empty():
+                return
@@ -0,0 +1,55 @@
+from threading import Event
+
+from nio.testing.block_test_case import NIOBlockTestCase
+from nio.util.threading.spawn import spawn
+
+from ..admission import AdmissionController
+
+
+class TestAdmissionController(NIOBlockTestCase):
+
+    def test_unlimited(self):
+        """ Without a limit every request is admitted and counted """
+        admission = AdmissionController()
+        for _ in range(100):
+            self.assertTrue(admission.acquire())
+        self.assertEqual(admission.stats()['in_flight'], 100)
+
+    def test_sheds_over_limit(self):
+        """ Requests over the limit are shed right away without a queue """
+        admission = AdmissionController(max_in_flight=1)
+        self.assertTrue(admission.acquire())
+        self.assertFalse(admission.acquire())
+        admission.release()
+        self.assertTrue(admission.acquire())
+        self.assertEqual(admission.stats(), {
+            'in_flight': 1,
+            'queued': 0,
+            'admitted': 2,
+            'shed': 1,
+        })
+
+    def test_queued_request_gets_slot(self):
+        """ A queued request is admitted once a slot frees up """
+        admission = AdmissionController(
+            max_in_flight=1, queue_depth=1, queue_timeout=5)
+        self.assertTrue(admission.acquire())
+        admitted = Event()
+
+        def wait_for_slot():
+            if admission.acquire():
+                admitted.set()
+
+        spawn(wait_for_slot)
+        self.assertFalse(admitted.wait(0.2))
+        admission.release()
+        self.assertTrue(admitted.wait(1))
+
+    def test_queue_timeout(self):
+        """ A queued request is shed if no slot frees up in time """
+        admission = AdmissionController(
+            max_in_flight=1, queue_depth=1, queue_timeout=0.1)
+        self.assertTrue(admission.acquire())
+        self.assertFalse(admission.acquire())
+        self.assertEqual(admission.stats()['shed'], 1)
+        self.assertEqual(admission.stats()['queued'], 0)
@@ -0,0 +1,64 @@
+from datetime import timedelta
+from time import monotonic, sleep
+from unittest.mock import MagicMock
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..batcher import SignalBatcher
+
+
+class TestSignalBatcher(NIOBlockTestCase):
+
+    def test_flushes_when_full(self):
+        """ A full batch is notified right away as one list """
+        notify = MagicMock()
+        batcher = SignalBatcher(notify, 3, timedelta(seconds=5))
+        batcher.add(1)
+        batcher.add(2)
+        self.assertEqual(notify.call_count, 0)
+        batcher.add(3)
+        notify.assert_called_once_with([1, 2, 3])
+
+    def test_flushes_after_window(self):
+        """ A partial batch is notified once the window elapses """
+        notify = MagicMock()
+        batcher = SignalBatcher(notify, 10, timedelta(seconds=0.2))
+        batcher.add(1)
+        batcher.add(2)
+        self.assertEqual(notify.call_count, 0)
+        sleep(0.5)
+        notify.assert_called_once_with([1, 2])
+
+    def test_stale_window_does_not_flush(self):
+        """ A window scheduled for a flushed batch leaves the next alone """
+        notify = MagicMock()
+        batcher = SignalBatcher(notify, 2, timedelta(seconds=0.2))
+        batcher.add(1)
+        batcher._flush_window(batcher._generation - 1)
+        self.assertEqual(notify.call_count, 0)
+        batcher.add(2)
+        notify.assert_called_once_with([1, 2])
+
+    def test_records_notified_time(self):
+        """ Signals are stamped when their batch is notified, not added """
+        notified = []
+        batcher = SignalBatcher(
+            lambda batch: notified.append(monotonic()), 2,
+            timedelta(seconds=5))
+        first, second = {'registered': 0}, {'registered': 0}
+        batcher.add(1, first)
+        self.assertNotIn('notified', first)
+        sleep(0.05)
+        batcher.add(2, second)
+        self.assertEqual(first['notified'], second['notified'])
+        self.assertLessEqual(first['notified'], notified[0])
+
+    def test_manual_flush(self):
+        """ Pending signals can be flushed, e.g. when the block stops """
+        notify = MagicMock()
+        batcher = SignalBatcher(notify, 10, timedelta(seconds=5))
+        batcher.flush()
+        self.assertEqual(notify.call_count, 0)
+        batcher.add(1)
+        batcher.flush()
+        notify.assert_called_once_with([1])
@@ -0,0 +1,93 @@
+import gzip
+import zlib
+from io import BytesIO
+from unittest.mock import MagicMock
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from .. import body
+from ..body import BodyError, BodyTooLarge, UnsupportedEncoding, \
+    decode_body, read_body, spool_body, iter_chunks
+
+
+class TestBody(NIOBlockTestCase):
+
+    def build_request(self, req_body, headers=None):
+        req = MagicMock()
+        req._headers = headers or {}
+        req.get_body.return_value = req_body
+        return req
+
+    def test_read_body(self):
+        """ Bodies within the limit are returned as the engine gave them """
+        self.assertEqual(read_body(self.build_request('body')), 'body')
+        self.assertEqual(read_body(self.build_request(b'body'), 4), b'body')
+        self.assertEqual(
+            read_body(self.build_request(BytesIO(b'body')), 4), b'body')
+        self.assertIsNone(read_body(self.build_request(None), 4))
+
+    def test_read_body_too_large(self):
+        """ Bodies over the limit are rejected, declared or not """
+        with self.assertRaises(BodyTooLarge):
+            read_body(self.build_request(b'12345'), 4)
+        with self.assertRaises(BodyTooLarge):
+            read_body(self.build_request(BytesIO(b'12345')), 4)
+        # A declared length over the limit is rejected without reading
+        req = self.build_request(b'', {'content-length': '5'})
+        with self.assertRaises(BodyTooLarge):
+            read_body(req, 4)
+        self.assertEqual(req.get_body.call_count, 0)
+
+    def test_spool_body(self):
+        """ Spooled bodies are rewound files with the whole body in them """
+        spooled = spool_body(self.build_request('body'))
+        self.assertEqual(spooled.read(), b'body')
+        spooled = spool_body(self.build_request(BytesIO(b'body')), 4)
+        self.assertEqual(spooled.read(), b'body')
+        with self.assertRaises(BodyTooLarge):
+            spool_body(self.build_request(BytesIO(b'12345')), 4)
+
+    def test_spooled_to_disk(self):
+        """ Large bodies are moved out of memory """
+        original = body.SPOOL_MEMORY_SIZE
+        body.SPOOL_MEMORY_SIZE = 10
+        try:
+            spooled = spool_body(self.build_request(b'x' * 100))
+        finally:
+            body.SPOOL_MEMORY_SIZE = original
+        self.assertTrue(spooled._rolled)
+        self.assertEqual(spooled.read(), b'x' * 100)
+
+    def test_iter_chunks(self):
+        self.assertEqual(
+            [bytes(chunk) for chunk in iter_chunks(b'abcde', 2)],
+            [b'ab', b'cd', b'e'])
+        self.assertEqual(list(iter_chunks(BytesIO(b'abc'), 2)),
+                         [b'ab', b'c'])
+        self.assertEqual(list(iter_chunks(None)), [])
+
+    def test_decode_body(self):
+        data = b'{"key": "value"}' * 100
+        self.assertEqual(decode_body(gzip.compress(data), 'gzip'), data)
+        self.assertEqual(decode_body(zlib.compress(data), 'deflate'), data)
+        # Raw deflate without the zlib wrapper is accepted too
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        self.assertEqual(decode_body(
+            raw.compress(data) + raw.flush(), 'Deflate'), data)
+        self.assertEqual(decode_body(data, 'identity'), data)
+
+    def test_decode_body_limit(self):
+        """ Bodies that decompress past the limit are rejected early """
+        bomb = gzip.compress(b'\0' * 10 * 1024 * 1024)
+        with self.assertRaises(BodyTooLarge):
+            decode_body(bomb, 'gzip', max_size=1024 * 1024)
+
+    def test_decode_body_errors(self):
+        with self.assertRaises(UnsupportedEncoding) as context:
+            decode_body(b'data', 'br')
+        self.assertEqual(context.exception.status, 415)
+        with self.assertRaises(BodyError) as context:
+            decode_body(b'not gzip', 'gzip')
+        self.assertEqual(context.exception.status, 400)
+        with self.assertRaises(BodyError):
+            decode_body(gzip.compress(b'data')[:-10], 'gzip')
@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import MagicMock
 
 from uuid import uuid4
@@ -8,7 +9,9 @@ from nio.modules.web.request import Request
 from nio.modules.web.response import Response
 from nio.testing.block_test_case import NIOBlockTestCase
 
-from ..broker import RequestResponseBroker
+from ..broker import RequestResponseBroker, AsyncRequestResponseBroker, \
+    BrokerCapacityError, RequestExpiredError
+from ..stream import StreamFailedError
 
 
 class TestBroker(NIOBlockTestCase):
@@ -19,14 +22,14 @@ class TestBroker(NIOBlockTestCase):
 
     def setUp(self):
         super().setUp()
-        RequestResponseBroker._mappings.clear()
+        self.broker = RequestResponseBroker('test')
 
     def test_writes_response(self):
         """ Tests that the broker writes to the proper response """
 
         req_id, mock_rsp = self.register_request(5)
         sleep(1)
-        RequestResponseBroker.write_response(
+        self.broker.write_response(
             req_id, status=123, body='body',
             headers={'header_name': 'header_value'})
 
@@ -35,7 +38,7 @@ class TestBroker(NIOBlockTestCase):
 
         # Give the event some time to trigger, make sure it got cleaned up
         sleep(0.1)
-        self.assertEqual(RequestResponseBroker._mappings, {})
+        self.assertEqual(len(self.broker._registry), 0)
 
     def test_timeout(self):
         """ Tests that the broker times out if not written in time """
@@ -48,10 +51,271 @@ class TestBroker(NIOBlockTestCase):
         mock_rsp.set_status.assert_called_once_with(504)
 
         with self.assertRaises(ValueError):
-            RequestResponseBroker.write_response(
+            self.broker.write_response(
                 req_id, status=123, body='body',
                 headers={'header_name': 'header_value'})
 
+    def test_late_write_after_timeout(self):
+        """ A write racing the timeout either wins or fails, never both """
+        mock_rsp = self.get_mocked_response()
+        request_info = self.broker.register_request(
+            'race_id', self.get_mocked_request(), mock_rsp, 5)
+        # Expire the request as the timing wheel would
+        self.broker._expire('race_id')
+        with self.assertRaises(ValueError):
+            self.broker.write_response('race_id', body='late')
+        self.broker.wait_for_response('race_id', request_info)
+        mock_rsp.set_status.assert_called_once_with(504)
+        self.assertEqual(mock_rsp.set_body.call_count, 1)
+
+    def test_expiry_writes_timeout(self):
+        """ Expired requests get their 504 before the waiter wakes up """
+        mock_rsp = self.get_mocked_response()
+        self.broker.register_request(
+            'expiry_id', self.get_mocked_request(), mock_rsp, 5)
+        self.broker._expire('expiry_id')
+        mock_rsp.set_status.assert_called_once_with(504)
+
+    def test_late_write_tombstone(self):
+        """ Late writes to expired requests fail with their own error """
+        self.broker.register_request(
+            'late_id', self.get_mocked_request(),
+            self.get_mocked_response(), 5)
+        self.broker._expire('late_id')
+        with self.assertRaises(RequestExpiredError):
+            self.broker.write_response('late_id', body='late')
+        with self.assertRaises(RequestExpiredError):
+            self.broker.write_chunk('late_id', 'late')
+        self.assertEqual(self.broker.stats()['late_writes'], 2)
+        # IDs that never existed are not reported as expired
+        try:
+            self.broker.write_response('unknown_id', body='body')
+        except ValueError as e:
+            self.assertNotIsInstance(e, RequestExpiredError)
+
+    def test_tombstones_are_forgotten(self):
+        """ Only the most recently expired IDs are remembered """
+        self.broker.max_tombstones = 1
+        for req_id in ('first_id', 'second_id'):
+            self.broker.register_request(
+                req_id, self.get_mocked_request(),
+                self.get_mocked_response(), 5)
+            self.broker._expire(req_id)
+        self.assertEqual(list(self.broker._tombstones), ['second_id'])
+
+    def test_write_before_wait(self):
+        """ A response written before the handler waits is not lost """
+        mock_rsp = self.get_mocked_response()
+        request_info = self.broker.register_request(
+            'fast_id', self.get_mocked_request(), mock_rsp, 5)
+        self.broker.write_response('fast_id', body='body')
+        self.broker.wait_for_response('fast_id', request_info)
+        mock_rsp.set_status.assert_called_once_with(200)
+
+    def test_async_writes_response(self):
+        """ Tests that the async broker resumes when a response is written """
+        broker = AsyncRequestResponseBroker('async')
+        loop = asyncio.new_event_loop()
+        mock_rsp = self.get_mocked_response()
+        request_info = broker.register_request(
+            'async_id', self.get_mocked_request(), mock_rsp, 5, loop=loop)
+        # Responses are written from another thread, just like WebOutput
+        spawn(broker.write_response, 'async_id', body='body')
+        loop.run_until_complete(
+            broker.wait_for_response('async_id', request_info))
+        loop.close()
+
+        mock_rsp.set_body.assert_called_once_with('body')
+        mock_rsp.set_status.assert_called_once_with(200)
+        self.assertEqual(len(broker._registry), 0)
+
+    def test_async_timeout(self):
+        """ Tests that the async broker times out if not written in time """
+        broker = AsyncRequestResponseBroker('async')
+        loop = asyncio.new_event_loop()
+        mock_rsp = self.get_mocked_response()
+        broker.register_request(
+            'async_id', self.get_mocked_request(), mock_rsp, 0.5, loop=loop)
+        loop.run_until_complete(broker.wait_for_response('async_id'))
+        loop.close()
+
+        mock_rsp.set_status.assert_called_once_with(504)
+        with self.assertRaises(ValueError):
+            broker.write_response('async_id', body='body')
+
+    def test_async_expires_without_sweeper(self):
+        """ Waiting expires the request itself if the sweeper falls behind """
+        broker = AsyncRequestResponseBroker('async')
+        broker._expiry_grace = 0.1
+        broker._wheel = MagicMock()
+        loop = asyncio.new_event_loop()
+        mock_rsp = self.get_mocked_response()
+        broker.register_request(
+            'async_id', self.get_mocked_request(), mock_rsp, 0.1, loop=loop)
+        loop.run_until_complete(broker.wait_for_response('async_id'))
+        loop.close()
+        mock_rsp.set_status.assert_called_once_with(504)
+
+    def test_async_needs_loop(self):
+        """ A loop must be given when no event loop is running """
+        broker = AsyncRequestResponseBroker('async')
+        with self.assertRaises(RuntimeError):
+            broker.register_request(
+                'async_id', self.get_mocked_request(),
+                self.get_mocked_response(), 5)
+
+    def test_write_chunks(self):
+        """ Chunks stream into the response until one is final """
+        mock_rsp = self.get_mocked_response()
+        request_info = self.broker.register_request(
+            'chunk_id', self.get_mocked_request(), mock_rsp, 5)
+        self.broker.write_chunk('chunk_id', 'one', status=201,
+                                headers={'header_name': 'header_value'})
+        # The handler thread is released by the first chunk
+        self.broker.wait_for_response('chunk_id', request_info)
+        mock_rsp.set_status.assert_called_once_with(201)
+        mock_rsp.set_header.assert_called_once_with(
+            'header_name', 'header_value')
+        stream = mock_rsp.set_body.call_args[0][0]
+
+        self.broker.write_chunk('chunk_id', 'two')
+        self.broker.write_chunk('chunk_id', 'three', final=True)
+        self.assertEqual(list(stream), [b'one', b'two', b'three'])
+        self.assertEqual(len(self.broker._registry), 0)
+        with self.assertRaises(ValueError):
+            self.broker.write_chunk('chunk_id', 'four')
+
+    def test_stream_outlives_timeout(self):
+        """ Streams only expire once they stop getting chunks """
+        mock_rsp = self.get_mocked_response()
+        self.broker.register_request(
+            'chunk_id', self.get_mocked_request(), mock_rsp, 0.3)
+        for chunk in ['one', 'two', 'three']:
+            self.broker.write_chunk('chunk_id', chunk)
+            sleep(0.2)
+        # Writing a whole response ends the stream
+        self.broker.write_response('chunk_id', body='four')
+        stream = mock_rsp.set_body.call_args[0][0]
+        self.assertEqual(list(stream), [b'one', b'two', b'three', b'four'])
+        self.assertEqual(mock_rsp.set_status.call_count, 1)
+
+        self.broker.register_request(
+            'idle_id', self.get_mocked_request(), mock_rsp, 0.3)
+        self.broker.write_chunk('idle_id', 'one')
+        stream = mock_rsp.set_body.call_args[0][0]
+        sleep(1)
+        with self.assertRaises(ValueError):
+            self.broker.write_chunk('idle_id', 'two')
+        # The client sees the expired stream fail rather than end
+        with self.assertRaises(StreamFailedError):
+            list(stream)
+
+    def test_groups(self):
+        """ Blocks in the same group share a broker, others get their own """
+        broker = RequestResponseBroker.get_group('group', 10)
+        self.assertIs(RequestResponseBroker.get_group('group', 20), broker)
+        self.assertEqual(broker.max_requests, 20)
+        self.assertIsNot(RequestResponseBroker.get_group('other'), broker)
+
+    def test_for_request(self):
+        """ The broker for a request is found from the request ID """
+        req_id = self.broker.request_id('token')
+        self.assertIs(RequestResponseBroker.for_request(req_id), self.broker)
+        # IDs without a broker key go to the default broker
+        self.assertIs(RequestResponseBroker.for_request('token'),
+                      RequestResponseBroker.default())
+        with self.assertRaises(ValueError):
+            RequestResponseBroker.for_request('nokey.token')
+
+    def test_capacity(self):
+        """ A broker rejects requests beyond its limit and counts them """
+        broker = RequestResponseBroker('limited', max_requests=1)
+        broker.register_request(
+            'first', self.get_mocked_request(), self.get_mocked_response(), 5)
+        with self.assertRaises(BrokerCapacityError):
+            broker.register_request('second', self.get_mocked_request(),
+                                    self.get_mocked_response(), 5)
+        broker.write_response('first')
+        self.assertEqual(broker.stats(), {
+            'registered': 1,
+            'responded': 1,
+            'expired': 0,
+            'rejected': 1,
+            'late_writes': 0,
+            'pending': 0,
+            'max_requests': 1,
+        })
+
+    def test_not_modified(self):
+        """ Responses with the ETag the client already has are a 304 """
+        req = self.get_mocked_request()
+        req._headers = {'If-None-Match': '"v1"'}
+        mock_rsp = self.get_mocked_response()
+        self.broker.register_request('etag_id', req, mock_rsp, 5)
+        self.broker.write_response(
+            'etag_id', body='body', headers={'ETag': '"v1"'})
+        mock_rsp.set_status.assert_called_once_with(304)
+        self.assertEqual(mock_rsp.set_body.call_count, 0)
+        mock_rsp.set_header.assert_called_once_with('ETag', '"v1"')
+
+        # Other ETags are written in full
+        mock_rsp = self.get_mocked_response()
+        self.broker.register_request('etag_id', req, mock_rsp, 5)
+        self.broker.write_response(
+            'etag_id', body='body', headers={'ETag': '"v2"'})
+        mock_rsp.set_status.assert_called_once_with(200)
+        mock_rsp.set_body.assert_called_once_with('body')
+
+    def test_aggregated_parts(self):
+        """ Parts are collected until every expected one has been added """
+        self.broker.register_request(
+            'parts_id', self.get_mocked_request(),
+            self.get_mocked_response(), 5)
+        self.broker.expect_parts('parts_id', 3)
+        self.assertIsNone(self.broker.add_part('parts_id', 'one'))
+        self.assertIsNone(self.broker.add_part('parts_id', 'two'))
+        self.assertEqual(self.broker.add_part('parts_id', 'three'),
+                         ['one', 'two', 'three'])
+        with self.assertRaises(ValueError):
+            self.broker.add_part('parts_id', 'four')
+
+    def test_final_part(self):
+        """ A final part completes the response early """
+        self.broker.register_request(
+            'parts_id', self.get_mocked_request(),
+            self.get_mocked_response(), 5)
+        self.broker.expect_parts('parts_id', 3)
+        self.broker.add_part('parts_id', 'one')
+        self.assertEqual(self.broker.add_part('parts_id', 'two', final=True),
+                         ['one', 'two'])
+
+    def test_response_times(self):
+        """ The times a request was registered and responded to are saved """
+        info = self.broker.register_request(
+            'timed_id', self.get_mocked_request(),
+            self.get_mocked_response(), 5)
+        self.broker.write_response('timed_id', body='body')
+        self.assertLessEqual(info['registered'], info['responded'])
+
+    def test_merges_vary(self):
+        """ A response's Vary adds to the one the handler already set """
+        mock_rsp = self.get_mocked_response()
+        info = self.broker.register_request(
+            'vary_id', self.get_mocked_request(), mock_rsp, 5)
+        info['vary'] = 'Origin'
+        self.broker.write_response('vary_id', body='body', headers={
+            'Vary': 'Accept-Encoding'})
+        mock_rsp.set_header.assert_called_once_with(
+            'Vary', 'Origin, Accept-Encoding')
+
+    def test_logs_failed_expiry(self):
+        """ A request that fails to expire is logged, the rest expire """
+        broker = MagicMock()
+        broker._expire.side_effect = [RuntimeError, None]
+        RequestResponseBroker._expire_keys([(broker, 'a'), (broker, 'b')])
+        self.assertEqual(broker._expire.call_count, 2)
+        self.assertEqual(broker.logger.exception.call_count, 1)
+
     def get_mocked_request(self):
         req = Request()
         return req
@@ -68,7 +332,7 @@ class TestBroker(NIOBlockTestCase):
         req_id = str(uuid4())
         mock_rsp = self.get_mocked_response()
         mock_req = self.get_mocked_request()
-        RequestResponseBroker.register_request(
+        self.broker.register_request(
             req_id, mock_req, mock_rsp, timeout)
-        spawn(RequestResponseBroker.wait_for_response, req_id)
+        spawn(self.broker.wait_for_response, req_id)
         return req_id, mock_rsp
@@ -0,0 +1,94 @@
+from time import sleep
+
+from nio.testing.block_test_case import NIOBlockTestCase
+from nio.util.threading.spawn import spawn
+
+from ..cache import ResponseCache
+
+
+class TestResponseCache(NIOBlockTestCase):
+
+    def test_key_for(self):
+        """ Keys are built from the configured params and headers """
+        cache = ResponseCache(10, 1, params=['a'], headers=['Accept'])
+        self.assertEqual(
+            cache.key_for('GET', 'path', {'a': '1', 'b': '2'},
+                          {'accept': 'text/plain'}),
+            cache.key_for('GET', 'path', {'a': '1', 'b': '3'},
+                          {'Accept': 'text/plain'}))
+        self.assertNotEqual(
+            cache.key_for('GET', 'path', {'a': '1'}, {}),
+            cache.key_for('GET', 'path', {'a': '2'}, {}))
+        # Without configured params all of them are in the key
+        cache = ResponseCache(10, 1)
+        self.assertNotEqual(
+            cache.key_for('GET', 'path', {'a': '1', 'b': '2'}, {}),
+            cache.key_for('GET', 'path', {'a': '1', 'b': '3'}, {}))
+
+    def test_hit_and_miss(self):
+        cache = ResponseCache(10, 1)
+        response, flight, leader = cache.lookup('key')
+        self.assertIsNone(response)
+        self.assertTrue(leader)
+        cache.finish('key', flight, (200, 'body', None))
+        response, flight, leader = cache.lookup('key')
+        self.assertEqual(response, (200, 'body', None))
+        self.assertIsNone(flight)
+        stats = cache.stats()
+        self.assertEqual(stats['cache_hits'], 1)
+        self.assertEqual(stats['cache_misses'], 1)
+        self.assertEqual(stats['cache_entries'], 1)
+
+    def test_only_successes_cached(self):
+        cache = ResponseCache(10, 1)
+        _, flight, _ = cache.lookup('key')
+        cache.finish('key', flight, (500, 'error', None))
+        self.assertTrue(cache.lookup('key')[2])
+
+    def test_compressed_responses(self):
+        """ Compressed responses need Accept-Encoding in the key """
+        cache = ResponseCache(10, 1)
+        _, flight, _ = cache.lookup('key')
+        # Waiting callers may not accept the encoding, so they get nothing
+        _, _, leader = cache.lookup('key')
+        self.assertFalse(leader)
+        cache.finish('key', flight, (200, b'', {'Content-Encoding': 'gzip'}))
+        self.assertIsNone(flight.wait(0))
+        self.assertIsNone(cache.peek('key'))
+        self.assertIsNone(cache.lookup('key')[0])
+        cache = ResponseCache(10, 1, headers=['Accept-Encoding'])
+        _, flight, _ = cache.lookup('key')
+        cache.finish('key', flight, (200, b'', {'Content-Encoding': 'gzip'}))
+        self.assertIsNotNone(cache.lookup('key')[0])
+
+    def test_ttl(self):
+        cache = ResponseCache(10, 0.05)
+        _, flight, _ = cache.lookup('key')
+        cache.finish('key', flight, (200, 'body', None))
+        sleep(0.1)
+        self.assertIsNone(cache.lookup('key')[0])
+
+    def test_lru_eviction(self):
+        """ The least recently used response is evicted first """
+        cache = ResponseCache(2, 1)
+        for key in ['one', 'two']:
+            _, flight, _ = cache.lookup(key)
+            cache.finish(key, flight, (200, key, None))
+        cache.lookup('one')
+        _, flight, _ = cache.lookup('three')
+        cache.finish('three', flight, (200, 'three', None))
+        self.assertEqual(cache.lookup('one')[0], (200, 'one', None))
+        self.assertIsNone(cache.lookup('two')[0])
+        self.assertEqual(cache.stats()['cache_evictions'], 1)
+
+    def test_single_flight(self):
+        """ Callers missing the same key wait for one fetch """
+        cache = ResponseCache(10, 1)
+        _, flight, leader = cache.lookup('key')
+        self.assertTrue(leader)
+        _, follower_flight, leader = cache.lookup('key')
+        self.assertFalse(leader)
+        self.assertIs(follower_flight, flight)
+        spawn(cache.finish, 'key', flight, (200, 'body', None))
+        self.assertEqual(follower_flight.wait(1), (200, 'body', None))
+        self.assertEqual(cache.stats()['cache_coalesced'], 1)
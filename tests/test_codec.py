@@ -0,0 +1,60 @@
+from datetime import datetime
+from unittest import skipUnless
+from unittest.mock import patch
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from .. import codec
+from ..codec import JSONCodecType, get_codec, StdlibCodec, OrjsonCodec
+from ..web_handler_block import WebJSONHandler
+from ..web_output_block import WebJSONOutput
+
+
+class TestCodec(NIOBlockTestCase):
+
+    def test_stdlib(self):
+        """ The stdlib codec decodes str and bytes and encodes to bytes """
+        stdlib = get_codec(JSONCodecType.stdlib)
+        self.assertIsInstance(stdlib, StdlibCodec)
+        self.assertEqual(stdlib.loads('{"a": 1}'), {'a': 1})
+        self.assertEqual(stdlib.loads(b'{"a": 1}'), {'a': 1})
+        self.assertEqual(stdlib.dumps({'a': 1}), b'{"a": 1}')
+        # Types JSON doesn't know about are encoded as strings
+        when = datetime(2017, 1, 1)
+        self.assertEqual(stdlib.loads(stdlib.dumps({'when': when})),
+                         {'when': str(when)})
+        with self.assertRaises(ValueError):
+            stdlib.loads('not JSON')
+
+    def test_falls_back_to_stdlib(self):
+        """ Codecs that are not installed fall back to the stdlib """
+        with patch.object(codec, 'orjson', None), \
+                patch.object(codec, 'ujson', None), \
+                patch.object(codec, 'simdjson', None):
+            self.assertIsInstance(
+                get_codec(JSONCodecType.orjson), StdlibCodec)
+            self.assertEqual(get_codec(JSONCodecType.auto).name, 'stdlib')
+
+    @skipUnless(codec.orjson, "orjson is not installed")
+    def test_orjson(self):
+        """ orjson is preferred when installed and matches the stdlib """
+        orjson_codec = get_codec(JSONCodecType.auto)
+        self.assertIsInstance(orjson_codec, OrjsonCodec)
+        obj = {'a': [1, 2.5, None, True], 'b': {'c': 'd'}, 1: 'e'}
+        self.assertEqual(orjson_codec.loads(orjson_codec.dumps(obj)),
+                         StdlibCodec().loads(StdlibCodec().dumps(obj)))
+        with self.assertRaises(ValueError):
+            orjson_codec.loads('not JSON')
+
+    @skipUnless(codec.orjson, "orjson is not installed")
+    def test_orjson_falls_back_to_stdlib(self):
+        """ Objects orjson can't encode are encoded with the stdlib """
+        obj = {'a': 2 ** 70}
+        self.assertEqual(OrjsonCodec().dumps(obj), StdlibCodec().dumps(obj))
+
+    def test_stdlib_is_default(self):
+        """ The blocks encode with the stdlib unless told otherwise """
+        with patch(WebJSONHandler.__module__ + '.WebEngine'):
+            for block in (WebJSONHandler(), WebJSONOutput()):
+                self.configure_block(block, {})
+                self.assertEqual(block.json_codec(), JSONCodecType.stdlib)
@@ -0,0 +1,55 @@
+import gzip
+import zlib
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..compression import Compressor, available_encodings, negotiate, \
+    parse_accept_encoding
+
+
+class TestCompression(NIOBlockTestCase):
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(
+            parse_accept_encoding('gzip, deflate;q=0.5, br;q=0'),
+            {'gzip': 1.0, 'deflate': 0.5, 'br': 0.0})
+        self.assertEqual(parse_accept_encoding(None), {})
+
+    def test_negotiate(self):
+        """ The server's preferred encoding the client accepts wins """
+        encodings = ('gzip', 'deflate')
+        self.assertEqual(negotiate('deflate, gzip', encodings), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0.1, deflate', encodings),
+                         'deflate')
+        self.assertEqual(negotiate('gzip;q=0, *', encodings), 'deflate')
+        self.assertIsNone(negotiate('identity', encodings))
+        self.assertIsNone(negotiate('', encodings))
+
+    def test_available_encodings(self):
+        self.assertEqual(available_encodings(['Deflate', 'gzip', 'zstd']),
+                         ('gzip', 'deflate'))
+
+    def test_encode(self):
+        compressor = Compressor(['gzip', 'deflate'], min_size=10)
+        body = 'x' * 100
+        encoded, headers = compressor.encode(
+            body, {'ETag': '"v1"'}, 'gzip')
+        self.assertEqual(gzip.decompress(encoded), body.encode())
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['ETag'], '"v1-gzip"')
+
+        encoded, headers = compressor.encode(body, None, 'deflate')
+        self.assertEqual(zlib.decompress(encoded), body.encode())
+
+    def test_encode_skipped(self):
+        """ Small, already encoded and unaccepted bodies are left alone """
+        compressor = Compressor(['gzip'], min_size=10)
+        headers = {'Content-Type': 'text/plain'}
+        self.assertEqual(compressor.encode('small', headers, 'gzip'),
+                         ('small', headers))
+        self.assertEqual(compressor.encode('x' * 20, headers, None),
+                         ('x' * 20, headers))
+        encoded = {'Content-Encoding': 'gzip'}
+        self.assertEqual(compressor.encode(b'x' * 20, encoded, 'gzip'),
+                         (b'x' * 20, encoded))
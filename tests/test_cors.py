@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..cors import CORSHeaders, OriginList, is_preflight
+
+
+def request(headers):
+    req = MagicMock()
+    req._headers = headers
+    return req
+
+
+class TestCORS(NIOBlockTestCase):
+
+    def test_origin_list(self):
+        origins = OriginList(['https://app.local'],
+                             r'https://[a-z]+\.example\.com')
+        self.assertTrue(origins)
+        self.assertTrue(origins.allows('https://app.local'))
+        self.assertTrue(origins.allows('https://api.example.com'))
+        self.assertFalse(origins.allows('https://api.example.com.evil'))
+        self.assertFalse(origins.allows('https://other.local'))
+        self.assertFalse(origins.allows(None))
+        self.assertFalse(OriginList())
+
+    def test_static_headers(self):
+        """ Without an origin list the same headers are always sent """
+        headers = CORSHeaders({'Access-Control-Allow-Origin': '*'})
+        items = headers.items_for(request({'Origin': 'https://app.local'}))
+        self.assertEqual(items, (('Access-Control-Allow-Origin', '*'),))
+        self.assertIs(headers.items_for(request({})), items)
+
+    def test_echoes_allowed_origin(self):
+        """ Allowed origins are echoed back and responses vary on them """
+        headers = CORSHeaders({
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Max-Age': '600',
+        }, OriginList(['https://app.local']))
+        self.assertEqual(
+            headers.items_for(request({'Origin': 'https://app.local'})), (
+                ('Access-Control-Max-Age', '600'),
+                ('Access-Control-Allow-Origin', 'https://app.local'),
+                ('Vary', 'Origin'),
+            ))
+        self.assertEqual(
+            headers.items_for(request({'Origin': 'https://other.local'})),
+            (('Access-Control-Max-Age', '600'), ('Vary', 'Origin')))
+
+    def test_preflight(self):
+        self.assertTrue(is_preflight(request({
+            'Origin': 'https://app.local',
+            'Access-Control-Request-Method': 'PUT',
+        })))
+        self.assertFalse(is_preflight(request({})))
@@ -0,0 +1,29 @@
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..etag import etag_matches, hash_etag, quote_etag
+
+
+class TestETag(NIOBlockTestCase):
+
+    def test_hash_etag(self):
+        """ Equal bodies hash to the same quoted ETag """
+        self.assertEqual(hash_etag('body'), hash_etag(b'body'))
+        self.assertNotEqual(hash_etag('body'), hash_etag('other'))
+        self.assertTrue(hash_etag('body').startswith('"'))
+        self.assertIsNone(hash_etag(None))
+
+    def test_quote_etag(self):
+        self.assertEqual(quote_etag('v1'), '"v1"')
+        self.assertEqual(quote_etag('"v1"'), '"v1"')
+        self.assertEqual(quote_etag('W/"v1"'), 'W/"v1"')
+        self.assertEqual(quote_etag(2), '"2"')
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"v1"', '"v1"'))
+        self.assertTrue(etag_matches('"v0", "v1"', '"v1"'))
+        self.assertTrue(etag_matches('W/"v1"', '"v1"'))
+        self.assertTrue(etag_matches('"v1"', 'W/"v1"'))
+        self.assertTrue(etag_matches('*', '"v1"'))
+        self.assertFalse(etag_matches('"v0"', '"v1"'))
+        self.assertFalse(etag_matches(None, '"v1"'))
+        self.assertFalse(etag_matches('"v1"', None))
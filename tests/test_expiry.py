@@ -0,0 +1,60 @@
+from time import sleep
+from unittest.mock import MagicMock
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..expiry import TimingWheel
+
+
+class TestTimingWheel(NIOBlockTestCase):
+
+    def test_expires_in_bulk(self):
+        """ Keys due on the same sweep are expired in one call """
+        on_expire = MagicMock()
+        wheel = TimingWheel(on_expire, resolution=0.1)
+        wheel.schedule('a', 0.2)
+        wheel.schedule('b', 0.2)
+        wheel.schedule('later', 5)
+        sleep(0.5)
+        wheel.stop()
+        on_expire.assert_called_once_with(['a', 'b'])
+
+    def test_advance_by_hand(self):
+        """ The wheel can be swept synchronously to a point in time """
+        on_expire = MagicMock()
+        wheel = TimingWheel(on_expire, resolution=1, slots=4)
+        wheel.stop()
+        origin = wheel._origin
+        # A deadline more than one lap away shares a slot with a closer one
+        wheel._slots[1].append((1, 'soon'))
+        wheel._slots[1].append((5, 'next lap'))
+        self.assertEqual(wheel.advance(origin + 2.5), ['soon'])
+        self.assertEqual(wheel.advance(origin + 5.5), ['next lap'])
+        self.assertEqual(wheel.advance(origin + 10), [])
+
+    def test_stop_and_restart(self):
+        """ Scheduling after stopping starts a new sweeper """
+        on_expire = MagicMock()
+        wheel = TimingWheel(on_expire, resolution=0.05)
+        wheel.schedule('a', 0)
+        wheel.stop()
+        self.assertIsNone(wheel._thread)
+        wheel.schedule('b', 0)
+        sleep(0.3)
+        wheel.stop()
+        expired = [key for call in on_expire.call_args_list
+                   for key in call[0][0]]
+        self.assertIn('b', expired)
+
+    def test_logs_failed_expiry(self):
+        """ A failing callback is logged and the sweeper keeps going """
+        on_expire = MagicMock(side_effect=[RuntimeError, None])
+        wheel = TimingWheel(on_expire, resolution=0.05)
+        wheel.logger = MagicMock()
+        wheel.schedule('a', 0)
+        sleep(0.2)
+        wheel.schedule('b', 0)
+        sleep(0.2)
+        wheel.stop()
+        self.assertEqual(wheel.logger.exception.call_count, 1)
+        self.assertEqual(on_expire.call_count, 2)
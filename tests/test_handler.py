@@ -1,8 +1,14 @@
+import gzip
 from collections import defaultdict
 from unittest.mock import MagicMock
 from nio.testing.block_test_case import NIOBlockTestCase
-from ..handler import Handler
-from ..web_handler_block import WebHandler
+from ..cache import ResponseCache
+from ..codec import StdlibCodec
+from ..cors import OriginList
+from ..handler import Handler, JSONHandler
+from ..routes import Route, Router
+from ..sse import SubscriberLimitError
+from ..web_handler_block import WebHandler, WebJSONHandler
 
 
 class TestHandler(NIOBlockTestCase):
@@ -13,10 +19,359 @@ class TestHandler(NIOBlockTestCase):
         handler.on_post(MagicMock(), MagicMock())
         self.assertEqual(handler.run_request.call_args[0][0], 'POST')
 
+    def test_handler_sheds_load(self):
+        """ Requests that are not admitted get a 503 and no signal """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        blk.get_admission.return_value.acquire.return_value = False
+        blk.get_retry_after.return_value = 3
+        handler = Handler(endpoint='', blk=blk)
+        rsp = MagicMock()
+        handler.run_request('GET', MagicMock(), rsp)
+        rsp.set_status.assert_called_once_with(503)
+        rsp.set_header.assert_called_once_with('Retry-After', '3')
+        self.assertEqual(blk.get_broker.call_count, 0)
+        self.assertEqual(blk.emit_request_signal.call_count, 0)
+
+    def test_handler_timeout_header(self):
+        """ Clients may ask for a shorter timeout than the block's """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_timeout_seconds.return_value = 10
+        blk.get_timeout_header.return_value = 'X-Request-Timeout'
+        handler = Handler(endpoint='', blk=blk)
+        req = MagicMock()
+        for requested, timeout in [('2.5', 2.5), ('30', 10), ('0', 10),
+                                   ('soon', 10), (None, 10)]:
+            req._headers = {'x-request-timeout': requested}
+            self.assertEqual(handler.timeout_for(req), timeout)
+
+    def test_handler_records_request(self):
+        """ Requests that were waited on are recorded with their times """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        blk.get_broker.return_value.register_request.side_effect = \
+            lambda *args: {'registered': 0}
+        handler = Handler(endpoint='', blk=blk)
+        handler.run_request('GET', MagicMock(), MagicMock())
+        request_id, request_info, now = blk.record_request.call_args[0]
+        # The block sets the notified time, with the request's info
+        self.assertIs(blk.emit_request_signal.call_args[0][1], request_info)
+        self.assertEqual(blk.count_status.call_count, 0)
+
+    def test_handler_counts_rejections(self):
+        """ Requests answered without a signal are counted by status """
+        blk = MagicMock(spec=WebHandler())
+        blk.supports_method.return_value = False
+        handler = Handler(endpoint='', blk=blk)
+        handler.on_delete(MagicMock(), MagicMock())
+        blk.count_status.assert_called_once_with(405)
+
+    def test_handler_counts_failures(self):
+        """ Requests that fail with an exception are counted as a 500 """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        blk.emit_request_signal.side_effect = RuntimeError
+        handler = Handler(endpoint='', blk=blk)
+        with self.assertRaises(RuntimeError):
+            handler.run_request('GET', MagicMock(), MagicMock())
+        blk.count_status.assert_called_once_with(500)
+        blk.count_status.reset_mock()
+        handler.build_output_signals = MagicMock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            handler.run_request('GET', MagicMock(), MagicMock())
+        blk.count_status.assert_called_once_with(500)
+
+    def test_handler_releases_admission(self):
+        """ Admitted requests give back their slot when done """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        handler = Handler(endpoint='', blk=blk)
+        handler.run_request('GET', MagicMock(), MagicMock())
+        self.assertEqual(blk.emit_request_signal.call_count, 1)
+        self.assertEqual(blk.get_admission.return_value.release.call_count, 1)
+
+    def test_handler_cached_response(self):
+        """ Cached GET responses are answered without a signal """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = ResponseCache(10, 60)
+        broker = blk.get_broker.return_value
+        broker.wait_for_response.side_effect = \
+            lambda req_id, info: info.update(response=(200, 'body', {}))
+        broker.register_request.side_effect = lambda *args: {}
+        handler = Handler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {}
+        req.get_params.return_value = {'key': 'value'}
+        handler.run_request('GET', req, MagicMock())
+        for _ in range(2):
+            rsp = MagicMock()
+            handler.run_request('GET', req, rsp)
+            rsp.set_body.assert_called_once_with('body')
+            rsp.set_status.assert_called_once_with(200)
+        self.assertEqual(blk.emit_request_signal.call_count, 1)
+        # Other params are cached separately
+        req.get_params.return_value = {'key': 'other'}
+        handler.run_request('GET', req, MagicMock())
+        self.assertEqual(blk.emit_request_signal.call_count, 2)
+
+    def test_handler_cached_not_modified(self):
+        """ Cached responses the client already has are a 304 """
+        handler = Handler(endpoint='', blk=MagicMock(spec=WebHandler()))
+        req = MagicMock()
+        req._headers = {'If-None-Match': '"v1"'}
+        rsp = MagicMock()
+        handler.write_cached_response(
+            (200, 'body', {'ETag': '"v1"'}), req, rsp)
+        rsp.set_status.assert_called_once_with(304)
+        self.assertEqual(rsp.set_body.call_count, 0)
+
+    def test_handler_routes(self):
+        """ Requests are matched to routes and get their path params """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        router = Router([Route('/users/{user_id}', ['GET'])])
+        handler = Handler(endpoint='', blk=blk, router=router)
+        req = MagicMock()
+        req.get_identifier.return_value = 'users/7'
+        handler.run_request('GET', req, MagicMock())
+        signal = blk.emit_request_signal.call_args[0][0]
+        self.assertEqual(signal.route, '/users/{user_id}')
+        self.assertEqual(signal.path_params, {'user_id': '7'})
+
+        # Other methods are not allowed on the route
+        rsp = MagicMock()
+        handler.run_request('POST', req, rsp)
+        rsp.set_status.assert_called_once_with(405)
+        rsp.set_header.assert_called_once_with('Allow', 'GET')
+
+        # Paths without a route are not found
+        req.get_identifier.return_value = 'other'
+        rsp = MagicMock()
+        handler.run_request('GET', req, rsp)
+        rsp.set_status.assert_called_once_with(404)
+        self.assertEqual(blk.emit_request_signal.call_count, 1)
+
+    def test_json_handler_codec(self):
+        """ The JSON handler decodes request bodies with its codec """
+        codec = MagicMock(spec=StdlibCodec())
+        codec.loads.return_value = {'key': 'value'}
+        blk = MagicMock(spec=WebHandler())
+        blk.get_max_body_size.return_value = 0
+        handler = JSONHandler(endpoint='', blk=blk, codec=codec)
+        req = MagicMock()
+        req._headers = {}
+        req.get_body.return_value = b'{"key": "value"}'
+        self.assertEqual(handler.get_body_for_signal(req), {'key': 'value'})
+        codec.loads.assert_called_once_with(b'{"key": "value"}')
+
+    def test_json_handler_compressed_body(self):
+        """ Compressed JSON bodies are decoded before they are parsed """
+        blk = MagicMock(spec=WebJSONHandler())
+        blk.get_max_body_size.return_value = 0
+        blk.get_max_decompressed_size.return_value = 100
+        handler = JSONHandler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {'Content-Encoding': 'gzip'}
+        req.get_body.return_value = gzip.compress(b'{"key": "value"}')
+        self.assertEqual(handler.get_body_for_signal(req), {'key': 'value'})
+
+        # Bodies that decompress past the limit get a 413
+        req.get_body.return_value = gzip.compress(b' ' * 101)
+        rsp = MagicMock()
+        handler.process_request('POST', req, rsp, include_body=True)
+        rsp.set_status.assert_called_once_with(413)
+
+        # Encodings that can't be decoded get a 415
+        req._headers = {'Content-Encoding': 'br'}
+        rsp = MagicMock()
+        handler.process_request('POST', req, rsp, include_body=True)
+        rsp.set_status.assert_called_once_with(415)
+        self.assertEqual(blk.emit_request_signal.call_count, 0)
+
+    def test_json_handler_bulk(self):
+        """ Bulk bodies are notified as a signal per record """
+        blk = MagicMock(spec=WebJSONHandler())
+        blk.get_max_body_size.return_value = 0
+        blk.accepts_bulk.return_value = True
+        handler = JSONHandler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {}
+        req.get_params.return_value = {}
+        req.get_body.return_value = b'[{"key": 1}, {"key": 2}]'
+        handler.process_request('POST', req, MagicMock(), include_body=True)
+        broker = blk.get_broker.return_value
+        request_id = broker.request_id.return_value
+        broker.expect_parts.assert_called_once_with(request_id, 2)
+        signals = blk.emit_request_signals.call_args[0][0]
+        self.assertEqual([sig.key for sig in signals], [1, 2])
+        self.assertTrue(all(sig._id == request_id for sig in signals))
+
+        # Newline delimited JSON works the same way
+        req._headers = {'Content-Type': 'application/x-ndjson'}
+        req.get_body.return_value = b'{"key": 3}\n\n{"key": 4}\n'
+        signals = handler.build_output_signals('id', req, 'POST', True)
+        self.assertEqual([sig.key for sig in signals], [3, 4])
+
+        # Records must be dictionaries
+        req.get_body.return_value = b'{"key": 3}\n[]\n'
+        with self.assertRaises(TypeError):
+            handler.build_output_signals('id', req, 'POST', True)
+
+    def test_handler_rejects_declared_large_body(self):
+        """ Bodies declared over the limit get a 413 before any work """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_max_body_size.return_value = 10
+        handler = Handler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {'Content-Length': '11'}
+        rsp = MagicMock()
+        handler.run_request('POST', req, rsp, include_body=True)
+        rsp.set_status.assert_called_once_with(413)
+        self.assertEqual(blk.get_admission.call_count, 0)
+        self.assertEqual(req.get_body.call_count, 0)
+
+    def test_handler_rejects_read_large_body(self):
+        """ Bodies found to be over the limit are never registered """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_max_body_size.return_value = 10
+        blk.streams_body.return_value = False
+        handler = Handler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {}
+        req.get_body.return_value = b'x' * 11
+        rsp = MagicMock()
+        handler.run_request('POST', req, rsp, include_body=True)
+        rsp.set_status.assert_called_once_with(413)
+        broker = blk.get_broker.return_value
+        self.assertEqual(broker.register_request.call_count, 0)
+        self.assertEqual(blk.emit_request_signal.call_count, 0)
+
+    def test_handler_streams_body(self):
+        """ Bodies can go on the signal as a file instead of bytes """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_max_body_size.return_value = 0
+        blk.streams_body.return_value = True
+        handler = Handler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {}
+        req.get_body.return_value = b'body'
+        body = handler.get_body_for_signal(req)
+        self.assertEqual(body.read(), b'body')
+
+    def test_handler_subscribes(self):
+        """ Event stream requests subscribe rather than make a request """
+        blk = MagicMock(spec=WebHandler())
+        blk.accepts_subscriptions.return_value = True
+        handler = Handler(endpoint='', blk=blk)
+        handler.run_request = MagicMock()
+        req = MagicMock()
+        req._headers = {'Accept': 'text/event-stream'}
+        rsp = MagicMock()
+        handler.on_get(req, rsp)
+        rsp.set_header.assert_any_call('Content-Type', 'text/event-stream')
+        rsp.set_body.assert_called_once_with(blk.subscribe.return_value)
+        self.assertEqual(handler.run_request.call_count, 0)
+        # Other GET requests are still regular requests
+        req._headers = {}
+        handler.on_get(req, MagicMock())
+        self.assertEqual(handler.run_request.call_count, 1)
+
+    def test_handler_refuses_subscription(self):
+        """ Subscriptions past the channel's limit get a 503 """
+        blk = MagicMock(spec=WebHandler())
+        blk.accepts_subscriptions.return_value = True
+        blk.subscribe.side_effect = SubscriberLimitError
+        blk.get_retry_after.return_value = 1
+        handler = Handler(endpoint='', blk=blk)
+        req = MagicMock()
+        req._headers = {'Accept': 'text/event-stream'}
+        rsp = MagicMock()
+        handler.on_get(req, rsp)
+        rsp.set_status.assert_called_once_with(503)
+        self.assertEqual(rsp.set_body.call_count, 0)
+
     def test_handler_options(self):
         handler = Handler(endpoint='', blk=MagicMock(spec=WebHandler()))
         handler.on_options(MagicMock(), MagicMock())
 
+    def test_handler_preflight(self):
+        """ Preflights are answered with the headers for their origin """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_allowed_methods.return_value = 'GET, OPTIONS, PUT'
+        handler = Handler(endpoint='', blk=blk,
+                          headers={'Access-Control-Max-Age': '600'},
+                          origins=OriginList(['https://app.local']))
+        handler.run_request = MagicMock()
+        req = MagicMock()
+        req._headers = {
+            'Origin': 'https://app.local',
+            'Access-Control-Request-Method': 'PUT',
+        }
+        rsp = MagicMock()
+        handler.on_options(req, rsp)
+        self.assertDictEqual(
+            dict(call[0] for call in rsp.set_header.call_args_list), {
+                'Allow': 'GET, OPTIONS, PUT',
+                'Access-Control-Max-Age': '600',
+                'Access-Control-Allow-Origin': 'https://app.local',
+                'Vary': 'Origin',
+            })
+        rsp.set_status.assert_called_once_with(204)
+        self.assertEqual(handler.run_request.call_count, 0)
+
+    def test_handler_keeps_vary(self):
+        """ The CORS Vary is saved so responses merge with it """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        blk.get_broker.return_value.register_request.side_effect = \
+            lambda *args: {'registered': 0}
+        handler = Handler(endpoint='', blk=blk,
+                          origins=OriginList(['https://app.local']))
+        req = MagicMock()
+        req._headers = {'Origin': 'https://other.local'}
+        handler.run_request('GET', req, MagicMock())
+        request_id, request_info, now = blk.record_request.call_args[0]
+        self.assertEqual(request_info['vary'], 'Origin')
+
+    def test_handler_method_not_allowed(self):
+        """ Methods the block does not allow get a 405 before anything else """
+        blk = MagicMock(spec=WebHandler())
+        blk.supports_method.return_value = False
+        blk.get_allowed_methods.return_value = 'GET, HEAD, OPTIONS'
+        handler = Handler(endpoint='', blk=blk,
+                          headers={'Access-Control-Allow-Origin': '*'})
+        handler.run_request = MagicMock()
+        rsp = MagicMock()
+        handler.on_post(MagicMock(), rsp)
+        rsp.set_status.assert_called_once_with(405)
+        rsp.set_header.assert_called_once_with('Allow', 'GET, HEAD, OPTIONS')
+        self.assertEqual(handler.run_request.call_count, 0)
+
+    def test_handler_head(self):
+        """ HEAD requests are answered without notifying a signal """
+        blk = MagicMock(spec=WebHandler())
+        blk.get_response_cache.return_value = None
+        handler = Handler(endpoint='', blk=blk)
+        rsp = MagicMock()
+        handler.on_head(MagicMock(), rsp)
+        rsp.set_status.assert_called_once_with(200)
+        self.assertEqual(blk.get_broker.call_count, 0)
+
+        cache = ResponseCache(10, 60)
+        blk.get_response_cache.return_value = cache
+        req = MagicMock()
+        req._headers = {}
+        req.get_params.return_value = {}
+        key = handler.cache_key(cache, 'GET', req)
+        _, flight, _ = cache.lookup(key)
+        cache.finish(key, flight, (200, 'body', {'ETag': '"1"'}))
+        rsp = MagicMock()
+        handler.on_head(req, rsp)
+        rsp.set_status.assert_called_once_with(200)
+        rsp.set_header.assert_called_once_with('ETag', '"1"')
+        self.assertEqual(rsp.set_body.call_count, 0)
+        self.assertEqual(blk.get_broker.call_count, 0)
+
     def test_handler_headers(self):
         """ Handler should add optional headers to all request types """
         headers = {
@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..headers import get_header, merge_vary, set_headers, \
+    split_names
+
+
+class TestHeaders(NIOBlockTestCase):
+
+    def test_get_header(self):
+        """ Headers are found whatever their case """
+        headers = {'Content-Type': 'text/plain', 'x-custom': 'value'}
+        self.assertEqual(get_header(headers, 'content-type'), 'text/plain')
+        self.assertEqual(get_header(headers, 'X-Custom'), 'value')
+        self.assertEqual(get_header(headers, 'Missing', 'default'),
+                         'default')
+        self.assertIsNone(get_header(None, 'Content-Type'))
+
+    def test_split_names(self):
+        """ Comma separated names are split, skipping blanks """
+        self.assertEqual(split_names(' a, b,,c '), ['a', 'b', 'c'])
+        self.assertEqual(split_names(None), [])
+
+    def test_merge_vary(self):
+        """ Vary values combine, keeping each name once """
+        self.assertEqual(merge_vary('Origin', 'Accept-Encoding'),
+                         'Origin, Accept-Encoding')
+        self.assertEqual(merge_vary('Origin', 'origin, Accept'),
+                         'Origin, Accept')
+        self.assertEqual(merge_vary(None, 'Accept'), 'Accept')
+        self.assertEqual(merge_vary('Origin', '*'), '*')
+
+    def test_set_headers(self):
+        """ Only the Vary header is merged with the one already set """
+        rsp = MagicMock()
+        set_headers(rsp, {'vary': 'Accept-Encoding', 'ETag': '"1"'},
+                    'Origin')
+        rsp.set_header.assert_any_call('vary', 'Origin, Accept-Encoding')
+        rsp.set_header.assert_any_call('ETag', '"1"')
@@ -0,0 +1,64 @@
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..metrics import Histogram, RequestMetrics
+
+
+class TestMetrics(NIOBlockTestCase):
+
+    def test_histogram(self):
+        histogram = Histogram((1, 2, 5))
+        self.assertIsNone(histogram.percentile(0.5))
+        for value in (0.5, 1, 1.5, 4, 10):
+            histogram.observe(value)
+        counts, total, count = histogram.snapshot()
+        self.assertEqual(counts, [2, 1, 1, 1])
+        self.assertEqual(total, 17)
+        self.assertEqual(count, 5)
+        self.assertEqual(histogram.percentile(0.4), 1)
+        self.assertEqual(histogram.percentile(0.6), 2)
+        self.assertEqual(histogram.percentile(0.99), float('inf'))
+
+    def test_records_requests(self):
+        metrics = RequestMetrics()
+        metrics.record({
+            'registered': 10,
+            'notified': 10.002,
+            'responded': 10.3,
+            'expired': False,
+            'response': (200, 'body', {}),
+        }, 10.301)
+        metrics.record({
+            'registered': 10,
+            'notified': 10.001,
+            'expired': True,
+        }, 15)
+        metrics.count_status(404)
+        metrics.count_status(501)
+        stats = metrics.stats()
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['responses_501'], 1)
+        self.assertEqual(stats['responses_4xx'], 1)
+        self.assertEqual(stats['responses_5xx'], 2)
+        self.assertEqual(stats['queue_p99'], 0.0025)
+        self.assertEqual(stats['service_p50'], 0.5)
+        self.assertEqual(stats['total_p99'], 5)
+
+    def test_prometheus(self):
+        metrics = RequestMetrics(bounds=(0.1, 1))
+        metrics.record({
+            'registered': 0,
+            'notified': 0.05,
+            'responded': 0.5,
+            'expired': False,
+        }, 0.5)
+        lines = metrics.prometheus(labels={'block': 'handler'}).splitlines()
+        self.assertIn('# TYPE web_handler_total_seconds histogram', lines)
+        self.assertIn(
+            'web_handler_total_seconds_bucket{block="handler",le="0.1"} 0',
+            lines)
+        self.assertIn(
+            'web_handler_total_seconds_bucket{block="handler",le="+Inf"} 1',
+            lines)
+        self.assertIn('web_handler_total_seconds_count{block="handler"} 1',
+                      lines)
+        self.assertIn('web_handler_requests_total{block="handler"} 1', lines)
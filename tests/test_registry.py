@@ -0,0 +1,52 @@
+from threading import Thread
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..registry import ShardedRegistry
+
+
+class TestShardedRegistry(NIOBlockTestCase):
+
+    def test_mapping_operations(self):
+        """ The registry saves, returns and removes values by key """
+        registry = ShardedRegistry(shards=4)
+        registry.add('key', 'value')
+        self.assertIn('key', registry)
+        self.assertEqual(registry.get('key'), 'value')
+        self.assertEqual(len(registry), 1)
+        self.assertEqual(registry.pop('key'), 'value')
+        self.assertNotIn('key', registry)
+        self.assertIsNone(registry.get('key'))
+        self.assertEqual(registry.pop('key', 'default'), 'default')
+
+    def test_shards_round_to_power_of_two(self):
+        registry = ShardedRegistry(shards=5)
+        self.assertEqual(len(registry._shards), 8)
+
+    def test_clear(self):
+        registry = ShardedRegistry()
+        for key in range(100):
+            registry.add(key, key)
+        self.assertEqual(len(registry), 100)
+        registry.clear()
+        self.assertEqual(len(registry), 0)
+
+    def test_pop_claims_once(self):
+        """ Only one of many concurrent pops gets the value """
+        registry = ShardedRegistry()
+        claimed = []
+        for key in range(200):
+            registry.add(key, key)
+
+        def claim():
+            for key in range(200):
+                value = registry.pop(key)
+                if value is not None:
+                    claimed.append(value)
+
+        threads = [Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), list(range(200)))
@@ -0,0 +1,36 @@
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..request_ids import RequestIdFormat, get_generator, CounterGenerator, \
+    TokenGenerator, UUIDGenerator
+
+
+class TestRequestIds(NIOBlockTestCase):
+
+    def test_formats(self):
+        """ Each format makes unique IDs of its own shape """
+        for id_format, length in [(RequestIdFormat.uuid, 36),
+                                  (RequestIdFormat.token, 16)]:
+            generator = get_generator(id_format)
+            ids = {generator() for _ in range(1000)}
+            self.assertEqual(len(ids), 1000)
+            self.assertTrue(all(len(req_id) == length for req_id in ids))
+
+    def test_counter(self):
+        """ Counter IDs are sequential behind a per-generator prefix """
+        generator = get_generator(RequestIdFormat.counter)
+        self.assertIsInstance(generator, CounterGenerator)
+        first, second = generator(), generator()
+        self.assertEqual(first[:-1], second[:-1])
+        self.assertEqual(first[-1], '0')
+        self.assertEqual(second[-1], '1')
+        # A new generator, e.g. after a block restart, uses a new prefix
+        self.assertNotEqual(get_generator(RequestIdFormat.counter)(), first)
+
+    def test_guessable_replaced(self):
+        """ Guessable formats are swapped for tokens when not allowed """
+        self.assertIsInstance(
+            get_generator(RequestIdFormat.counter, allow_guessable=False),
+            TokenGenerator)
+        self.assertIsInstance(
+            get_generator(RequestIdFormat.uuid, allow_guessable=False),
+            UUIDGenerator)
@@ -0,0 +1,47 @@
+from unittest.mock import MagicMock
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..routes import Route, Router, request_path
+
+
+class TestRoutes(NIOBlockTestCase):
+
+    def test_request_path(self):
+        req = MagicMock()
+        req.get_identifier.return_value = 'users/1/'
+        self.assertEqual(request_path(req), '/users/1')
+        req.get_identifier.return_value = None
+        self.assertEqual(request_path(req), '/')
+
+    def test_route_match(self):
+        route = Route('users/{user_id}/posts/{post_id}')
+        self.assertEqual(route.pattern, '/users/{user_id}/posts/{post_id}')
+        self.assertFalse(route.static)
+        self.assertEqual(route.match('/users/1/posts/a.b'),
+                         {'user_id': '1', 'post_id': 'a.b'})
+        self.assertIsNone(route.match('/users/1/posts'))
+        self.assertIsNone(route.match('/users/1/posts/2/more'))
+        # Literal parts of patterns are not regular expressions
+        self.assertIsNone(Route('/a.c').match('/abc'))
+        self.assertEqual(Route('/a.c').match('/a.c'), {})
+
+    def test_router(self):
+        router = Router([
+            Route('/users', ['GET']),
+            Route('/users', ['post']),
+            Route('/users/{user_id}', ['GET', 'PUT']),
+            Route('/health'),
+        ])
+        match, _ = router.match('POST', '/users')
+        self.assertEqual(match.route.methods, {'POST'})
+        match, _ = router.match('PUT', '/users/7')
+        self.assertEqual(match.params, {'user_id': '7'})
+        match, _ = router.match('DELETE', '/health')
+        self.assertEqual(match.route.pattern, '/health')
+
+    def test_router_misses(self):
+        router = Router([Route('/users/{user_id}', ['GET', 'PUT'])])
+        self.assertEqual(router.match('DELETE', '/users/7'),
+                         (None, {'GET', 'PUT'}))
+        self.assertEqual(router.match('GET', '/other'), (None, set()))
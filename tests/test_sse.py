@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock
+
+from nio.testing.block_test_case import NIOBlockTestCase
+
+from ..sse import SlowClientPolicy, SubscriberLimitError, \
+    SubscriptionChannel, accepts_event_stream, format_event
+
+
+class TestSubscriptionChannel(NIOBlockTestCase):
+
+    def test_format_event(self):
+        """ Each line of data gets its own data field """
+        self.assertEqual(format_event('one\ntwo', event='update'),
+                         b'event: update\ndata: one\ndata: two\n\n')
+        self.assertEqual(format_event(b'{"a": 1}'), b'data: {"a": 1}\n\n')
+
+    def test_accepts_event_stream(self):
+        req = MagicMock()
+        req._headers = {'accept': 'text/event-stream'}
+        self.assertTrue(accepts_event_stream(req))
+        req._headers = {'Accept': 'application/json'}
+        self.assertFalse(accepts_event_stream(req))
+
+    def test_get_channel(self):
+        """ Channels are shared by name """
+        channel = SubscriptionChannel.get_channel('test_get_channel')
+        self.assertIs(
+            SubscriptionChannel.get_channel('test_get_channel'), channel)
+
+    def test_fan_out(self):
+        """ Every subscriber gets every published event """
+        channel = SubscriptionChannel('test')
+        first = iter(channel.subscribe())
+        second = iter(channel.subscribe())
+        self.assertEqual(next(first), b': subscribed\n\n')
+        self.assertEqual(next(second), b': subscribed\n\n')
+        self.assertEqual(channel.publish('one'), 2)
+        self.assertEqual(channel.publish('two'), 2)
+        self.assertEqual(next(first), b'data: one\n\ndata: two\n\n')
+        self.assertEqual(next(second), b'data: one\n\ndata: two\n\n')
+        self.assertEqual(channel.stats()['subscribers'], 2)
+        # Closing the body unsubscribes the client
+        first.close()
+        self.assertEqual(channel.stats()['subscribers'], 1)
+
+    def test_keepalive(self):
+        """ A comment is sent when nothing is published for a while """
+        channel = SubscriptionChannel('test')
+        events = iter(channel.subscribe(keepalive=0.01))
+        next(events)
+        self.assertEqual(next(events), b': keepalive\n\n')
+
+    def test_slow_client_dropped_events(self):
+        """ Events over a client's buffer are dropped for that client """
+        channel = SubscriptionChannel('test')
+        events = iter(channel.subscribe(buffer_size=2))
+        next(events)
+        for index in range(3):
+            channel.publish(index)
+        self.assertEqual(next(events), b'data: 0\n\ndata: 1\n\n')
+        self.assertEqual(channel.stats()['dropped'], 1)
+
+    def test_slow_client_disconnected(self):
+        """ Clients over their buffer can be disconnected instead """
+        channel = SubscriptionChannel('test')
+        events = iter(channel.subscribe(
+            buffer_size=1, policy=SlowClientPolicy.disconnect))
+        next(events)
+        self.assertEqual(channel.publish('one'), 1)
+        self.assertEqual(channel.publish('two'), 0)
+        self.assertEqual(list(events), [])
+        self.assertEqual(channel.stats()['subscribers'], 0)
+
+    def test_max_subscribers(self):
+        """ Subscriptions past the limit are refused until one leaves """
+        channel = SubscriptionChannel('test')
+        subscriber = channel.subscribe(max_subscribers=1)
+        with self.assertRaises(SubscriberLimitError):
+            channel.subscribe(max_subscribers=1)
+        self.assertEqual(channel.stats()['refused'], 1)
+        channel.unsubscribe(subscriber)
+        channel.subscribe(max_subscribers=1)
+        self.assertEqual(channel.stats()['subscribers'], 1)
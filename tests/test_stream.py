@@ -0,0 +1,60 @@
+from time import monotonic, sleep
+
+from nio.testing.block_test_case import NIOBlockTestCase
+from nio.util.threading.spawn import spawn
+
+from ..stream import ChunkStream, StreamFailedError
+
+
+class TestChunkStream(NIOBlockTestCase):
+
+    def test_iterates_chunks(self):
+        """ Chunks are read in order as bytes until the stream closes """
+        stream = ChunkStream(1)
+        stream.put('one')
+        stream.put(b'two')
+        stream.put('')
+        stream.close()
+        self.assertEqual(list(stream), [b'one', b'two'])
+        with self.assertRaises(ValueError):
+            stream.put('three')
+
+    def test_bounded_buffer(self):
+        """ A writer never outruns a reader that keeps up """
+        stream = ChunkStream(5, max_chunks=2)
+        chunks = []
+        reader = spawn(lambda: chunks.extend(stream))
+        for index in range(10):
+            stream.put(str(index))
+            sleep(0.01)
+        stream.close()
+        reader.join()
+        self.assertEqual(len(chunks), 10)
+
+    def test_reader_gone(self):
+        """ Writing to a full buffer fails the stream without waiting """
+        stream = ChunkStream(5, max_chunks=1)
+        stream.put('one')
+        start = monotonic()
+        with self.assertRaises(ValueError):
+            stream.put('two')
+        self.assertLess(monotonic() - start, 1)
+        with self.assertRaises(StreamFailedError):
+            list(stream)
+
+    def test_writer_gone(self):
+        """ Reading fails if nothing is written in time """
+        stream = ChunkStream(0.1)
+        stream.put('one')
+        chunks = []
+        with self.assertRaises(StreamFailedError):
+            for chunk in stream:
+                chunks.append(chunk)
+        self.assertEqual(chunks, [b'one'])
+
+    def test_closed_while_full(self):
+        """ A stream closed with a full buffer ends once it is read """
+        stream = ChunkStream(5, max_chunks=1)
+        stream.put('one')
+        stream.close()
+        self.assertEqual(list(stream), [b'one'])
@@ -0,0 +1,44 @@
+import json
+import pickle
+from copy import deepcopy
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..views import ReadOnlyDict, select_headers
+
+
+class TestViews(NIOBlockTestCase):
+
+    def test_read_only_dict(self):
+        headers = ReadOnlyDict({'Accept': '*/*'})
+        self.assertEqual(headers['Accept'], '*/*')
+        for change in (lambda: headers.update(a=1),
+                       lambda: headers.pop('Accept'),
+                       lambda: headers.setdefault('a', 1),
+                       headers.clear):
+            with self.assertRaises(TypeError):
+                change()
+        with self.assertRaises(TypeError):
+            headers['Accept'] = 'text/plain'
+        # It is encoded like any other dict
+        self.assertEqual(json.dumps(headers), '{"Accept": "*/*"}')
+        self.assertEqual(json.dumps(headers, default=str),
+                         '{"Accept": "*/*"}')
+
+    def test_copies_are_dicts(self):
+        """ Copies and pickles are plain dicts that can be changed """
+        headers = ReadOnlyDict({'key': 'value'})
+        for copied in (headers.copy(), deepcopy(headers),
+                       pickle.loads(pickle.dumps(headers))):
+            self.assertIs(type(copied), dict)
+            self.assertEqual(copied, {'key': 'value'})
+
+    def test_select_headers(self):
+        headers = {'Content-Type': 'text/plain', 'X-Trace': '1'}
+        # Every header is copied, so the request's own can't be changed
+        selected = select_headers(headers)
+        self.assertIsInstance(selected, ReadOnlyDict)
+        self.assertIsNot(selected, headers)
+        self.assertEqual(selected, headers)
+        selected = select_headers(headers, frozenset(['content-type']))
+        self.assertIsInstance(selected, ReadOnlyDict)
+        self.assertEqual(selected, {'Content-Type': 'text/plain'})
+        self.assertEqual(select_headers(None, frozenset(['a'])), {})
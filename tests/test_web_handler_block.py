@@ -1,7 +1,9 @@
 from unittest.mock import MagicMock, patch
 from collections import defaultdict
-from ..web_handler_block import WebHandler
+from ..web_handler_block import WebHandler, WebJSONHandler
+from ..broker import RequestResponseBroker
 from ..handler import Handler
+from ..request_ids import CounterGenerator, TokenGenerator
 from nio.testing.block_test_case import NIOBlockTestCase
 
 
@@ -26,8 +28,7 @@ class TestWebHandler(NIOBlockTestCase):
         self.assertEqual(mock_web_engine.add_server.call_args[0][0], 1234)
         self.assertEqual(mock_web_engine.add_server.call_args[0][1],
                          "fakehost")
-        # TODO: These all return True now, update when support for
-        # different methods is available
+        # With no allowed_methods configured every method is supported
         self.assertTrue(blk.supports_method('GET'))
         self.assertTrue(blk.supports_method('POST'))
         self.assertTrue(blk.supports_method('PUT'))
@@ -35,6 +36,20 @@ class TestWebHandler(NIOBlockTestCase):
         self.assertTrue(blk.supports_method('NOTAMETHOD'))
         self.assertTrue(blk.supports_method('OPTIONS'))
 
+    def test_allowed_methods(self):
+        """ Only the allowed methods are supported, along with HEAD and
+        OPTIONS """
+        blk = WebHandler()
+        self.configure_block(blk, {'allowed_methods': 'get, post'})
+        self.assertTrue(blk.supports_method('GET'))
+        self.assertTrue(blk.supports_method('HEAD'))
+        self.assertTrue(blk.supports_method('OPTIONS'))
+        self.assertTrue(blk.supports_method('POST'))
+        self.assertFalse(blk.supports_method('PUT'))
+        self.assertFalse(blk.supports_method('DELETE'))
+        self.assertEqual(
+            blk.get_allowed_methods(), 'GET, HEAD, OPTIONS, POST')
+
     def test_override_auth(self):
         """ Optionally disable authentication """
         with patch(WebHandler.__module__ + ".WebEngine") as mock_web_engine:
@@ -71,3 +86,142 @@ class TestWebHandler(NIOBlockTestCase):
         self.assertEqual(MockHandler.call_count, 1)
         args, kwargs = MockHandler.call_args
         self.assertEqual(kwargs['headers'], {})
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    @patch(WebHandler.__module__ + ".JSONHandler")
+    def test_json_cors_headers(self, MockHandler, MockWebHandler):
+        """ The JSON block adds CORS headers and origin lists too """
+        blk = WebJSONHandler()
+        self.configure_block(blk, {
+            'cors': {
+                'allow_methods': 'GET, POST',
+                'allowed_origins': 'http://app.local, http://other.local'
+            }
+        })
+        args, kwargs = MockHandler.call_args
+        self.assertEqual(kwargs['headers'], {
+            'Access-Control-Allow-Methods': 'GET, POST',
+        })
+        self.assertTrue(kwargs['origins'].allows('http://other.local'))
+        self.assertFalse(kwargs['origins'].allows('http://evil.local'))
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_metrics(self, mock_web_engine):
+        """ Requests are counted in stats and the Prometheus metrics """
+        blk = WebHandler()
+        self.configure_block(blk, {'name': 'handler'})
+        blk.count_status(404)
+        self.assertEqual(blk.stats()['responses_4xx'], 1)
+        self.assertIn('web_handler_requests_total{block="handler"} 1',
+                      blk.metrics().splitlines())
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_trace_sample(self, mock_web_engine):
+        """ One in every N requests is logged with its timings """
+        blk = WebHandler()
+        self.configure_block(blk, {'trace_sample_rate': 2})
+        blk.logger = MagicMock()
+        for request_id in ('one', 'two', 'three'):
+            blk.record_request(request_id, {
+                'registered': 1,
+                'notified': 1.5,
+                'responded': 2,
+                'expired': False,
+            }, 2)
+        self.assertEqual(
+            [call[0][1] for call in blk.logger.info.call_args_list],
+            ['one', 'three'])
+        self.assertEqual(blk.logger.info.call_args[0][3:],
+                         ('500.00ms', '500.00ms', '1000.00ms'))
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_signal_headers(self, mock_web_engine):
+        """ Only the listed headers are put on request signals """
+        blk = WebHandler()
+        self.configure_block(blk, {})
+        self.assertIsNone(blk.get_signal_headers())
+        self.configure_block(blk, {'signal_headers': 'Content-Type, X-Id'})
+        self.assertEqual(blk.get_signal_headers(),
+                         frozenset(['content-type', 'x-id']))
+        handler = mock_web_engine.add_server.return_value.add_handler.\
+            call_args[0][0]
+        req = MagicMock()
+        req._headers = {'content-type': 'text/plain', 'Cookie': 'secret'}
+        signal = handler.build_output_signal('id', req, 'GET', False)
+        self.assertEqual(dict(signal.headers),
+                         {'content-type': 'text/plain'})
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_notifies_without_batching(self, mock_web_engine):
+        """ By default every request signal is notified on its own """
+        blk = WebHandler()
+        self.configure_block(blk, {})
+        # The notified time is set before the signals are notified
+        blk.notify_signals = MagicMock(
+            side_effect=lambda signals: self.assertIn('notified', info))
+        info = {'registered': 0}
+        blk.emit_request_signal('sig', info)
+        blk.notify_signals.assert_called_once_with(['sig'])
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_batches_request_signals(self, mock_web_engine):
+        """ Request signals are notified together when batching is on """
+        blk = WebHandler()
+        blk.notify_signals = MagicMock()
+        self.configure_block(blk, {
+            'batch_size': 2,
+            'batch_window': {'seconds': 5}
+        })
+        blk.emit_request_signal('sig1')
+        self.assertEqual(blk.notify_signals.call_count, 0)
+        blk.emit_request_signal('sig2')
+        blk.notify_signals.assert_called_once_with(['sig1', 'sig2'])
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_broker_groups(self, mock_web_engine):
+        """ Blocks get their own broker unless they share a group """
+        blk1, blk2, blk3 = WebHandler(), WebHandler(), WebHandler()
+        self.configure_block(blk1, {'id': 'blk1'})
+        self.configure_block(blk2, {'id': 'blk2'})
+        self.configure_block(blk3, {
+            'id': 'blk3',
+            'broker_group': 'blk1',
+            'max_pending_requests': 5
+        })
+        self.assertIsNot(blk1.get_broker(), blk2.get_broker())
+        self.assertIs(blk1.get_broker(), blk3.get_broker())
+        self.assertIs(blk1.get_broker(),
+                      RequestResponseBroker.get_group('blk1', 5))
+        self.assertEqual(blk1.stats()['max_requests'], 5)
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_request_id_format(self, mock_web_engine):
+        """ Counter IDs are only used when requests are authenticated """
+        blk = WebHandler()
+        self.configure_block(blk, {'request_id_format': 'counter'})
+        self.assertIsInstance(blk._id_generator, CounterGenerator)
+        self.assertNotEqual(blk.new_request_token(), blk.new_request_token())
+
+        blk = WebHandler()
+        self.configure_block(blk, {
+            'request_id_format': 'counter',
+            'auth': False
+        })
+        self.assertIsInstance(blk._id_generator, TokenGenerator)
+
+    @patch(WebHandler.__module__ + ".WebEngine")
+    def test_routes(self, mock_web_engine):
+        """ Routes are compiled once and given to the handler """
+        blk = WebHandler()
+        self.configure_block(blk, {
+            'routes': [
+                {'path': '/users/{user_id}', 'methods': 'GET, PUT'},
+                {'path': '/health'},
+            ]
+        })
+        handler = mock_web_engine.add_server.return_value.add_handler.\
+            call_args[0][0]
+        match, _ = handler._router.match('PUT', '/users/1')
+        self.assertEqual(match.params, {'user_id': '1'})
+        match, _ = handler._router.match('DELETE', '/health')
+        self.assertIsNotNone(match)
@@ -1,7 +1,12 @@
-from unittest.mock import patch
+import gzip
+import json
+from unittest.mock import MagicMock, patch
 from ..broker import RequestResponseBroker
+from ..sse import SubscriptionChannel
 from collections import defaultdict
-from ..web_output_block import WebOutput
+from ..web_output_block import WebOutput, WebJSONOutput
+from nio.modules.web.request import Request
+from nio.modules.web.response import Response
 from nio.signal.base import Signal
 from nio.testing.block_test_case import NIOBlockTestCase
 
@@ -48,3 +53,218 @@ class TestWebOutput(NIOBlockTestCase):
         with patch.object(RequestResponseBroker, 'write_response') as write:
             blk.process_signals([test_sig])
             self.assertEqual(write.call_count, 0)
+
+    def test_late_write(self):
+        """ Writes to requests that just timed out are not logged as errors """
+        broker = RequestResponseBroker('late_output_test')
+        blk = WebOutput()
+        self.configure_block(blk, {'response_out': '{{ $body }}'})
+        req_id = broker.request_id('token')
+        broker.register_request(req_id, Request(), MagicMock(), 5)
+        broker._expire(req_id)
+        blk.logger = MagicMock()
+        blk.process_signals([Signal({'id': req_id, 'body': 'late'})])
+        self.assertEqual(blk.logger.exception.call_count, 0)
+        self.assertEqual(broker.stats()['late_writes'], 1)
+
+    def test_routes_to_request_broker(self):
+        """ Responses are written to the broker the request came through """
+        broker = RequestResponseBroker('output_test')
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_out': '{{ $body }}',
+        })
+        req_id = broker.request_id('token')
+        with patch.object(broker, 'write_response') as write:
+            blk.process_signals([Signal({'id': req_id, 'body': 'body'})])
+            write.assert_called_once_with(
+                req_id, body='body', headers={}, status=200)
+
+    def test_static_headers_evaluated_once(self):
+        """ Headers without expressions are built once and reused """
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_headers': [{
+                'header_name': 'Cache-Control',
+                'header_val': 'no-cache'
+            }]
+        })
+        first = blk.build_headers(Signal({'a': 1}))
+        self.assertDictEqual(dict(first), {'Cache-Control': 'no-cache'})
+        self.assertIs(blk.build_headers(Signal({'a': 2})), first)
+        with self.assertRaises(TypeError):
+            first['Cache-Control'] = 'changed'
+
+    def test_static_and_dynamic_headers(self):
+        """ Only headers with expressions are evaluated per signal """
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_headers': [{
+                'header_name': 'Cache-Control',
+                'header_val': 'no-cache'
+            }, {
+                'header_name': 'X-Request',
+                'header_val': '{{ $id }}'
+            }]
+        })
+        self.assertEqual(len(blk._dynamic_headers), 1)
+        self.assertDictEqual(blk.build_headers(Signal({'id': 'one'})), {
+            'Cache-Control': 'no-cache',
+            'X-Request': 'one'
+        })
+        self.assertDictEqual(blk.build_headers(Signal({'id': 'two'})), {
+            'Cache-Control': 'no-cache',
+            'X-Request': 'two'
+        })
+
+    def test_json_content_type(self):
+        """ The JSON block defaults Content-Type unless it is configured """
+        blk = WebJSONOutput()
+        self.configure_block(blk, {})
+        self.assertDictEqual(dict(blk.build_headers(Signal())), {
+            'Content-Type': 'application/json'
+        })
+        blk = WebJSONOutput()
+        self.configure_block(blk, {
+            'response_headers': [{
+                'header_name': 'Content-Type',
+                'header_val': '{{ $type }}'
+            }]
+        })
+        self.assertDictEqual(blk.build_headers(Signal({'type': 'text/csv'})), {
+            'Content-Type': 'text/csv'
+        })
+
+    def test_json_body(self):
+        """ The JSON block encodes the non-hidden signal attributes """
+        blk = WebJSONOutput()
+        self.configure_block(blk, {'json_codec': 'stdlib'})
+        body = blk.build_body(Signal({'_id': 'id', 'key': 'value'}))
+        self.assertIsInstance(body, bytes)
+        self.assertDictEqual(json.loads(body.decode()), {'key': 'value'})
+        # Bodies that are already encoded are left alone
+        blk = WebJSONOutput()
+        self.configure_block(blk, {'response_out': '{{ $text }}'})
+        self.assertEqual(blk.build_body(Signal({'text': '[1]'})), '[1]')
+
+    def test_serialize_signal(self):
+        """ The JSON block can encode signals without evaluating the body """
+        blk = WebJSONOutput()
+        self.configure_block(blk, {
+            'serialize_signal': True,
+            'response_out': '{{ $not_used }}'
+        })
+        signal = Signal({
+            'key': 'value',
+            'nested': {'list': [1, 2]},
+            '_id': 'id',
+            '_method': 'POST',
+            '_params': {},
+            '_headers': {},
+        })
+        self.assertDictEqual(json.loads(blk.build_body(signal).decode()), {
+            'key': 'value',
+            'nested': {'list': [1, 2]},
+        })
+
+    def test_chunked(self):
+        """ Chunked responses are written chunk by chunk """
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_out': '{{ $body }}',
+            'chunked': True,
+            'last_chunk': '{{ $last }}'
+        })
+        with patch.object(RequestResponseBroker, 'write_chunk') as write:
+            blk.process_signals([
+                Signal({'id': 'fakeid', 'body': 'one', 'last': False}),
+                Signal({'id': 'fakeid', 'body': 'two', 'last': True}),
+            ])
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(write.call_args_list[0][0], ('fakeid', 'one'))
+        self.assertFalse(write.call_args_list[0][1]['final'])
+        self.assertTrue(write.call_args_list[1][1]['final'])
+
+    def test_publish_channel(self):
+        """ Signals can be published to subscribers instead of responded to """
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_out': '{{ $body }}',
+            'publish_channel': 'test_publish_channel',
+        })
+        channel = SubscriptionChannel.get_channel('test_publish_channel')
+        events = iter(channel.subscribe())
+        next(events)
+        with patch.object(RequestResponseBroker, 'write_response') as write:
+            blk.process_signals([Signal({'body': 'update'})])
+        self.assertEqual(write.call_count, 0)
+        self.assertEqual(next(events), b'data: update\n\n')
+
+    def test_etag(self):
+        """ ETags are added to the response headers """
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_out': '{{ $body }}',
+            'etag': 'hash',
+        })
+        with patch.object(RequestResponseBroker, 'write_response') as write:
+            blk.process_signals([
+                Signal({'id': 'fakeid', 'body': 'body'}),
+                Signal({'id': 'fakeid', 'body': 'body'}),
+                Signal({'id': 'fakeid', 'body': 'other'}),
+            ])
+        etags = [call[1]['headers']['ETag'] for call in write.call_args_list]
+        self.assertEqual(etags[0], etags[1])
+        self.assertNotEqual(etags[0], etags[2])
+
+        self.configure_block(blk, {
+            'response_out': '{{ $body }}',
+            'etag': 'expression',
+            'etag_value': '{{ $version }}',
+        })
+        with patch.object(RequestResponseBroker, 'write_response') as write:
+            blk.process_signals([
+                Signal({'id': 'fakeid', 'body': 'body', 'version': 3})])
+        self.assertEqual(write.call_args[1]['headers'], {'ETag': '"3"'})
+
+    def test_compression(self):
+        """ Bodies are compressed with an encoding the request accepts """
+        blk = WebOutput()
+        self.configure_block(blk, {
+            'response_out': '{{ $body }}',
+            'compression': {'enabled': True, 'min_size': 10},
+        })
+        broker = RequestResponseBroker('compression_test')
+        req_id = broker.request_id('token')
+        req = Request()
+        req._headers = {'Accept-Encoding': 'gzip'}
+        broker.register_request(req_id, req, Response(), 5)
+        with patch.object(broker, 'write_response') as write:
+            blk.process_signals([Signal({'id': req_id, 'body': 'x' * 100})])
+        self.assertEqual(
+            gzip.decompress(write.call_args[1]['body']), b'x' * 100)
+        self.assertEqual(
+            write.call_args[1]['headers']['Content-Encoding'], 'gzip')
+
+    def test_aggregate(self):
+        """ One response is written once every part has been handled """
+        blk = WebJSONOutput()
+        self.configure_block(blk, {
+            'aggregate': True,
+            'final_part': '{{ $last }}',
+        })
+        broker = RequestResponseBroker('aggregate_test')
+        req_id = broker.request_id('token')
+        broker.register_request(req_id, Request(), Response(), 5)
+        broker.expect_parts(req_id, 3)
+        with patch.object(broker, 'write_response') as write:
+            blk.process_signals([
+                Signal({'_id': req_id, 'key': 1, 'last': False}),
+                Signal({'_id': req_id, 'key': 2, 'last': False}),
+            ])
+            self.assertEqual(write.call_count, 0)
+            blk.process_signals([
+                Signal({'_id': req_id, 'key': 3, 'last': True})])
+        self.assertEqual(
+            [part['key'] for part in json.loads(write.call_args[1]['body'])],
+            [1, 2, 3])
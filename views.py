@@ -0,0 +1,44 @@
+class ReadOnlyDict(dict):
+
+    """ A dict that can't be changed, for data shared between signals
+
+    It is a real dict, so expressions and JSON encoders treat it like any
+    other. Copies and pickles of it are plain dicts, so signals can still be
+    persisted or sent to other nodes.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("{} is read-only".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def copy(self):
+        return dict(self)
+
+
+def select_headers(headers, names=None):
+    """ The request headers to put on a signal
+
+    The headers are copied when the signal is built, so that blocks can't
+    change the headers the broker reads when writing the response, and so
+    that the signal does not hold on to headers that were left out.
+
+    Args:
+        headers (dict): The headers of the request
+        names (frozenset): The lower case names of the headers to keep,
+            None to keep every header
+
+    Returns:
+        headers (ReadOnlyDict): The headers that are kept
+    """
+    if names is None:
+        return ReadOnlyDict(headers or {})
+    return ReadOnlyDict(
+        (name, value) for name, value in (headers or {}).items()
+        if name.lower() in names)
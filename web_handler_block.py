@@ -1,10 +1,25 @@
+from itertools import count
+from time import monotonic
+
+from .admission import AdmissionController
+from .batcher import SignalBatcher
+from .broker import RequestResponseBroker
+from .cache import ResponseCache
+from .codec import JSONCodecType, get_codec
+from .cors import OriginList
 from .handler import Handler, JSONHandler
+from .headers import split_names
+from .metrics import RequestMetrics, format_ms
+from .request_ids import RequestIdFormat, get_generator
+from .routes import Route, Router
+from .sse import SlowClientPolicy, SubscriptionChannel
 
 from nio import GeneratorBlock
+from nio.command import command
 from nio.modules.web import WebEngine
 from nio.properties import StringProperty, IntProperty, VersionProperty, \
                            ObjectProperty, TimeDeltaProperty, BoolProperty, \
-                           PropertyHolder
+                           PropertyHolder, SelectProperty, ListProperty
 
 
 class CORS(PropertyHolder):
@@ -32,14 +47,94 @@ class CORS(PropertyHolder):
         title='Access-Control-Allow-Headers',
         default=None,
         allow_none=True)
+    allowed_origins = StringProperty(
+        title='Allowed Origins',
+        default=None,
+        allow_none=True)
+    allowed_origin_pattern = StringProperty(
+        title='Allowed Origin Pattern',
+        default=None,
+        allow_none=True)
+
+
+class AdmissionControl(PropertyHolder):
+    max_in_flight = IntProperty(
+        title='Max In-Flight Requests',
+        default=0)
+    queue_depth = IntProperty(
+        title='Queue Depth',
+        default=0)
+    queue_timeout = TimeDeltaProperty(
+        title='Queue Timeout',
+        default={'seconds': 1})
+    retry_after = IntProperty(
+        title='Retry-After (seconds)',
+        default=1)
+
+
+class Subscriptions(PropertyHolder):
+    enabled = BoolProperty(
+        title='Enable Subscriptions',
+        default=False)
+    channel = StringProperty(
+        title='Channel',
+        default='default')
+    buffer_size = IntProperty(
+        title='Buffered Events per Client',
+        default=100)
+    slow_clients = SelectProperty(
+        SlowClientPolicy,
+        title='Slow Clients',
+        default=SlowClientPolicy.drop)
+    keepalive = TimeDeltaProperty(
+        title='Keepalive Interval',
+        default={'seconds': 15})
+    max_subscribers = IntProperty(
+        title='Max Subscribers',
+        default=1000)
+
+
+class HandlerRoute(PropertyHolder):
+    path = StringProperty(
+        title='Path',
+        default='')
+    methods = StringProperty(
+        title='Methods',
+        default='',
+        allow_none=True)
 
 
+class ResponseCaching(PropertyHolder):
+    max_entries = IntProperty(
+        title='Max Cached Responses',
+        default=0)
+    ttl = TimeDeltaProperty(
+        title='Time to Live',
+        default={'seconds': 5})
+    key_params = StringProperty(
+        title='Params in Cache Key',
+        default='',
+        allow_none=True)
+    key_headers = StringProperty(
+        title='Headers in Cache Key',
+        default='',
+        allow_none=True)
+
+
+@command('metrics')
+@command('stats')
 class WebHandler(GeneratorBlock):
 
-    version = VersionProperty("1.2.1")
+    # The methods the REST Handler answers
+    handled_methods = ('DELETE', 'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT')
+
+    version = VersionProperty("1.16.0")
     host = StringProperty(title='Host', default='0.0.0.0', visible=False)
     port = IntProperty(title='Port', default=8182)
     endpoint = StringProperty(title='Endpoint', default='')
+    routes = ListProperty(HandlerRoute, title='Routes', default=[])
+    allowed_methods = StringProperty(title='Allowed Methods', default='',
+                                     allow_none=True, advanced=True)
     auth = BoolProperty(title='Require Authentication', default=True)
     request_timeout = TimeDeltaProperty(title='Max Request Timeout',
                                         default={'days': 0,
@@ -58,6 +153,41 @@ class WebHandler(GeneratorBlock):
                           title="Access-Control Headers",
                           default=CORS(),
                           advanced=True)
+    max_body_size = IntProperty(title='Max Request Body Size (bytes)',
+                                default=0, advanced=True)
+    stream_body = BoolProperty(title='Stream Request Body', default=False,
+                               advanced=True)
+    admission = ObjectProperty(AdmissionControl,
+                               title='Admission Control',
+                               default=AdmissionControl(),
+                               advanced=True)
+    request_id_format = SelectProperty(RequestIdFormat,
+                                       title='Request ID Format',
+                                       default=RequestIdFormat.uuid,
+                                       advanced=True)
+    broker_group = StringProperty(title='Broker Group', default='',
+                                  allow_none=True, advanced=True)
+    max_pending_requests = IntProperty(title='Max Pending Requests',
+                                       default=0, advanced=True)
+    batch_size = IntProperty(title='Max Batch Size', default=1, advanced=True)
+    batch_window = TimeDeltaProperty(title='Batch Window',
+                                     default={'milliseconds': 10},
+                                     advanced=True)
+    timeout_header = StringProperty(title='Request Timeout Header',
+                                    default='X-Request-Timeout',
+                                    allow_none=True, advanced=True)
+    signal_headers = StringProperty(title='Signal Headers', default='',
+                                    allow_none=True, advanced=True)
+    trace_sample_rate = IntProperty(title='Trace 1 in N Requests', default=0,
+                                    advanced=True)
+    subscriptions = ObjectProperty(Subscriptions,
+                                   title='Event Stream Subscriptions',
+                                   default=Subscriptions(),
+                                   advanced=True)
+    response_cache = ObjectProperty(ResponseCaching,
+                                    title='GET Response Cache',
+                                    default=ResponseCaching(),
+                                    advanced=True)
 
     def configure(self, context):
         super().configure(context)
@@ -71,10 +201,73 @@ class WebHandler(GeneratorBlock):
         if not self.auth():
             Handler.before_handler = self._no_auth
 
+        # Anyone can make requests without authentication, so request IDs
+        # must not be guessable from one another
+        self._id_generator = get_generator(
+            self.request_id_format(), allow_guessable=self.auth())
+
+        # Without a group name each block gets a broker of its own
+        self._broker = RequestResponseBroker.get_group(
+            self.broker_group() or self.id(), self.max_pending_requests())
+
+        self._admission = AdmissionController(
+            self.admission().max_in_flight(),
+            self.admission().queue_depth(),
+            self.admission().queue_timeout().total_seconds())
+
+        if self.batch_size() > 1:
+            self._batcher = SignalBatcher(
+                self.notify_signals, self.batch_size(), self.batch_window())
+
+        if self.subscriptions().enabled():
+            self._channel = SubscriptionChannel.get_channel(
+                self.subscriptions().channel())
+
+        if self.response_cache().max_entries() > 0:
+            self._cache = ResponseCache(
+                self.response_cache().max_entries(),
+                self.response_cache().ttl().total_seconds(),
+                split_names(self.response_cache().key_params()),
+                split_names(self.response_cache().key_headers()))
+
+        self._trace_rate = max(0, self.trace_sample_rate())
+        signal_headers = split_names(self.signal_headers())
+        self._signal_headers = frozenset(
+            name.lower() for name in signal_headers) \
+            if signal_headers else None
+        allowed_methods = split_names(self.allowed_methods())
+        if allowed_methods:
+            allowed_methods = set(
+                method.upper() for method in allowed_methods)
+            if 'GET' in allowed_methods:
+                # HEAD requests are answered the way GET requests would be
+                allowed_methods.add('HEAD')
+            # OPTIONS requests are always answered, for CORS preflights
+            allowed_methods.add('OPTIONS')
+            self._allowed_methods = frozenset(allowed_methods)
+            self._allow_header = ', '.join(sorted(allowed_methods))
+
+        if self.routes():
+            self._router = Router([
+                Route(route.path(), split_names(route.methods()))
+                for route in self.routes()])
+
         self._server = WebEngine.add_server(self.port(), self.host(), config)
         self._server.add_handler(self.get_handler())
 
     def get_handler(self):
+        return Handler(self.endpoint(), blk=self,
+                       headers=self.get_cors_headers(),
+                       router=self._router,
+                       origins=self.get_cors_origins())
+
+    def get_cors_origins(self):
+        """ The origins allowed to make requests, None to allow any """
+        origins = OriginList(split_names(self.cors().allowed_origins()),
+                             self.cors().allowed_origin_pattern())
+        return origins or None
+
+    def get_cors_headers(self):
         allow_origin = self.cors().allow_origin()
         allow_credentials = self.cors().allow_credentials()
         max_age = self.cors().max_age()
@@ -102,11 +295,24 @@ class WebHandler(GeneratorBlock):
         if allow_headers:
             headers["Access-Control-Allow-Headers"] = allow_headers
 
-        return Handler(self.endpoint(), blk=self, headers=headers)
+        return headers
 
     def __init__(self):
         super().__init__()
         self._server = None
+        self._batcher = None
+        self._broker = None
+        self._admission = None
+        self._id_generator = None
+        self._channel = None
+        self._cache = None
+        self._router = None
+        self._allowed_methods = None
+        self._allow_header = ', '.join(self.handled_methods)
+        self._metrics = RequestMetrics()
+        self._trace_rate = 0
+        self._signal_headers = None
+        self._traced = count()
 
     def start(self):
         super().start()
@@ -115,15 +321,122 @@ class WebHandler(GeneratorBlock):
 
     def stop(self):
         self._server.stop()
+        if self._batcher:
+            self._batcher.flush()
         super().stop()
 
+    def emit_request_signal(self, signal, request_info=None):
+        """ Notify a request signal, batching it with others if enabled
+
+        The time the signal is notified is set as the `notified` of
+        request_info, before notifying since a response may be written
+        before notify_signals returns.
+        """
+        if self._batcher:
+            self._batcher.add(signal, request_info)
+        else:
+            self.emit_request_signals([signal], request_info)
+
+    def emit_request_signals(self, signals, request_info=None):
+        """ Notify the signals for one request, all in the same list """
+        if self._batcher:
+            # Don't split the request's signals between batches
+            self._batcher.flush()
+        if request_info is not None:
+            request_info['notified'] = monotonic()
+        self.notify_signals(signals)
+
+    def accepts_subscriptions(self):
+        """ Whether GET requests may subscribe to an event stream """
+        return self._channel is not None
+
+    def subscribe(self):
+        """ Add a subscriber to the block's channel for the REST Handler """
+        return self._channel.subscribe(
+            self.subscriptions().buffer_size(),
+            self.subscriptions().slow_clients(),
+            self.subscriptions().keepalive().total_seconds(),
+            self.subscriptions().max_subscribers())
+
+    def get_signal_headers(self):
+        """ The lower case names of the headers to put on request signals,
+        None for all of them """
+        return self._signal_headers
+
+    def get_response_cache(self):
+        """ The cache the REST Handler answers GET requests from, if any """
+        return self._cache
+
+    def record_request(self, request_id, request_info, now):
+        """ Record the latencies and status of a request the REST Handler
+        waited on, logging them for a sample of the requests """
+        timings = self._metrics.record(request_info, now)
+        if self._trace_rate and next(self._traced) % self._trace_rate == 0:
+            queue, service, total, status = timings
+            self.logger.info(
+                "Trace of request %s: status %s, queue %s, service %s, "
+                "total %s", request_id, status, format_ms(queue),
+                format_ms(service), format_ms(total))
+
+    def count_status(self, status):
+        """ Count a response the REST Handler wrote without waiting """
+        self._metrics.count_status(status)
+
+    def get_broker(self):
+        """ The broker the REST Handler registers requests with """
+        return self._broker
+
+    def new_request_token(self):
+        """ A unique token for the REST Handler to build a request ID from """
+        return self._id_generator()
+
+    def get_max_body_size(self):
+        """ The most bytes the REST Handler accepts in a body, 0 for any """
+        return self.max_body_size()
+
+    def streams_body(self):
+        """ Whether request bodies go on signals as spooled files """
+        return self.stream_body()
+
+    def get_admission(self):
+        """ The REST Handler must be admitted here to work on a request """
+        return self._admission
+
+    def get_retry_after(self):
+        """ Seconds after which clients of a shed request should retry """
+        return self.admission().retry_after()
+
+    def stats(self):
+        """ Counts of the requests that went through this block """
+        stats = self._broker.stats()
+        stats.update(self._admission.stats())
+        if self._channel:
+            stats.update(self._channel.stats())
+        if self._cache:
+            stats.update(self._cache.stats())
+        stats.update(self._metrics.stats())
+        return stats
+
+    def metrics(self):
+        """ Request latencies and counts in the Prometheus text format """
+        return self._metrics.prometheus(labels={'block': self.name()})
+
     def get_timeout_seconds(self):
         """ The REST Handler will use this to determine how long to wait """
         return self.request_timeout().total_seconds()
 
+    def get_timeout_header(self):
+        """ The header clients may ask for a shorter timeout with """
+        return self.timeout_header()
+
     def supports_method(self, method):
         """ Returns True if the block should support the given HTTP method """
-        return True
+        return self._allowed_methods is None or \
+            method in self._allowed_methods
+
+    def get_allowed_methods(self):
+        """ The value of the Allow header for the REST Handler """
+        return self._allow_header
 
     def _no_auth(self, request, response):
         """ Override before_handler so that authentication is not required """
@@ -132,7 +445,28 @@ class WebHandler(GeneratorBlock):
 
 class WebJSONHandler(WebHandler):
 
-    version = VersionProperty("1.2.1")
+    version = VersionProperty("1.20.0")
+    json_codec = SelectProperty(JSONCodecType,
+                                title='JSON Codec',
+                                default=JSONCodecType.stdlib,
+                                advanced=True)
+    max_decompressed_size = IntProperty(
+        title='Max Decompressed Body Size (bytes)',
+        default=16 * 1024 * 1024, advanced=True)
+    bulk = BoolProperty(title='Bulk Requests', default=False, advanced=True)
 
     def get_handler(self):
-        return JSONHandler(self.endpoint(), self)
+        codec = get_codec(self.json_codec())
+        self.logger.debug("Decoding JSON with %s", codec.name)
+        return JSONHandler(self.endpoint(), self,
+                           headers=self.get_cors_headers(), codec=codec,
+                           router=self._router,
+                           origins=self.get_cors_origins())
+
+    def get_max_decompressed_size(self):
+        """ The most bytes a compressed body may decompress to, 0 for any """
+        return self.max_decompressed_size()
+
+    def accepts_bulk(self):
+        """ Whether a body may hold many records, a signal for each """
+        return self.bulk()
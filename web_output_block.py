@@ -1,10 +1,17 @@
-import json
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 
 from nio import TerminatorBlock
 from nio.properties import VersionProperty, Property, \
-    PropertyHolder, ListProperty, IntProperty
+    PropertyHolder, ListProperty, IntProperty, SelectProperty, BoolProperty, \
+    StringProperty, ObjectProperty
 
-from .broker import RequestResponseBroker
+from .broker import RequestExpiredError, RequestResponseBroker
+from .codec import JSONCodecType, get_codec
+from .compression import Compressor
+from .etag import ETagSource, hash_etag, quote_etag
+from .headers import get_header, split_names
+from .sse import SubscriptionChannel
 
 
 class ResponseHeader(PropertyHolder):
@@ -12,18 +19,99 @@ class ResponseHeader(PropertyHolder):
     header_val = Property(title='Value', default='application/json')
 
 
+class Compression(PropertyHolder):
+    enabled = BoolProperty(title='Compress Responses', default=False)
+    encodings = StringProperty(title='Encodings', default='br, gzip, deflate',
+                               allow_none=True)
+    min_size = IntProperty(title='Minimum Size (bytes)', default=1024)
+    level = IntProperty(title='Compression Level', default=6)
+    workers = IntProperty(title='Worker Threads', default=0)
+
+
+def is_static(prop_value):
+    """ Whether a configured property value contains no expression """
+    # Anything we can't inspect is treated as dynamic to be safe
+    value = getattr(prop_value, 'value', '{{')
+    return not (isinstance(value, str) and '{{' in value)
+
+
 class WebOutput(TerminatorBlock):
 
-    version = VersionProperty("1.0.1")
+    version = VersionProperty("1.6.0")
     id_val = Property(title='Request ID', default='{{ $id }}')
     response_out = Property(title='Response Body', default='')
     response_status = IntProperty(
         title='Response Status', default=200)
     response_headers = ListProperty(ResponseHeader, title='Response Headers',
                                     default=[])
+    chunked = BoolProperty(title='Chunked Response', default=False,
+                           advanced=True)
+    last_chunk = BoolProperty(title='Last Chunk', default=True,
+                              advanced=True)
+    publish_channel = StringProperty(title='Publish to Channel', default='',
+                                     allow_none=True, advanced=True)
+    etag = SelectProperty(ETagSource, title='ETag', default=ETagSource.none,
+                          advanced=True)
+    etag_value = Property(title='ETag Value', default='', allow_none=True,
+                          advanced=True)
+    aggregate = BoolProperty(title='Aggregate Responses', default=False,
+                             advanced=True)
+    final_part = BoolProperty(title='Final Part', default=False,
+                              advanced=True)
+    compression = ObjectProperty(Compression,
+                                 title='Response Compression',
+                                 default=Compression(),
+                                 advanced=True)
+
+    # Headers to include unless the block is configured to set them itself
+    default_headers = {}
+
+    def __init__(self):
+        super().__init__()
+        self._static_headers = MappingProxyType({})
+        self._dynamic_headers = []
+        self._chunked = False
+        self._channel = None
+        self._etag = ETagSource.none
+        self._compressor = None
+        self._pool = None
+        self._aggregate = False
+
+    def configure(self, context):
+        """ Evaluate headers without expressions in them once, up front """
+        super().configure(context)
+        self._chunked = self.chunked()
+        self._etag = self.etag()
+        self._aggregate = self.aggregate()
+        if self.compression().enabled():
+            self._compressor = Compressor(
+                split_names(self.compression().encodings()),
+                self.compression().min_size(),
+                self.compression().level())
+            if self.compression().workers() > 0:
+                self._pool = ThreadPoolExecutor(self.compression().workers())
+        if self.publish_channel():
+            self._channel = SubscriptionChannel.get_channel(
+                self.publish_channel())
+        static_headers = dict(self.default_headers)
+        self._dynamic_headers = []
+        for header in self.response_headers():
+            if is_static(header.header_name) and is_static(header.header_val):
+                static_headers[header.header_name()] = header.header_val()
+            else:
+                self._dynamic_headers.append(header)
+        self._static_headers = MappingProxyType(static_headers)
+
+    def stop(self):
+        if self._pool:
+            self._pool.shutdown()
+        super().stop()
 
     def process_signals(self, signals, input_id='default'):
         for sig in signals:
+            if self._channel:
+                self.publish_event(sig)
+                continue
             try:
                 req_id = self.id_val(sig)
                 rsp_body = self.build_body(sig)
@@ -34,21 +122,83 @@ class WebOutput(TerminatorBlock):
                 continue
 
             try:
-                self.put_response(req_id, rsp_body, rsp_headers, rsp_status)
+                if self._chunked:
+                    self.put_chunk(req_id, rsp_body, rsp_headers, rsp_status,
+                                   self.last_chunk(sig))
+                    continue
+                if self._aggregate:
+                    parts = self.put_part(
+                        req_id, rsp_body, self.final_part(sig))
+                    if parts is None:
+                        # Wait for the rest of the parts of the response
+                        continue
+                    rsp_body = self.build_aggregate_body(parts)
+                rsp_headers = self.add_etag(sig, rsp_body, rsp_headers)
+                if self._pool:
+                    # Compress on a worker so a large body does not hold up
+                    # the responses to the rest of the signals
+                    self._pool.submit(self._put_response_logged, req_id,
+                                      rsp_body, rsp_headers, rsp_status)
+                else:
+                    self.put_response(
+                        req_id, rsp_body, rsp_headers, rsp_status)
+            except RequestExpiredError as e:
+                self.logger.debug("Not writing response: %s", e)
             except:
                 self.logger.exception("Unable to write response")
 
+    def _put_response_logged(self, req_id, body, headers, status):
+        try:
+            self.put_response(req_id, body, headers, status)
+        except RequestExpiredError as e:
+            self.logger.debug("Not writing response: %s", e)
+        except:
+            self.logger.exception("Unable to write response")
+
     def build_headers(self, signal):
-        """ Determine the headers of the response given an input signal """
-        return {
-            header.header_name(signal): header.header_val(signal)
-            for header in self.response_headers()
-        }
+        """ Determine the headers of the response given an input signal
+
+        The returned mapping may be shared between responses, it must not be
+        modified.
+        """
+        if not self._dynamic_headers:
+            return self._static_headers
+        headers = dict(self._static_headers)
+        for header in self._dynamic_headers:
+            headers[header.header_name(signal)] = header.header_val(signal)
+        return headers
 
     def build_body(self, signal):
         """ Determine the body of the response given an input signal """
         return self.response_out(signal)
 
+    def publish_event(self, signal):
+        """ Send the body for a signal to every subscriber of the channel """
+        try:
+            self._channel.publish(self.build_body(signal))
+        except:
+            self.logger.exception("Unable to publish event")
+
+    def build_aggregate_body(self, parts):
+        """ Join the bodies of each part into one, a line for each part """
+        return b'\n'.join(
+            part.encode() if isinstance(part, str) else part
+            for part in parts if part is not None)
+
+    def add_etag(self, signal, body, headers):
+        """ Add the ETag of a response to its headers, if it has one """
+        etag = self.build_etag(signal, body)
+        return dict(headers, ETag=etag) if etag else headers
+
+    def build_etag(self, signal, body):
+        """ Determine the ETag of the response, None for no ETag """
+        if self._etag is ETagSource.hash:
+            return hash_etag(body)
+        if self._etag is ETagSource.expression:
+            value = self.etag_value(signal)
+            return quote_etag(value) if value else None
+        return None
+
     def put_response(self, req_id, body, headers, status):
         """ For a given request ID, write a response.
 
@@ -61,11 +211,60 @@ class WebOutput(TerminatorBlock):
         Returns:
             None
         """
-        self.logger.debug(
-            "Writing response for request ID {}".format(req_id))
-        RequestResponseBroker.write_response(
+        self.logger.debug("Writing response for request ID %s", req_id)
+        broker = RequestResponseBroker.for_request(req_id)
+        if self._compressor:
+            body, headers = self.compress_body(broker, req_id, body, headers)
+        broker.write_response(
             req_id, body=body, headers=headers, status=status)
 
+    def compress_body(self, broker, req_id, body, headers):
+        """ Compress a response body if the request accepts it
+
+        Returns:
+            (body, headers): The body and headers to write
+        """
+        req = broker.get_request_info(req_id)['req']
+        accept_encoding = get_header(
+            getattr(req, '_headers', None), 'Accept-Encoding')
+        return self._compressor.encode(body, headers, accept_encoding)
+
+    def put_part(self, req_id, body, final):
+        """ For a given request ID, add a part of an aggregated response.
+
+        Args:
+            req_id: A request ID - should be taken from the WebHandler block
+            body: The body built for this part of the response
+            final (bool): True if this part ends the response even if not
+                every expected part has been added
+
+        Returns:
+            parts (list): The bodies of every part once the response is
+                complete and should be written, otherwise None
+        """
+        self.logger.debug("Adding response part for request ID %s", req_id)
+        return RequestResponseBroker.for_request(req_id).add_part(
+            req_id, body, final)
+
+    def put_chunk(self, req_id, body, headers, status, final):
+        """ For a given request ID, write the next chunk of a response.
+
+        Args:
+            req_id: A request ID - should be taken from the WebHandler block
+            body: The chunk of the response body to send
+            headers (dict): The response headers, sent with the first chunk
+            status (int): The HTTP response status code, sent with the first
+                chunk
+            final (bool): True if this chunk ends the response
+
+        Returns:
+            None
+        """
+        self.logger.debug(
+            "Writing response chunk for request ID %s", req_id)
+        RequestResponseBroker.for_request(req_id).write_chunk(
+            req_id, body, final=final, headers=headers, status=status)
+
 
 class WebJSONOutput(WebOutput):
 
@@ -80,19 +279,45 @@ class WebJSONOutput(WebOutput):
     id_val = Property(title='Request ID', default='{{ $_id }}')
     response_out = Property(
         title='Response Body',
-        default='{{ json.dumps($to_dict(), default=str) }}')
-    version = VersionProperty("1.0.1")
+        default='{{ $to_dict() }}')
+    serialize_signal = BoolProperty(title='Serialize Signal',
+                                    default=False)
+    json_codec = SelectProperty(JSONCodecType,
+                                title='JSON Codec',
+                                default=JSONCodecType.stdlib,
+                                advanced=True)
+    version = VersionProperty("1.8.0")
+
+    default_headers = {'Content-Type': 'application/json'}
+
+    def __init__(self):
+        super().__init__()
+        self._codec = None
+        self._serialize_signal = False
+
+    def configure(self, context):
+        super().configure(context)
+        self._codec = get_codec(self.json_codec())
+        self.logger.debug("Encoding JSON with %s", self._codec.name)
+        self._serialize_signal = self.serialize_signal()
+
+    def build_aggregate_body(self, parts):
+        """ Join the JSON of each part into a JSON array
+
+        The parts are already encoded, so they are joined without decoding
+        and encoding them again.
+        """
+        return b'[' + b','.join(
+            part.encode() if isinstance(part, str) else part
+            for part in parts if part) + b']'
 
     def build_body(self, signal):
+        """ Encode the body to JSON bytes unless it is already encoded """
+        if self._serialize_signal:
+            # Skip the expression engine, hidden attributes such as the
+            # request info from WebJSONHandler are left out
+            return self._codec.dumps(signal.to_dict())
         resp_obj = self.response_out(signal)
-        if not isinstance(resp_obj, str):
-            resp_obj = json.dumps(resp_obj)
+        if not isinstance(resp_obj, (str, bytes)):
+            resp_obj = self._codec.dumps(resp_obj)
         return resp_obj
-
-    def build_headers(self, signal):
-        """ Determine the headers of the response given an input signal """
-        configured_headers = super().build_headers(signal)
-        if 'Content-Type' not in configured_headers:
-            configured_headers['Content-Type'] = 'application/json'
-
-        return configured_headers